@@ -0,0 +1,97 @@
+"""
+Shared setup for the benchmark scripts: a throwaway SQLite database with
+seeded sites and a logged-in session cookie.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+if str(PROJECT_DIR) not in sys.path:
+    sys.path.insert(0, str(PROJECT_DIR))
+
+
+def setup_django(db_path=None):
+    """
+    Configure Django against a fresh SQLite file and run migrations.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rockartdb.settings")
+    from django.conf import settings
+
+    if db_path is None:
+        db_path = Path(tempfile.mkdtemp(prefix="rockart-bench-")) / "bench.sqlite3"
+    settings.DATABASES["default"]["NAME"] = str(db_path)
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ["*"]
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+    return db_path
+
+
+def seed_sites(count, panels_per_site=0):
+    from rockart.models import Panel, Site
+
+    sites = Site.objects.bulk_create(
+        Site(
+            site_number=f"BENCH-{i:06d}",
+            project_name=f"Project {i % 10}",
+            project_description="Recorded during the benchmark run. " * 4,
+            recorders="Bench",
+        )
+        for i in range(count)
+    )
+    Panel.objects.bulk_create(
+        Panel(site=site, panel_number=n, height_m=1.5, width_m=2.0, area_m2=3.0)
+        for site in sites
+        for n in range(1, panels_per_site + 1)
+    )
+    return sites
+
+
+def session_cookie(username="bench", staff=True):
+    """
+    Create a user and return a Cookie header value for a logged-in session.
+    """
+    from django.conf import settings
+    from django.contrib.auth import (
+        BACKEND_SESSION_KEY,
+        HASH_SESSION_KEY,
+        SESSION_KEY,
+        get_user_model,
+    )
+    from django.contrib.sessions.backends.db import SessionStore
+
+    User = get_user_model()
+    user, _ = User.objects.get_or_create(
+        username=username, defaults={"is_staff": staff}
+    )
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return f"{settings.SESSION_COOKIE_NAME}={session.session_key}"
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
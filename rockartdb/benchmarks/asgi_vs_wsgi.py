@@ -0,0 +1,155 @@
+"""
+Compare the sync DRF read endpoints under WSGI with the same endpoints and
+the native async ones under ASGI, at high concurrency.
+
+The servers are driven in process (a thread pool calling the WSGI callable,
+an event loop calling the ASGI callable), so the numbers measure the
+framework and ORM path rather than a particular web server.
+
+    python benchmarks/asgi_vs_wsgi.py --requests 2000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _setup import percentile, seed_sites, session_cookie, setup_django
+
+
+def wsgi_run(app, path, cookie, total, concurrency):
+    def one():
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": path,
+            "QUERY_STRING": "",
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "HTTP_HOST": "localhost",
+            "HTTP_COOKIE": cookie,
+            "wsgi.input": io.BytesIO(),
+            "wsgi.errors": io.StringIO(),
+            "wsgi.url_scheme": "http",
+            "wsgi.version": (1, 0),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        statuses = []
+        start = time.perf_counter()
+        body = app(environ, lambda status, headers: statuses.append(status))
+        b"".join(body)
+        body.close()
+        assert statuses[0].startswith("200"), statuses[0]
+        return time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(lambda _: one(), range(total)))
+    return latencies, time.perf_counter() - started
+
+
+def asgi_run(app, path, cookie, total, concurrency):
+    async def one():
+        sent_body = False
+        statuses = []
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await asyncio.Future()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"host", b"localhost"), (b"cookie", cookie.encode())],
+            "client": ("127.0.0.1", 50000),
+            "server": ("localhost", 80),
+        }
+        start = time.perf_counter()
+        await app(scope, receive, send)
+        assert statuses[0] == 200, statuses[0]
+        return time.perf_counter() - start
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded():
+            async with semaphore:
+                return await one()
+
+        return await asyncio.gather(*(bounded() for _ in range(total)))
+
+    started = time.perf_counter()
+    latencies = asyncio.run(main())
+    return latencies, time.perf_counter() - started
+
+
+def report(label, latencies, elapsed):
+    print(
+        f"{label:<44} {len(latencies) / elapsed:>9.1f} req/s"
+        f"  p50 {percentile(latencies, 50) * 1000:>8.1f} ms"
+        f"  p99 {percentile(latencies, 99) * 1000:>8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sites", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.asgi import get_asgi_application
+    from django.core.wsgi import get_wsgi_application
+
+    sites = seed_sites(args.sites, panels_per_site=3)
+    cookie = session_cookie()
+    site_id = sites[0].pk
+    wsgi_app = get_wsgi_application()
+    asgi_app = get_asgi_application()
+
+    print(
+        f"{args.requests} requests, concurrency {args.concurrency}, "
+        f"{args.sites} sites"
+    )
+    cases = [
+        ("site list", "/api/sites/", "/api/async/sites/"),
+        (
+            "site dossier",
+            f"/api/sites/{site_id}/dossier/",
+            f"/api/async/sites/{site_id}/dossier/",
+        ),
+    ]
+    for name, sync_path, async_path in cases:
+        report(
+            f"{name}: WSGI, sync view",
+            *wsgi_run(wsgi_app, sync_path, cookie, args.requests, args.concurrency),
+        )
+        report(
+            f"{name}: ASGI, sync view",
+            *asgi_run(asgi_app, sync_path, cookie, args.requests, args.concurrency),
+        )
+        report(
+            f"{name}: ASGI, async view",
+            *asgi_run(asgi_app, async_path, cookie, args.requests, args.concurrency),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Rows/sec of the fast values()-based list path against the regular
+ModelSerializer path for the Panel and inventory list endpoints.
+
+    python benchmarks/fast_list.py --sites 2000
+"""
+
+import argparse
+
+from _setup import Timer, seed_sites, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sites", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+    from rockart.api import serializers
+    from rockart.api.fastlist import compile_list_plan
+    from rockart.models import AnthropomorphInventory, Panel, ZoomorphInventory
+
+    sites = seed_sites(args.sites, panels_per_site=2)
+    AnthropomorphInventory.objects.bulk_create(
+        AnthropomorphInventory(site=site, frontal=3, headdress=1) for site in sites
+    )
+    ZoomorphInventory.objects.bulk_create(
+        ZoomorphInventory(site=site, feline=1, avian=2) for site in sites
+    )
+
+    renderer = JSONRenderer()
+    cases = [
+        (Panel, serializers.PanelSerializer),
+        (AnthropomorphInventory, serializers.AnthropomorphInventorySerializer),
+        (ZoomorphInventory, serializers.ZoomorphInventorySerializer),
+    ]
+    for model, serializer_class in cases:
+        queryset = model.objects.select_related("site").all()
+        rows = queryset.count()
+        plan = compile_list_plan(serializer_class())
+        best_slow = best_fast = float("inf")
+        for _ in range(args.repeat):
+            with Timer() as slow:
+                slow_body = renderer.render(serializer_class(queryset, many=True).data)
+            with Timer() as fast:
+                fast_body = renderer.render(plan.render(plan.values_queryset(queryset)))
+            best_slow = min(best_slow, slow.elapsed)
+            best_fast = min(best_fast, fast.elapsed)
+        assert slow_body == fast_body, f"{model.__name__} output differs"
+        print(
+            f"{model.__name__:<24} {rows:>7} rows"
+            f"  serializer {rows / best_slow:>10.0f} rows/s"
+            f"  fast {rows / best_fast:>10.0f} rows/s"
+            f"  x{best_slow / best_fast:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
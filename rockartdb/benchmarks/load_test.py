@@ -0,0 +1,456 @@
+"""
+Mixed-workload load test against a running server, simulating field
+recorders alongside API and GraphQL clients.
+
+Start the server first (``manage.py runserver`` or an ASGI server such as
+``uvicorn rockartdb.asgi:application``), then:
+
+    python benchmarks/load_test.py --prepare --sites 200
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 \\
+        --recorders 30 --pollers 200 --graphql 10 --ramp-up 30 --duration 120
+
+--prepare creates the load test user and seeds sites in the database the
+settings point at, i.e. the server's. Each virtual user logs in and then
+loops until the end of the run:
+
+- recorders pick a site from the site list and walk its tabs in form order,
+  GETting each tab and POSTing its form back with one field changed (the
+  panel, photogrammetry and notes tabs add a row);
+- pollers GET the site list, a site's panels and the changes feed;
+- GraphQL readers query a site with its panels and rock art.
+
+Users start evenly spread over --ramp-up seconds. The report gives the
+throughput and p50/p95/p99 latency per URL name, and counts failed
+requests by kind: "locked" (a 5xx whose body mentions a locked database,
+shown by the debug error page), "timeout", other 5xx and 4xx statuses,
+and "invalid" (a form POST answered with the form again).
+"""
+
+import argparse
+import http.client
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from html.parser import HTMLParser
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from _setup import percentile
+
+USERNAME = "loadtest"
+PASSWORD = "loadtest-password"
+
+# The tabs of rockart/urls.py in form order.
+TABS = [
+    "rockart-project",
+    "rockart-rock-art",
+    "rockart-panel",
+    "rockart-conditions",
+    "rockart-attributes",
+    "rockart-inventory-anthro",
+    "rockart-inventory-continued",
+    "rockart-photogrammetry",
+    "rockart-notes",
+]
+
+SITE_QUERY = """
+query ($id: Int!) {
+  site(id: $id) {
+    siteNumber projectName
+    panels { panelNumber heightM widthM }
+    rockArt { locationType rockArtTypes { name } }
+  }
+}
+"""
+
+
+def setup_django():
+    import os
+    import sys
+    from pathlib import Path
+
+    project = Path(__file__).resolve().parent.parent
+    if str(project) not in sys.path:
+        sys.path.insert(0, str(project))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rockartdb.settings")
+    import django
+
+    django.setup()
+
+
+def prepare(sites):
+    """
+    Create the load test user and seed sites up to ``sites``.
+    """
+    from django.contrib.auth import get_user_model
+    from rockart import shards
+    from rockart.models import Site
+
+    user, _ = get_user_model().objects.get_or_create(
+        username=USERNAME, defaults={"is_staff": True}
+    )
+    user.set_password(PASSWORD)
+    user.save()
+    existing = sum(
+        Site.objects.using(database).filter(site_number__startswith="LOAD-").count()
+        for database in shards.site_databases()
+    )
+    # Saved one by one, so the change log and shard ids are written as for
+    # sites entered in the UI, and each site lands in its project's shard.
+    for i in range(existing, sites):
+        site = Site(site_number=f"LOAD-{i:06d}", project_name=f"Load Project {i % 10}")
+        site.save()
+        site.panels.create(panel_number=1, height_m=1.5, width_m=2.0)
+    print(f"User {USERNAME!r} ready; {max(sites - existing, 0)} sites added.")
+
+
+class FormParser(HTMLParser):
+    """
+    The fields of the first POST form on a page, as a browser would submit
+    them, and the names of its required fields.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.fields = []
+        self.required = {}
+        self.links = []
+        self._forms = 0
+        self._select = None
+        self._select_value = None
+        self._textarea = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "a" and attrs.get("href"):
+            self.links.append(attrs["href"])
+        if tag == "form" and attrs.get("method", "").lower() == "post":
+            self._forms += 1
+        if self._forms != 1:
+            return
+        name = attrs.get("name")
+        if tag == "input" and name:
+            kind = attrs.get("type", "text")
+            if kind in ("submit", "button", "file"):
+                return
+            if kind in ("checkbox", "radio") and "checked" not in attrs:
+                return
+            self.fields.append((name, attrs.get("value", "")))
+            if "required" in attrs:
+                self.required[name] = kind
+        elif tag == "select" and name:
+            self._select, self._select_value = name, None
+            if "required" in attrs:
+                self.required[name] = "select"
+        elif tag == "option" and self._select:
+            if self._select_value is None or "selected" in attrs:
+                self._select_value = attrs.get("value", "")
+        elif tag == "textarea" and name:
+            self._textarea = [name, ""]
+
+    def handle_data(self, data):
+        if self._textarea:
+            self._textarea[1] += data
+
+    def handle_endtag(self, tag):
+        if tag == "form" and self._forms == 1:
+            self._forms += 1
+        elif tag == "select" and self._select:
+            if self._select_value is not None:
+                self.fields.append((self._select, self._select_value))
+            self._select = None
+        elif tag == "textarea" and self._textarea:
+            self.fields.append(tuple(self._textarea))
+            self._textarea = None
+
+
+def fill_form(parser):
+    """
+    The form's fields with blank required ones filled in and one free
+    text field changed, so the POST is a real edit.
+    """
+    fields = dict(parser.fields)
+    for name, kind in parser.required.items():
+        if fields.get(name):
+            continue
+        if kind == "number":
+            # Large, so new panels rarely collide with existing numbers.
+            fields[name] = str(random.randint(1, 10**6))
+        elif kind == "date":
+            fields[name] = date.today().isoformat()
+        else:
+            fields[name] = "Load test"
+    editable = [
+        name
+        for name in fields
+        if re.search(r"(recorders|notes|description|text|comments)$", name)
+    ]
+    if editable:
+        fields[random.choice(editable)] = f"Edited {time.time():.3f}"
+    return fields
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(lambda: defaultdict(int))
+
+    def record(self, name, elapsed, failure=None):
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            if failure:
+                self.failures[name][failure] += 1
+
+
+class Client:
+    """
+    One user's keep-alive connection and cookies.
+    """
+
+    def __init__(self, url, stats, timeout):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.stats = stats
+        self.timeout = timeout
+        self.cookies = SimpleCookie()
+        self.conn = None
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+        return self.conn
+
+    def request(self, name, method, path, body=None, headers=None, expect=(200,)):
+        headers = dict(headers or {})
+        cookie = "; ".join(f"{k}={v.value}" for k, v in self.cookies.items())
+        if cookie:
+            headers["Cookie"] = cookie
+        if method == "POST":
+            headers["X-CSRFToken"] = self.csrf_token()
+            headers["Referer"] = f"http://{self.host}:{self.port}{path}"
+        start = time.perf_counter()
+        try:
+            conn = self._connection()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except TimeoutError:
+            self._reset()
+            self.stats.record(name, time.perf_counter() - start, "timeout")
+            return None, b""
+        except (OSError, http.client.HTTPException):
+            self._reset()
+            self.stats.record(name, time.perf_counter() - start, "connection")
+            return None, b""
+        elapsed = time.perf_counter() - start
+        for header in response.headers.get_all("Set-Cookie") or []:
+            self.cookies.load(header)
+        failure = None
+        if response.status >= 500:
+            failure = "locked" if b"database is locked" in data else "5xx"
+        elif response.status not in expect:
+            failure = "invalid" if response.status == 200 else f"{response.status}"
+        self.stats.record(name, elapsed, failure)
+        return response.status, data
+
+    def _reset(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = None
+
+    def csrf_token(self):
+        cookie = self.cookies.get("csrftoken")
+        return cookie.value if cookie else ""
+
+    def get(self, name, path, **kwargs):
+        return self.request(name, "GET", path, **kwargs)
+
+    def post_form(self, name, path, fields, **kwargs):
+        body = urlencode(fields)
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        return self.request(name, "POST", path, body, headers, **kwargs)
+
+    def post_json(self, name, path, payload):
+        headers = {"Content-Type": "application/json"}
+        return self.request(name, "POST", path, json.dumps(payload), headers)
+
+    def login(self):
+        from django.urls import reverse
+
+        path = reverse("login")
+        status, _ = self.get("login", path)
+        if status is None:
+            return False
+        fields = {
+            "username": USERNAME,
+            "password": PASSWORD,
+            "csrfmiddlewaretoken": self.csrf_token(),
+        }
+        status, _ = self.post_form("login", path, fields, expect=(302,))
+        return status == 302
+
+
+SITE_LINK = re.compile(r"^/sites/(\d+)/project/$")
+
+
+def site_ids(client):
+    from django.urls import reverse
+
+    _, page = client.get("rockart-home", reverse("rockart-home"))
+    parser = FormParser()
+    parser.feed(page.decode(errors="replace"))
+    return [int(m.group(1)) for m in map(SITE_LINK.match, parser.links) if m]
+
+
+def recorder(client, think, stop):
+    from django.urls import reverse
+
+    sites = site_ids(client)
+    while sites and not stop.is_set():
+        site_id = random.choice(sites)
+        for name in TABS:
+            if stop.is_set():
+                return
+            path = reverse(name, args=[site_id])
+            status, page = client.get(name, path)
+            if status != 200:
+                continue
+            parser = FormParser()
+            parser.feed(page.decode(errors="replace"))
+            client.post_form(f"POST {name}", path, fill_form(parser), expect=(302,))
+            stop.wait(think * random.uniform(0.5, 1.5))
+
+
+def poller(client, think, stop):
+    from django.urls import reverse
+
+    sites = site_ids(client)
+    cursor = 0
+    while sites and not stop.is_set():
+        client.get("site-list", reverse("site-list") + "?fields=id,site_number")
+        site_id = random.choice(sites)
+        client.get("panel-list", f"{reverse('panel-list')}?site={site_id}")
+        status, body = client.get(
+            "changes-feed", f"{reverse('changes-feed')}?cursor={cursor}"
+        )
+        if status == 200:
+            cursor = json.loads(body).get("cursor", cursor)
+        stop.wait(think * random.uniform(0.5, 1.5))
+
+
+def graphql_reader(client, think, stop):
+    from django.urls import reverse
+
+    sites = site_ids(client)
+    while sites and not stop.is_set():
+        payload = {"query": SITE_QUERY, "variables": {"id": random.choice(sites)}}
+        client.post_json("graphql-api", reverse("graphql-api"), payload)
+        stop.wait(think * random.uniform(0.5, 1.5))
+
+
+def run_user(role, args, stats, delay, stop):
+    if stop.wait(delay):
+        return
+    client = Client(args.url, stats, args.timeout)
+    if client.login():
+        role(client, args.think, stop)
+
+
+def report(stats, elapsed):
+    total = sum(len(samples) for samples in stats.latencies.values())
+    print(f"\n{total} requests in {elapsed:.1f} s, {total / elapsed:.1f} req/s\n")
+    print(
+        f"{'URL name':<38}{'count':>7}{'req/s':>8}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  failures"
+    )
+    for name in sorted(stats.latencies):
+        samples = stats.latencies[name]
+        failures = ", ".join(
+            f"{kind} {count}" for kind, count in sorted(stats.failures[name].items())
+        )
+        print(
+            f"{name:<38}{len(samples):>7}{len(samples) / elapsed:>8.1f}"
+            f"{percentile(samples, 50) * 1000:>9.1f}"
+            f"{percentile(samples, 95) * 1000:>9.1f}"
+            f"{percentile(samples, 99) * 1000:>9.1f}  {failures}"
+        )
+    totals = defaultdict(int)
+    for failures in stats.failures.values():
+        for kind, count in failures.items():
+            totals[kind] += count
+    print(
+        "\nFailures: "
+        + (
+            ", ".join(f"{kind} {count}" for kind, count in sorted(totals.items()))
+            or "none"
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--recorders", type=int, default=30)
+    parser.add_argument("--pollers", type=int, default=200)
+    parser.add_argument("--graphql", type=int, default=10)
+    parser.add_argument(
+        "--ramp-up", type=float, default=30, help="Seconds to start every user."
+    )
+    parser.add_argument(
+        "--duration", type=float, default=120, help="Seconds after the ramp-up."
+    )
+    parser.add_argument(
+        "--think", type=float, default=1.0, help="Mean pause between steps."
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--prepare", action="store_true", help="Create the user and seed sites."
+    )
+    parser.add_argument("--sites", type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django()
+    if args.prepare:
+        prepare(args.sites)
+        return
+
+    roles = (
+        [recorder] * args.recorders
+        + [poller] * args.pollers
+        + [graphql_reader] * args.graphql
+    )
+    random.shuffle(roles)
+    stats = Stats()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=run_user,
+            args=(role, args, stats, args.ramp_up * i / max(1, len(roles)), stop),
+            daemon=True,
+        )
+        for i, role in enumerate(roles)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        time.sleep(args.ramp_up + args.duration)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for thread in threads:
+        thread.join(args.timeout)
+    report(stats, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Time to build the site x motif matrix and latency of
+/api/analytics/motifs/ and /api/sites/<id>/similar/ queries over it.
+
+    python benchmarks/motif_analytics.py --sites 100000
+"""
+
+import argparse
+import random
+import tempfile
+import time
+
+from _setup import Timer, percentile, seed_sites, setup_django
+
+QUERIES = [
+    {},
+    {"has": "headdress,feline"},
+    {"columns": "frontal,headdress,feline,avian,spiral", "cooccurrence": "1"},
+    {"cooccurrence": "1"},
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sites", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+    from rockart import motifs
+    from rockart.models import (
+        AnthropomorphInventory,
+        EnigmaticInventory,
+        ZoomorphInventory,
+    )
+
+    settings.MEDIA_ROOT = tempfile.mkdtemp(prefix="rockart-bench-media-")
+    rng = random.Random(42)
+    sites = seed_sites(args.sites, panels_per_site=1)
+    AnthropomorphInventory.objects.bulk_create(
+        AnthropomorphInventory(
+            site=site, frontal=rng.randint(0, 9), headdress=rng.randint(0, 2)
+        )
+        for site in sites
+    )
+    EnigmaticInventory.objects.bulk_create(
+        EnigmaticInventory(site=site, spiral=rng.randint(0, 3)) for site in sites
+    )
+    ZoomorphInventory.objects.bulk_create(
+        ZoomorphInventory(site=site, feline=rng.randint(0, 1), avian=rng.randint(0, 4))
+        for site in sites
+    )
+
+    with Timer() as timer:
+        motifs.build()
+    print(f"build {args.sites} sites: {timer.elapsed:.2f} s")
+
+    client = APIClient()
+    client.force_authenticate(get_user_model().objects.create_user("bench"))
+    cases = [(reverse("motif-analytics"), params) for params in QUERIES] + [
+        (reverse("site-similar", args=[sites[0].pk]), {"metric": metric})
+        for metric in ("cosine", "jaccard")
+    ]
+    for url, params in cases:
+        assert client.get(url, params).status_code == 200
+        latencies = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            client.get(url, params)
+            latencies.append(time.perf_counter() - start)
+        label = url + "?" + "&".join(f"{k}={v}" for k, v in params.items())
+        print(
+            f"{label:<80}"
+            f"  p50 {percentile(latencies, 50) * 1000:7.2f} ms"
+            f"  p95 {percentile(latencies, 95) * 1000:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
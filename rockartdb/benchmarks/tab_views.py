@@ -0,0 +1,83 @@
+"""
+Latency of GET requests to the site tab pages (the server-rendered forms),
+from URL resolution to the rendered body, and the cost of constructing
+each tab's form on its own.
+
+    python benchmarks/tab_views.py --requests 300
+"""
+
+import argparse
+import time
+
+from _setup import Timer, percentile, seed_sites, setup_django
+
+TABS = [
+    "rockart-project",
+    "rockart-rock-art",
+    "rockart-panel",
+    "rockart-conditions",
+    "rockart-attributes",
+    "rockart-inventory-anthro",
+    "rockart-inventory-continued",
+    "rockart-photogrammetry",
+    "rockart-notes",
+]
+
+FORMS = [
+    "SiteForm",
+    "RockArtInfoForm",
+    "RockArtConditionForm",
+    "RockArtAttributesForm",
+    "AnthropomorphInventoryForm",
+    "EnigmaticInventoryForm",
+    "ZoomorphInventoryForm",
+    "GeneralIconographicAttributesForm",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+    from django.urls import reverse
+
+    [site] = seed_sites(1, panels_per_site=5)
+    user, _ = get_user_model().objects.get_or_create(
+        username="bench", defaults={"is_staff": True}
+    )
+    client = Client()
+    client.force_login(user)
+
+    for name in TABS:
+        url = reverse(name, args=[site.pk])
+        # The first request creates the tab's row and warms the caches.
+        assert client.get(url).status_code == 200
+        latencies = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            client.get(url)
+            latencies.append(time.perf_counter() - start)
+        print(
+            f"{name:<30}"
+            f"  p50 {percentile(latencies, 50) * 1000:6.2f} ms"
+            f"  p95 {percentile(latencies, 95) * 1000:6.2f} ms"
+        )
+
+    from rockart import forms
+
+    for form_class in FORMS:
+        form_class = getattr(forms, form_class)
+        form_class()
+        with Timer() as timer:
+            for _ in range(args.requests):
+                form_class()
+        per_form = timer.elapsed / args.requests * 1_000_000
+        print(f"{form_class.__name__:<34}  {per_form:8.1f} us per form")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_safe
+
+from rockart import shards
+from rockart.api.serializers import SiteSerializer
+from rockart.archive import include_archived
+from rockart.db_routers import use_archive
+from rockart.dossier import aget_dossier
+from rockart.graphql.schema import schema as gql_schema
+from rockart.middleware import is_graphql_read
+from rockart.models import Site
+
+# Native async read endpoints for ASGI deployments. They mirror the
+# read side of SiteViewSet and GraphQLAPIView without a trip through the
+# sync thread pool; writes stay on the DRF endpoints. ShardRoutingMiddleware
+# routes them like the sync views.
+
+
+def async_login_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=403,
+            )
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _search(queryset, terms):
+    for term in terms.replace(",", " ").split():
+        queryset = queryset.filter(
+            Q(site_number__icontains=term) | Q(project_name__icontains=term)
+        )
+    return queryset
+
+
+async def _list(queryset):
+    if shards.fans_out():
+        # Merging the shards' rows in order is done by the sync helper.
+        return await sync_to_async(shards.across)(queryset)
+    return [row async for row in queryset.all()]
+
+
+@require_safe
+@async_login_required
+async def site_list(request):
+    queryset = Site.objects.all().order_by("site_number")
+    if request.GET.get("search"):
+        queryset = _search(queryset, request.GET["search"])
+    sites = await _list(queryset)
+    if include_archived(request):
+        # As in ArchivedReadMixin: archived sites follow the active ones.
+        with use_archive():
+            sites += [site async for site in queryset.all()]
+    return JsonResponse(SiteSerializer(sites, many=True).data, safe=False)
+
+
+@require_safe
+@async_login_required
+async def site_detail(request, pk):
+    site = await Site.objects.filter(pk=pk).afirst()
+    if site is None and include_archived(request):
+        with use_archive():
+            site = await Site.objects.filter(pk=pk).afirst()
+    if site is None:
+        raise Http404("No Site matches the given query.")
+    return JsonResponse(SiteSerializer(site).data)
+
+
+@require_safe
+@async_login_required
+async def site_dossier(request, pk):
+    try:
+        data = await aget_dossier(pk)
+    except Site.DoesNotExist:
+        raise Http404("No Site matches the given query.")
+    return JsonResponse(data)
+
+
+@csrf_exempt
+@require_POST
+@async_login_required
+async def graphql_query(request):
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"detail": "Invalid JSON body."}, status=400)
+    if not is_graphql_read(request):
+        return JsonResponse(
+            {"detail": "Only query operations are accepted; use /api/graphql/."},
+            status=400,
+        )
+    # graphene 2 resolvers are synchronous. Like the other ORM calls here,
+    # they run on the request's sync thread, which keeps its connections
+    # managed and the shard context of the request.
+    result = await sync_to_async(gql_schema.execute)(
+        body["query"], variable_values=body.get("variables"), context_value=request
+    )
+    resp_data = {}
+    if result.errors:
+        resp_data["errors"] = [str(err) for err in result.errors]
+    if result.data:
+        resp_data["data"] = result.data
+    return JsonResponse(resp_data)
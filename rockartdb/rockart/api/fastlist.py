@@ -0,0 +1,187 @@
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from rockart.fields import CompressedTextField
+
+# Serializer fields whose representation of a database value is the value
+# itself (DRF only re-casts to the same Python type).
+IDENTITY_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.FloatField,
+    serializers.IntegerField,
+)
+
+_plans = {}
+
+
+def _date_converter(field):
+    if getattr(field, "format", api_settings.DATE_FORMAT) == ISO_8601:
+        return lambda value: value.isoformat()
+    return field.to_representation
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if output_format != ISO_8601 or hasattr(field, "timezone"):
+        return field.to_representation
+    tz = field.default_timezone()
+
+    def convert(value):
+        if tz is not None:
+            value = value.astimezone(tz)
+        value = value.isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+
+    return convert
+
+
+def _converter(field):
+    """
+    Return a callable for a non-null value, None for identity, or raise
+    TypeError when the field cannot be rendered from a values() row.
+    """
+    if isinstance(field, PrimaryKeyRelatedField):
+        if field.pk_field is not None:
+            return field.pk_field.to_representation
+        return None
+    if isinstance(field, IDENTITY_FIELDS) and not isinstance(
+        field, serializers.MultipleChoiceField
+    ):
+        return None
+    if isinstance(field, serializers.DateTimeField):
+        return _datetime_converter(field)
+    if isinstance(field, serializers.DateField):
+        return _date_converter(field)
+    if isinstance(field, serializers.ModelField):
+        raise TypeError(field)
+    return field.to_representation
+
+
+class ListPlan:
+    """
+    Precompiled recipe for rendering a serializer's list output straight
+    from ``.values()`` rows.
+    """
+
+    def __init__(self, model, columns, many):
+        # columns: [(output name, values() key, converter or None)]
+        self.model = model
+        self.columns = columns
+        self.many = many
+        self.keys = [key for _, key, _ in columns]
+
+    def values_queryset(self, queryset):
+        return queryset.select_related(None).prefetch_related(None).values(*self.keys)
+
+    def render(self, rows):
+        rows = list(rows)
+        related = self._related_ids(rows)
+        output = []
+        for row in rows:
+            item = {}
+            for name, key, convert in self.columns:
+                if name in related:
+                    item[name] = related[name].get(row[key], [])
+                    continue
+                value = row[key]
+                if value is not None and convert is not None:
+                    value = convert(value)
+                item[name] = value
+            output.append(item)
+        return output
+
+    def _related_ids(self, rows):
+        if not self.many or not rows:
+            return {}
+        pk_key = self.model._meta.pk.attname
+        ids = [row[pk_key] for row in rows]
+        related = {}
+        for name, (through, source, target) in self.many.items():
+            grouped = defaultdict(list)
+            pairs = (
+                through.objects.filter(**{f"{source}__in": ids})
+                .order_by("pk")
+                .values_list(source, target)
+            )
+            for owner, target_id in pairs:
+                grouped[owner].append(target_id)
+            related[name] = grouped
+        return related
+
+
+def compile_list_plan(serializer):
+    """
+    Build (and cache) a ListPlan for a ModelSerializer instance, or return
+    None when one of its fields needs a model instance to render.
+    """
+    cache_key = (type(serializer), tuple(serializer.fields))
+    if cache_key in _plans:
+        return _plans[cache_key]
+    plan = None
+    try:
+        plan = _build_plan(serializer)
+    except (FieldDoesNotExist, TypeError):
+        pass
+    _plans[cache_key] = plan
+    return plan
+
+
+def _build_plan(serializer):
+    model = serializer.Meta.model
+    pk_key = model._meta.pk.attname
+    columns = []
+    many = {}
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if "." in field.source or field.source == "*":
+            raise TypeError(field)
+        model_field = model._meta.get_field(field.source)
+        if isinstance(field, ManyRelatedField):
+            if not isinstance(field.child_relation, PrimaryKeyRelatedField):
+                raise TypeError(field)
+            through = model_field.remote_field.through
+            many[field.field_name] = (
+                through,
+                model_field.m2m_field_name(),
+                model_field.m2m_reverse_name(),
+            )
+            columns.append((field.field_name, pk_key, None))
+            continue
+        if not model_field.concrete:
+            raise TypeError(field)
+        convert = _converter(field)
+        if isinstance(model_field, CompressedTextField):
+            convert = str
+        columns.append((field.field_name, model_field.attname, convert))
+    return ListPlan(model, columns, many)
+
+
+class FastListMixin:
+    """
+    Render list responses from ``.values()`` rows instead of building a
+    model instance and running every serializer field per row. Output is
+    identical to the serializer's; ViewSets whose serializer cannot be
+    compiled fall back to the regular path.
+    """
+
+    fast_list = True
+
+    def list(self, request, *args, **kwargs):
+        plan = compile_list_plan(self.get_serializer()) if self.fast_list else None
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+        queryset = plan.values_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(plan.render(page))
+        return Response(plan.render(queryset))
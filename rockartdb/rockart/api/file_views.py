@@ -0,0 +1,77 @@
+from functools import wraps
+
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_safe
+
+from rockart.fileserve import IMMUTABLE_CACHE_CONTROL, serve_file
+from rockart.media import asset_name, media_root
+from rockart.models import MediaAsset
+
+# Plain Django views for derived media files: tile viewers fetch hundreds
+# of small files, so they skip DRF's negotiation and serializer layers.
+
+
+def login_required_json(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=403,
+            )
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@require_safe
+@login_required_json
+def deepzoom_descriptor(request, sha256):
+    return serve_file(
+        request,
+        media_root() / "deepzoom" / sha256 / "image.dzi",
+        content_type="application/xml",
+        cache_control="private, no-cache",
+    )
+
+
+@require_safe
+@login_required_json
+def deepzoom_tile(request, sha256, level, col, row, fmt):
+    path = (
+        media_root()
+        / "deepzoom"
+        / sha256
+        / "image_files"
+        / str(int(level))
+        / f"{int(col)}_{int(row)}.{fmt}"
+    )
+    return serve_file(request, path, cache_control=IMMUTABLE_CACHE_CONTROL)
+
+
+@require_safe
+@login_required_json
+def media_file(request, sha256):
+    """
+    An uploaded file, full resolution, with byte range support.
+    """
+    asset = MediaAsset.objects.filter(sha256=sha256).only("content_type").first()
+    if asset is None:
+        raise Http404("File not found.")
+    return serve_file(
+        request,
+        media_root() / asset_name(sha256),
+        content_type=asset.content_type or "application/octet-stream",
+        cache_control=IMMUTABLE_CACHE_CONTROL,
+    )
+
+
+@require_safe
+@login_required_json
+def three_d_level(request, sha256, cells):
+    return serve_file(
+        request,
+        media_root() / "lod" / sha256 / f"{int(cells)}.ply",
+        content_type="application/octet-stream",
+        cache_control=IMMUTABLE_CACHE_CONTROL,
+    )
@@ -0,0 +1,54 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.filters import BaseFilterBackend
+
+from rockart import geo
+
+DEFAULT_NEAREST = 10
+MAX_NEAREST = 500
+
+
+class SiteGeoFilter(BaseFilterBackend):
+    """
+    ``?bbox=min_lon,min_lat,max_lon,max_lat`` keeps sites inside the box;
+    ``?near=lon,lat&k=`` returns the k nearest sites, nearest first.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        try:
+            if "bbox" in params:
+                queryset = geo.filter_bbox(queryset, *geo.parse_bbox(params["bbox"]))
+            if "near" in params:
+                lon, lat = geo.parse_point(params["near"])
+                k = int(params.get("k", DEFAULT_NEAREST))
+                if not 1 <= k <= MAX_NEAREST:
+                    raise ValueError(f"k must be between 1 and {MAX_NEAREST}")
+                queryset = geo.filter_nearest(queryset, lat, lon, k)
+        except ValueError as exc:
+            raise ParseError(str(exc))
+        return queryset
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": "bbox",
+                "required": False,
+                "in": "query",
+                "description": "min_lon,min_lat,max_lon,max_lat",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": "near",
+                "required": False,
+                "in": "query",
+                "description": "lon,lat; returns the k nearest sites",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": "k",
+                "required": False,
+                "in": "query",
+                "description": f"Number of nearest sites (default {DEFAULT_NEAREST})",
+                "schema": {"type": "integer"},
+            },
+        ]
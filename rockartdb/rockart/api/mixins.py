@@ -0,0 +1,178 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.http import Http404
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import SAFE_METHODS
+
+from rockart import shards
+from rockart.archive import include_archived
+from rockart.db_routers import use_archive, use_shard
+
+SPARSE_ACTIONS = ("list", "retrieve")
+
+
+def split_param(value):
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+class SparseFieldsetMixin:
+    """
+    Support ``?fields=a,b`` and ``?omit=c`` on list/retrieve.
+
+    The serializer is trimmed to the requested fields and the queryset is
+    narrowed with ``.only()`` so unrequested columns (long TextFields in
+    particular) are never read from the database.
+    """
+
+    def get_sparse_fieldset(self):
+        """
+        Return the serializer field names to keep, or None for all of them.
+        """
+        if hasattr(self, "_sparse_fieldset"):
+            return self._sparse_fieldset
+        self._sparse_fieldset = None
+        if self.action not in SPARSE_ACTIONS:
+            return None
+        params = self.request.query_params
+        fields = split_param(params.get("fields", ""))
+        omit = split_param(params.get("omit", ""))
+        if not fields and not omit:
+            return None
+        available = list(self.get_serializer_class()().fields)
+        unknown = sorted(set(fields + omit) - set(available))
+        if unknown:
+            raise ParseError(f"Unknown field(s): {', '.join(unknown)}")
+        keep = [name for name in available if not fields or name in fields]
+        self._sparse_fieldset = [name for name in keep if name not in omit]
+        return self._sparse_fieldset
+
+    def get_serializer(self, *args, **kwargs):
+        fieldset = self.get_sparse_fieldset()
+        if fieldset is not None:
+            kwargs.setdefault("fields", fieldset)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fieldset = self.get_sparse_fieldset()
+        if fieldset is None:
+            return queryset
+        return self.apply_sparse_fieldset(queryset, fieldset)
+
+    def get_sparse_related(self):
+        """
+        Relations the view joins with select_related after trimming; they
+        have to stay loaded alongside the sparse columns.
+        """
+        return []
+
+    def apply_sparse_fieldset(self, queryset, fieldset):
+        model = queryset.model
+        columns = {model._meta.pk.name, *self.get_sparse_related()}
+        relations = set()
+        for name in fieldset:
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                # Computed serializer field: its sources are unknown, so
+                # leave the queryset alone.
+                return queryset
+            if field.many_to_many:
+                relations.add(name)
+            elif field.concrete:
+                columns.add(name)
+            else:
+                return queryset
+        prefetches = [
+            lookup
+            for lookup in queryset._prefetch_related_lookups
+            if str(getattr(lookup, "prefetch_to", lookup)).split("__")[0] in relations
+        ]
+        # Related rows are only rendered as primary keys, which come from
+        # the local *_id columns, so the joins can go as well.
+        return (
+            queryset.select_related(None)
+            .prefetch_related(None)
+            .prefetch_related(*prefetches)
+            .only(*columns)
+        )
+
+
+class ArchivedReadMixin:
+    """
+    Add archived rows to list responses, after the active ones, and find
+    archived objects for detail routes, on GETs with ?include_archived=1.
+    """
+
+    def reads_archive(self):
+        return self.request.method in SAFE_METHODS and include_archived(self.request)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if self.reads_archive() and isinstance(response.data, list):
+            with use_archive():
+                archived = super().list(request, *args, **kwargs)
+            response.data = [*response.data, *archived.data]
+        return response
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if not self.reads_archive():
+                raise
+            with use_archive():
+                return super().get_object()
+
+
+class ShardedReadMixin:
+    """
+    List the rows of every site database when sharding is on and the
+    request named no shard (see rockart.shards), merged in the order the
+    queryset gives them.
+    """
+
+    _merging = False
+
+    def list(self, request, *args, **kwargs):
+        if not shards.fans_out():
+            return super().list(request, *args, **kwargs)
+        found = []
+        self._merging = True
+        try:
+            for database in shards.site_databases():
+                with use_shard(database):
+                    response = super().list(request, *args, **kwargs)
+                if not isinstance(response.data, list):
+                    return response
+                if response.data:
+                    found.append((database, self._listed_queryset, response.data))
+            # Rows from a single database need no merge keys.
+            if len(found) < 2:
+                rows = found[0][2] if found else []
+                response.data = rows[: self.get_merge_limit()]
+                return response
+            parts = []
+            for database, queryset, rows in found:
+                with use_shard(database):
+                    parts.append(zip(self.get_merge_keys(queryset), rows))
+        finally:
+            self._merging = False
+        response.data = shards.merge(parts, self.get_merge_limit())
+        return response
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self._merging:
+            queryset = self._listed_queryset = shards.total_order(queryset)
+        return queryset
+
+    def get_merge_keys(self, queryset):
+        """
+        Keys to merge the listed rows of one database on, in row order.
+        """
+        return shards.sort_keys(queryset)
+
+    def get_merge_limit(self):
+        """
+        The number of merged rows to keep; all of them by default (None).
+        """
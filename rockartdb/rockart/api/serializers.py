@@ -1,11 +1,19 @@
+from typing import ClassVar
+
+from django.urls import reverse
 from rest_framework import serializers
 
+from rockart import media, vocab
 from rockart.models import (
     AnthropomorphInventory,
+    DeepZoomImage,
+    DerivativeStatus,
     EnigmaticInventory,
     GeneralIconographicAttributes,
+    Job,
     Panel,
     PhotogrammetryLogEntry,
+    PhotogrammetryMedia,
     RockArtAttributes,
     RockArtCategory,
     RockArtCondition,
@@ -13,83 +21,359 @@ from rockart.models import (
     RockArtNote,
     RockArtType,
     Site,
+    ThreeDModel,
+    ThreeDModelLevel,
+    UploadSession,
+    UploadStatus,
     ZoomorphInventory,
 )
 
 
-class SiteSerializer(serializers.ModelSerializer):
+class VocabularyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key of a rock art type or category, validated against the
+    vocabulary snapshot (reloaded first if the vocabularies were edited)
+    instead of a query per id.
+    """
+
+    def __init__(self, vocabulary, **kwargs):
+        self.vocabulary = vocabulary
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        obj = vocab.get(fresh=True).instance(self.vocabulary, pk)
+        if obj is None:
+            self.fail("does_not_exist", pk_value=data)
+        return obj
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer that accepts ``fields`` / ``omit`` keyword arguments to
+    trim its output to a sparse fieldset. Relations to the rock art
+    vocabularies are validated from the vocabulary cache.
+    """
+
+    def __init__(self, *args, fields=None, omit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name in omit or ():
+            self.fields.pop(name, None)
+
+    def build_relational_field(self, field_name, relation_info):
+        field_class, field_kwargs = super().build_relational_field(
+            field_name, relation_info
+        )
+        vocabulary = vocab.VOCABULARIES.get(relation_info.related_model)
+        if vocabulary is not None and field_class is serializers.PrimaryKeyRelatedField:
+            field_class = VocabularyRelatedField
+            field_kwargs["vocabulary"] = vocabulary
+        return field_class, field_kwargs
+
+
+class SiteSerializer(DynamicFieldsModelSerializer):
+    """
+    Site columns, plus nested tabs for each name in ``expand`` (see
+    SITE_EXPANSIONS).
+    """
+
+    def __init__(self, *args, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in expand:
+            for relation, serializer_class, many in SITE_EXPANSIONS[name]:
+                self.fields[relation] = serializer_class(many=many, read_only=True)
+
     class Meta:
         model = Site
         fields = "__all__"
 
 
-class RockArtTypeSerializer(serializers.ModelSerializer):
+class RockArtTypeSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = RockArtType
         fields = "__all__"
 
 
-class RockArtCategorySerializer(serializers.ModelSerializer):
+class RockArtCategorySerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = RockArtCategory
         fields = "__all__"
 
 
-class RockArtInfoSerializer(serializers.ModelSerializer):
+class RockArtInfoSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = RockArtInfo
         fields = "__all__"
 
 
-class PanelSerializer(serializers.ModelSerializer):
+class PanelSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Panel
         fields = "__all__"
 
 
-class RockArtConditionSerializer(serializers.ModelSerializer):
+class RockArtConditionSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = RockArtCondition
         fields = "__all__"
 
 
-class RockArtAttributesSerializer(serializers.ModelSerializer):
+class RockArtAttributesSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = RockArtAttributes
         fields = "__all__"
 
 
-class AnthropomorphInventorySerializer(serializers.ModelSerializer):
+class AnthropomorphInventorySerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = AnthropomorphInventory
         fields = "__all__"
 
 
-class EnigmaticInventorySerializer(serializers.ModelSerializer):
+class EnigmaticInventorySerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = EnigmaticInventory
         fields = "__all__"
 
 
-class ZoomorphInventorySerializer(serializers.ModelSerializer):
+class ZoomorphInventorySerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = ZoomorphInventory
         fields = "__all__"
 
 
-class GeneralIconographicAttributesSerializer(serializers.ModelSerializer):
+class GeneralIconographicAttributesSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = GeneralIconographicAttributes
         fields = "__all__"
 
 
-class PhotogrammetryLogEntrySerializer(serializers.ModelSerializer):
+class PhotogrammetryLogEntrySerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = PhotogrammetryLogEntry
         fields = "__all__"
 
 
-class RockArtNoteSerializer(serializers.ModelSerializer):
+class PhotogrammetryMediaSerializer(DynamicFieldsModelSerializer):
+    sha256 = serializers.CharField(source="asset.sha256", read_only=True)
+    size = serializers.IntegerField(source="asset.size", read_only=True)
+    content_type = serializers.CharField(source="asset.content_type", read_only=True)
+
+    class Meta:
+        model = PhotogrammetryMedia
+        fields: ClassVar[list[str]] = [
+            "id",
+            "entry",
+            "filename",
+            "sha256",
+            "size",
+            "content_type",
+            "created_at",
+            "updated_at",
+            "version",
+        ]
+
+
+def _absolute(serializer, url):
+    request = serializer.context.get("request")
+    return request.build_absolute_uri(url) if request else url
+
+
+class DeepZoomImageSerializer(serializers.ModelSerializer):
+    dzi_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DeepZoomImage
+        fields: ClassVar[list[str]] = [
+            "status",
+            "width",
+            "height",
+            "tile_size",
+            "overlap",
+            "format",
+            "error",
+            "completed_at",
+            "dzi_url",
+        ]
+
+    def get_dzi_url(self, dzi) -> str | None:
+        if dzi.status != DerivativeStatus.READY:
+            return None
+        return _absolute(self, reverse("deepzoom-descriptor", args=[dzi.asset.sha256]))
+
+
+class ThreeDModelLevelSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ThreeDModelLevel
+        fields: ClassVar[list[str]] = [
+            "cells",
+            "size",
+            "vertex_count",
+            "face_count",
+            "url",
+        ]
+
+    def get_url(self, level) -> str:
+        sha256 = level.model.source.asset.sha256
+        return _absolute(self, reverse("three-d-level", args=[sha256, level.cells]))
+
+
+class ThreeDModelSerializer(DynamicFieldsModelSerializer):
+    """
+    ``levels`` lists the decimated variants coarse to fine; ``source_url``
+    is the full-resolution file.
+    """
+
+    levels = ThreeDModelLevelSerializer(many=True, read_only=True)
+    source_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ThreeDModel
+        fields: ClassVar[list[str]] = [
+            "id",
+            "entry",
+            "panel",
+            "source",
+            "name",
+            "kind",
+            "vertex_count",
+            "face_count",
+            "lod_status",
+            "lod_error",
+            "levels",
+            "source_url",
+            "created_at",
+            "updated_at",
+            "version",
+        ]
+        read_only_fields: ClassVar[list[str]] = [
+            "kind",
+            "vertex_count",
+            "face_count",
+            "lod_status",
+            "lod_error",
+        ]
+
+    def get_source_url(self, model) -> str:
+        return _absolute(self, reverse("media-file", args=[model.source.asset.sha256]))
+
+    def validate(self, attrs):
+        entry = attrs.get("entry", getattr(self.instance, "entry", None))
+        source = attrs.get("source", getattr(self.instance, "source", None))
+        panel = attrs.get("panel", getattr(self.instance, "panel", None))
+        if source is not None and source.entry_id != entry.pk:
+            raise serializers.ValidationError(
+                {"source": "Media must belong to the same photogrammetry entry."}
+            )
+        if panel is not None and panel.site_id != entry.site_id:
+            raise serializers.ValidationError(
+                {"panel": "Panel must belong to the entry's site."}
+            )
+        return attrs
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields: ClassVar[list[str]] = [
+            "id",
+            "kind",
+            "key",
+            "payload",
+            "status",
+            "priority",
+            "attempts",
+            "max_attempts",
+            "run_after",
+            "progress",
+            "progress_message",
+            "result",
+            "error",
+            "created_by",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+        read_only_fields = fields
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    sha256 = serializers.RegexField(r"^[0-9a-fA-F]{64}$")
+    chunk_size = serializers.IntegerField(required=False, min_value=64 * 1024)
+    chunk_count = serializers.IntegerField(read_only=True)
+    missing = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields: ClassVar[list[str]] = [
+            "id",
+            "entry",
+            "filename",
+            "content_type",
+            "size",
+            "sha256",
+            "chunk_size",
+            "chunk_count",
+            "status",
+            "missing",
+            "media",
+            "created_at",
+            "completed_at",
+        ]
+        read_only_fields: ClassVar[list[str]] = ["status", "media", "completed_at"]
+
+    def get_missing(self, session) -> list[int]:
+        if session.status == UploadStatus.COMPLETE:
+            return []
+        return media.missing_chunks(session)
+
+    def validate_chunk_size(self, value):
+        if value > media.max_chunk_size():
+            raise serializers.ValidationError(
+                f"Chunk size may not exceed {media.max_chunk_size()} bytes."
+            )
+        return value
+
+    def validate_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError("Size may not be negative.")
+        return value
+
+
+class RockArtNoteSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = RockArtNote
         fields = "__all__"
+
+
+# ?expand= names on the site endpoints -> [(relation, serializer, many)].
+SITE_EXPANSIONS = {
+    "panels": [("panels", PanelSerializer, True)],
+    "notes": [("notes", RockArtNoteSerializer, True)],
+    "photogrammetry_logs": [
+        ("photogrammetry_logs", PhotogrammetryLogEntrySerializer, True)
+    ],
+    "rock_art": [("rock_art", RockArtInfoSerializer, False)],
+    "conditions": [("conditions", RockArtConditionSerializer, False)],
+    "attributes": [("attributes", RockArtAttributesSerializer, False)],
+    "inventories": [
+        ("anthropomorph_inventory", AnthropomorphInventorySerializer, False),
+        ("enigmatic_inventory", EnigmaticInventorySerializer, False),
+        ("zoomorph_inventory", ZoomorphInventorySerializer, False),
+        (
+            "general_iconographic_attributes",
+            GeneralIconographicAttributesSerializer,
+            False,
+        ),
+    ],
+}
@@ -1,7 +1,7 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
-from rockart.api import views
+from rockart.api import async_views, file_views, views
 
 router = DefaultRouter()
 router.register("sites", views.SiteViewSet)
@@ -19,8 +19,49 @@ router.register(
 )
 router.register("photogrammetry-logs", views.PhotogrammetryLogEntryViewSet)
 router.register("rock-art-notes", views.RockArtNoteViewSet)
+router.register("photogrammetry-media", views.PhotogrammetryMediaViewSet)
+router.register("uploads", views.UploadSessionViewSet)
+router.register("3d-models", views.ThreeDModelViewSet)
+router.register("jobs", views.JobViewSet)
 
 urlpatterns = [
     path("", include(router.urls)),
     path("graphql/", views.GraphQLAPIView.as_view(), name="graphql-api"),
+    path("changes/", views.ChangesFeedView.as_view(), name="changes-feed"),
+    path("tiles/<int:z>/<int:x>/<int:y>/", views.SiteTileView.as_view(), name="tile"),
+    path(
+        "analytics/motifs/",
+        views.MotifAnalyticsView.as_view(),
+        name="motif-analytics",
+    ),
+    path("sync/upload/", views.SyncUploadView.as_view(), name="sync-upload"),
+    re_path(
+        r"^deepzoom/(?P<sha256>[0-9a-f]{64})/image\.dzi$",
+        file_views.deepzoom_descriptor,
+        name="deepzoom-descriptor",
+    ),
+    re_path(
+        r"^deepzoom/(?P<sha256>[0-9a-f]{64})/image_files/(?P<level>\d+)/"
+        r"(?P<col>\d+)_(?P<row>\d+)\.(?P<fmt>jpg|png)$",
+        file_views.deepzoom_tile,
+        name="deepzoom-tile",
+    ),
+    re_path(
+        r"^media/(?P<sha256>[0-9a-f]{64})$",
+        file_views.media_file,
+        name="media-file",
+    ),
+    re_path(
+        r"^3d/(?P<sha256>[0-9a-f]{64})/(?P<cells>\d+)\.ply$",
+        file_views.three_d_level,
+        name="three-d-level",
+    ),
+    path("async/sites/", async_views.site_list, name="async-site-list"),
+    path("async/sites/<int:pk>/", async_views.site_detail, name="async-site-detail"),
+    path(
+        "async/sites/<int:pk>/dossier/",
+        async_views.site_dossier,
+        name="async-site-dossier",
+    ),
+    path("async/graphql/", async_views.graphql_query, name="async-graphql"),
 ]
@@ -1,18 +1,69 @@
-from rest_framework import serializers, viewsets
+from typing import ClassVar
+
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from drf_spectacular.utils import (
+    OpenApiExample,
+    OpenApiParameter,
+    OpenApiResponse,
+    extend_schema,
+)
+from rest_framework import mixins, serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound, ParseError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
-from drf_spectacular.utils import OpenApiExample, OpenApiResponse, extend_schema
 
+from rockart import archive, geo, jobs, media, motifs, sync, tiles
+from rockart.api.fastlist import FastListMixin
+from rockart.api.filters import DEFAULT_NEAREST, SiteGeoFilter
+from rockart.api.mixins import (
+    SPARSE_ACTIONS,
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    SparseFieldsetMixin,
+    split_param,
+)
 from rockart.api.permissions import IsAuthenticatedStaffWriteOtherwiseReadOnly
+from rockart.api.serializers import (
+    SITE_EXPANSIONS,
+    AnthropomorphInventorySerializer,
+    DeepZoomImageSerializer,
+    EnigmaticInventorySerializer,
+    GeneralIconographicAttributesSerializer,
+    JobSerializer,
+    PanelSerializer,
+    PhotogrammetryLogEntrySerializer,
+    PhotogrammetryMediaSerializer,
+    RockArtAttributesSerializer,
+    RockArtCategorySerializer,
+    RockArtConditionSerializer,
+    RockArtInfoSerializer,
+    RockArtNoteSerializer,
+    RockArtTypeSerializer,
+    SiteSerializer,
+    ThreeDModelSerializer,
+    UploadSessionSerializer,
+    ZoomorphInventorySerializer,
+)
+from rockart.db_routers import use_archive
+from rockart.dossier import build_dossier, dossier_queryset
 from rockart.graphql.schema import schema as gql_schema
-
+from rockart.middleware import is_query_document
 from rockart.models import (
     AnthropomorphInventory,
+    DeepZoomImage,
+    DerivativeStatus,
     EnigmaticInventory,
     GeneralIconographicAttributes,
+    Job,
+    JobStatus,
     Panel,
     PhotogrammetryLogEntry,
+    PhotogrammetryMedia,
     RockArtAttributes,
     RockArtCategory,
     RockArtCondition,
@@ -20,47 +71,194 @@ from rockart.models import (
     RockArtNote,
     RockArtType,
     Site,
+    ThreeDModel,
+    UploadSession,
     ZoomorphInventory,
 )
-from rockart.api.serializers import (
-    AnthropomorphInventorySerializer,
-    EnigmaticInventorySerializer,
-    GeneralIconographicAttributesSerializer,
-    PanelSerializer,
-    PhotogrammetryLogEntrySerializer,
-    RockArtAttributesSerializer,
-    RockArtCategorySerializer,
-    RockArtConditionSerializer,
-    RockArtInfoSerializer,
-    RockArtNoteSerializer,
-    RockArtTypeSerializer,
-    SiteSerializer,
-    ZoomorphInventorySerializer,
-)
 
+# Result sizes of /api/sites/<id>/similar/.
+DEFAULT_SIMILAR = 10
+MAX_SIMILAR = 100
 
-class SiteViewSet(viewsets.ModelViewSet):
+# Nested lists are ordered the way the corresponding tab lists them.
+EXPANSION_ORDERING = {
+    "panels": ("panel_number",),
+    "photogrammetry_logs": ("date",),
+    "notes": ("date", "created_at"),
+}
+
+
+class MatrixPending(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The motif matrix is being built. Try again shortly."
+    default_code = "matrix_pending"
+    # Sent as Retry-After by the exception handler.
+    wait = 30
+
+
+def motif_matrix(request):
+    """
+    The current motif matrix; a 503 while a build job writes the first one.
+    """
+    try:
+        return motifs.get(created_by=request.user)
+    except motifs.MatrixPending:
+        raise MatrixPending()
+
+
+class SiteViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Site.objects.all().order_by("site_number")
     serializer_class = SiteSerializer
     search_fields = ["site_number", "project_name"]
+    filter_backends: ClassVar[list[type]] = [
+        *api_settings.DEFAULT_FILTER_BACKENDS,
+        SiteGeoFilter,
+    ]
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
+    def get_expansions(self):
+        """
+        Validated ``?expand=`` names for list/retrieve.
+        """
+        if self.action not in SPARSE_ACTIONS:
+            return []
+        expand = split_param(self.request.query_params.get("expand", ""))
+        unknown = sorted(set(expand) - set(SITE_EXPANSIONS))
+        if unknown:
+            raise ParseError(f"Unknown expansion(s): {', '.join(unknown)}")
+        return [name for name in SITE_EXPANSIONS if name in expand]
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("expand", self.get_expansions())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_sparse_related(self):
+        return [
+            relation
+            for name in self.get_expansions()
+            for relation, _, many in SITE_EXPANSIONS[name]
+            if not many
+        ]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        for name in self.get_expansions():
+            for relation, serializer_class, many in SITE_EXPANSIONS[name]:
+                model = serializer_class.Meta.model
+                if many:
+                    queryset = queryset.prefetch_related(
+                        Prefetch(
+                            relation,
+                            queryset=model.objects.order_by(
+                                *EXPANSION_ORDERING[relation]
+                            ),
+                        )
+                    )
+                else:
+                    queryset = queryset.select_related(relation)
+            if name == "rock_art":
+                queryset = queryset.prefetch_related(
+                    "rock_art__rock_art_types", "rock_art__rock_art_categories"
+                )
+        return queryset
+
+    def get_merge_keys(self, queryset):
+        if "near" not in self.request.query_params:
+            return super().get_merge_keys(queryset)
+        # Each database returns its own k nearest; rank them together.
+        lon, lat = geo.parse_point(self.request.query_params["near"])
+        key = geo.nearest_first(lat, lon)
+        located = queryset.select_related(None).prefetch_related(None)
+        return [key(site) for site in located.only("latitude", "longitude")]
+
+    def get_merge_limit(self):
+        if "near" not in self.request.query_params:
+            return None
+        return int(self.request.query_params.get("k", DEFAULT_NEAREST))
+
+    @action(detail=True, methods=["get"])
+    def dossier(self, request, pk=None):
+        """
+        The site with every tab recorded for it.
+        """
+        site = get_object_or_404(dossier_queryset(), pk=pk)
+        self.check_object_permissions(request, site)
+        return Response(build_dossier(site))
 
-class RockArtTypeViewSet(viewsets.ModelViewSet):
+    @extend_schema(
+        summary="Sites with the most similar motif profile",
+        parameters=[
+            OpenApiParameter("k", int, description="Number of sites (default 10)"),
+            OpenApiParameter("metric", str, enum=motifs.METRICS),
+        ],
+        responses={
+            200: OpenApiResponse(description="Sites ranked by similarity"),
+            503: OpenApiResponse(description="The matrix is being built"),
+        },
+    )
+    @action(detail=True, methods=["get"])
+    def similar(self, request, pk=None):
+        """
+        The k sites whose iconographic inventories and rock art types and
+        categories are closest to this site's.
+        """
+        if not motifs.available():
+            raise NotFound("Similarity search needs NumPy.")
+        site = get_object_or_404(Site.objects.only("pk"), pk=pk)
+        self.check_object_permissions(request, site)
+        metric = request.query_params.get("metric", motifs.COSINE)
+        if metric not in motifs.METRICS:
+            raise ParseError(f"metric must be one of {', '.join(motifs.METRICS)}.")
+        try:
+            k = int(request.query_params.get("k", DEFAULT_SIMILAR))
+        except ValueError:
+            raise ParseError("k must be an integer.")
+        k = max(1, min(k, MAX_SIMILAR))
+        try:
+            hits = motif_matrix(request).similar(site.pk, k, metric)
+        except KeyError:
+            # Saved but not yet in the matrix.
+            hits = []
+        numbers = dict(
+            Site.objects.filter(pk__in=[pk for pk, _ in hits]).values_list(
+                "pk", "site_number"
+            )
+        )
+        results = [
+            {"site": pk, "site_number": numbers[pk], "score": round(score, 6)}
+            for pk, score in hits
+            if pk in numbers
+        ]
+        return Response({"site": site.pk, "metric": metric, "results": results})
+
+
+class RockArtTypeViewSet(FastListMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = RockArtType.objects.all().order_by("name")
     serializer_class = RockArtTypeSerializer
     search_fields = ["name"]
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class RockArtCategoryViewSet(viewsets.ModelViewSet):
+class RockArtCategoryViewSet(FastListMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = RockArtCategory.objects.all().order_by("name")
     serializer_class = RockArtCategorySerializer
     search_fields = ["name"]
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class RockArtInfoViewSet(viewsets.ModelViewSet):
+class RockArtInfoViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = RockArtInfo.objects.select_related("site").prefetch_related(
         "rock_art_types", "rock_art_categories"
     )
@@ -69,62 +267,442 @@ class RockArtInfoViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class PanelViewSet(viewsets.ModelViewSet):
+class PanelViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Panel.objects.select_related("site").all()
     serializer_class = PanelSerializer
     search_fields = ["site__site_number", "panel_number"]
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class RockArtConditionViewSet(viewsets.ModelViewSet):
+class RockArtConditionViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = RockArtCondition.objects.select_related("site").all()
     serializer_class = RockArtConditionSerializer
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class RockArtAttributesViewSet(viewsets.ModelViewSet):
+class RockArtAttributesViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = RockArtAttributes.objects.select_related("site", "rock_art_category")
     serializer_class = RockArtAttributesSerializer
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class AnthropomorphInventoryViewSet(viewsets.ModelViewSet):
+class AnthropomorphInventoryViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = AnthropomorphInventory.objects.select_related("site").all()
     serializer_class = AnthropomorphInventorySerializer
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class EnigmaticInventoryViewSet(viewsets.ModelViewSet):
+class EnigmaticInventoryViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = EnigmaticInventory.objects.select_related("site").all()
     serializer_class = EnigmaticInventorySerializer
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class ZoomorphInventoryViewSet(viewsets.ModelViewSet):
+class ZoomorphInventoryViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = ZoomorphInventory.objects.select_related("site").all()
     serializer_class = ZoomorphInventorySerializer
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class GeneralIconographicAttributesViewSet(viewsets.ModelViewSet):
+class GeneralIconographicAttributesViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = GeneralIconographicAttributes.objects.select_related("site").all()
     serializer_class = GeneralIconographicAttributesSerializer
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class PhotogrammetryLogEntryViewSet(viewsets.ModelViewSet):
+class PhotogrammetryLogEntryViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = PhotogrammetryLogEntry.objects.select_related("site").all()
     serializer_class = PhotogrammetryLogEntrySerializer
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
-class RockArtNoteViewSet(viewsets.ModelViewSet):
+class PhotogrammetryMediaViewSet(
+    ArchivedReadMixin, FastListMixin, SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet
+):
+    queryset = PhotogrammetryMedia.objects.select_related("asset").all()
+    serializer_class = PhotogrammetryMediaSerializer
+    filterset_fields: ClassVar[list[str]] = ["entry"]
+    permission_classes: ClassVar[list[type]] = [
+        IsAuthenticatedStaffWriteOtherwiseReadOnly
+    ]
+
+    @extend_schema(
+        summary="Deep zoom pyramid of a panorama",
+        request=None,
+        responses={200: DeepZoomImageSerializer, 202: DeepZoomImageSerializer},
+    )
+    @action(detail=True, methods=["get", "post"])
+    def deepzoom(self, request, pk=None):
+        """
+        GET reports the pyramid's status; POST queues a build job, whose
+        progress is at the Location of the response.
+        """
+        asset = self.get_object().asset
+        headers = {}
+        if request.method == "POST":
+            dzi, job = media.request_deep_zoom(asset, created_by=request.user)
+            code = status.HTTP_202_ACCEPTED
+            if job is not None:
+                headers["Location"] = request.build_absolute_uri(
+                    reverse("job-detail", args=[job.pk])
+                )
+        else:
+            dzi = get_object_or_404(DeepZoomImage, asset=asset)
+            code = status.HTTP_200_OK
+        serializer = DeepZoomImageSerializer(dzi, context={"request": request})
+        return Response(serializer.data, status=code, headers=headers)
+
+
+class ThreeDModelViewSet(
+    ArchivedReadMixin, FastListMixin, SparseFieldsetMixin, viewsets.ModelViewSet
+):
+    """
+    Meshes and point clouds uploaded as photogrammetry media. New models
+    queue a job building their level-of-detail variants; its progress is
+    listed under ``/api/jobs/?key=lod:<id>``.
+    """
+
+    queryset = (
+        ThreeDModel.objects.select_related("source__asset")
+        .prefetch_related("levels")
+        .all()
+    )
+    serializer_class = ThreeDModelSerializer
+    filterset_fields: ClassVar[list[str]] = ["entry", "panel"]
+    permission_classes: ClassVar[list[type]] = [
+        IsAuthenticatedStaffWriteOtherwiseReadOnly
+    ]
+
+    def perform_create(self, serializer):
+        model = serializer.save()
+        media.request_lods(model, created_by=self.request.user)
+
+    def perform_update(self, serializer):
+        previous_source = serializer.instance.source_id
+        model = serializer.save()
+        if model.source_id != previous_source:
+            model.levels.all().delete()
+            model.lod_status = DerivativeStatus.PENDING
+            model.save(update_fields=["lod_status"])
+            media.request_lods(model, created_by=self.request.user)
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Background jobs and their progress. Staff see every job and may retry
+    failed ones; other users see the jobs they started.
+    """
+
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    filterset_fields: ClassVar[list[str]] = ["kind", "key", "status"]
+    permission_classes: ClassVar[list[type]] = [
+        IsAuthenticatedStaffWriteOtherwiseReadOnly
+    ]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if not (user.is_staff or user.is_superuser):
+            queryset = queryset.filter(created_by=user)
+        return queryset
+
+    @extend_schema(summary="Queue a failed job again", request=None)
+    @action(detail=True, methods=["post"])
+    def retry(self, request, pk=None):
+        job = self.get_object()
+        if job.status != JobStatus.FAILED:
+            return Response(
+                {"detail": "Only failed jobs can be retried."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return Response(self.get_serializer(jobs.retry(job)).data)
+
+
+class UploadSessionViewSet(
+    mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+):
+    """
+    Resumable chunked uploads of photogrammetry media.
+
+    Create a session with the file's size and SHA-256, PUT each chunk to
+    ``chunks/<index>/`` with an ``X-Chunk-SHA256`` header (in any order,
+    in parallel), then POST ``complete/``. Retrieving the session lists the
+    chunks still missing, so an interrupted upload resumes from there.
+    """
+
+    queryset = UploadSession.objects.select_related("entry").all()
+    serializer_class = UploadSessionSerializer
+    permission_classes: ClassVar[list[type]] = [
+        IsAuthenticatedStaffWriteOtherwiseReadOnly
+    ]
+
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        serializer.instance = media.start_upload(**data, created_by=self.request.user)
+
+    @extend_schema(
+        summary="Upload one chunk",
+        request={"application/octet-stream": bytes},
+        parameters=[
+            OpenApiParameter(
+                "X-Chunk-SHA256",
+                str,
+                location=OpenApiParameter.HEADER,
+                required=True,
+                description="SHA-256 of the chunk body",
+            )
+        ],
+        responses={204: None},
+    )
+    @action(detail=True, methods=["put"], url_path=r"chunks/(?P<index>\d+)")
+    def chunk(self, request, pk=None, index=None):
+        session = self.get_object()
+        checksum = request.META.get("HTTP_X_CHUNK_SHA256")
+        if not checksum:
+            raise ParseError("X-Chunk-SHA256 header is required.")
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+            # Read the body straight from the WSGI stream: DRF's parsers
+            # would buffer the whole chunk in memory.
+            media.write_chunk(session, int(index), request, checksum, length)
+        except media.UploadConflict as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+        except (media.UploadError, ValueError) as exc:
+            raise ParseError(str(exc))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @extend_schema(summary="Assemble and attach the uploaded file", request=None)
+    @action(detail=True, methods=["post"])
+    def complete(self, request, pk=None):
+        session = self.get_object()
+        try:
+            media.complete_upload(session)
+        except media.UploadConflict as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+        except media.UploadError as exc:
+            raise ParseError(str(exc))
+        return Response(self.get_serializer(session).data)
+
+
+class RockArtNoteViewSet(
+    ArchivedReadMixin,
+    ShardedReadMixin,
+    FastListMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = RockArtNote.objects.select_related("site").all()
     serializer_class = RockArtNoteSerializer
-    search_fields = ["site__site_number", "author", "text"]
+    search_fields: ClassVar[list[str]] = ["site__site_number", "author", "text__search"]
     permission_classes = [IsAuthenticatedStaffWriteOtherwiseReadOnly]
 
 
+class ChangesFeedView(APIView):
+    """
+    Rows created, updated or deleted since a cursor, for offline clients.
+    """
+
+    permission_classes: ClassVar[list[type]] = [IsAuthenticated]
+
+    @extend_schema(
+        summary="Changes since a cursor",
+        parameters=[
+            OpenApiParameter("since", int, description="Cursor from the last page"),
+            OpenApiParameter("limit", int, description="Log entries per page"),
+        ],
+        responses={200: OpenApiResponse(description="Page of upserts and tombstones")},
+    )
+    def get(self, request):
+        try:
+            since = int(request.query_params.get("since", 0))
+            limit = int(request.query_params.get("limit", sync.DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise ParseError("since and limit must be integers.")
+        limit = max(1, min(limit, sync.MAX_PAGE_SIZE))
+        return Response(sync.changes_since(since, limit))
+
+
+class SiteTileView(APIView):
+    """
+    Clustered site counts for one web map tile.
+    """
+
+    permission_classes: ClassVar[list[type]] = [IsAuthenticated]
+
+    @extend_schema(
+        summary="Clustered sites in a map tile",
+        responses={
+            200: OpenApiResponse(
+                description="Clusters with counts and location type and "
+                "category breakdowns"
+            )
+        },
+    )
+    def get(self, request, z, x, y):
+        if not tiles.valid_tile(z, x, y):
+            raise NotFound("No such tile.")
+        return Response(tiles.get_tile(z, x, y))
+
+
+class MotifAnalyticsView(APIView):
+    """
+    Motif totals and co-occurrence over the site x motif matrix.
+    """
+
+    permission_classes: ClassVar[list[type]] = [IsAuthenticated]
+
+    @extend_schema(
+        summary="Motif counts across sites",
+        parameters=[
+            OpenApiParameter(
+                "columns", str, description="Comma-separated motifs (default all)"
+            ),
+            OpenApiParameter(
+                "has", str, description="Only sites with every one of these motifs"
+            ),
+            OpenApiParameter("sites", str, description="Comma-separated site ids"),
+            OpenApiParameter(
+                "cooccurrence", bool, description="Include pairwise site counts"
+            ),
+        ],
+        responses={
+            200: OpenApiResponse(
+                description="Figure totals and sites per motif for the matched sites"
+            ),
+            503: OpenApiResponse(description="The matrix is being built"),
+        },
+    )
+    def get(self, request):
+        if not motifs.available():
+            raise NotFound("Motif analytics need NumPy.")
+        params = request.query_params
+        columns = split_param(params.get("columns", "")) or motifs.COLUMNS
+        having = split_param(params.get("has", ""))
+        site_ids = None
+        if params.get("sites"):
+            try:
+                site_ids = [int(pk) for pk in split_param(params["sites"])]
+            except ValueError:
+                raise ParseError("sites must be comma-separated integers.")
+        matrix = motif_matrix(request)
+        try:
+            rows = matrix.select(site_ids, having)
+            data = {
+                "sites": len(rows),
+                "totals": matrix.totals(rows, columns),
+                "sites_with": matrix.sites_with(rows, columns),
+            }
+            if params.get("cooccurrence") in ("1", "true"):
+                data["cooccurrence"] = matrix.cooccurrence(rows, columns)
+        except KeyError as exc:
+            raise ParseError(f"Unknown motif columns: {exc.args[0]}")
+        return Response(data)
+
+
+class SyncMutationSerializer(serializers.Serializer):
+    ref = serializers.CharField(
+        required=False,
+        max_length=64,
+        help_text='Client reference; later mutations can use "$<ref>" as an id.',
+    )
+    model = serializers.ChoiceField(choices=sorted(sync.VERSIONED_SERIALIZERS))
+    op = serializers.ChoiceField(choices=sorted(sync.APPLY))
+    id = serializers.IntegerField(required=False)
+    version = serializers.IntegerField(
+        required=False, min_value=1, help_text="Base version of the edited row"
+    )
+    data = serializers.DictField(required=False, default=dict)
+
+    def validate(self, attrs):
+        if attrs["op"] != "create" and ("id" not in attrs or "version" not in attrs):
+            raise serializers.ValidationError(
+                "update and delete need the row id and its base version."
+            )
+        return attrs
+
+
+class SyncUploadSerializer(serializers.Serializer):
+    mutations = SyncMutationSerializer(
+        many=True, allow_empty=False, max_length=sync.MAX_UPLOAD_MUTATIONS
+    )
+
+
+class SyncUploadView(APIView):
+    """
+    Apply a batch of offline edits in one transaction with per-row version
+    checks.
+    """
+
+    permission_classes: ClassVar[list[type]] = [
+        IsAuthenticatedStaffWriteOtherwiseReadOnly
+    ]
+
+    @extend_schema(
+        summary="Upload a batch of offline edits",
+        request=SyncUploadSerializer,
+        responses={
+            200: OpenApiResponse(description="Accepted rows, conflicts and errors")
+        },
+    )
+    def post(self, request):
+        serializer = SyncUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = sync.apply_mutations(
+            serializer.validated_data["mutations"],
+            context={"request": request, "view": self},
+        )
+        return Response(result)
+
+
 class GraphQLRequestSerializer(serializers.Serializer):
     query = serializers.CharField(help_text="GraphQL query string")
     variables = serializers.JSONField(
@@ -161,12 +739,38 @@ class GraphQLAPIView(APIView):
         serializer.is_valid(raise_exception=True)
         query = serializer.validated_data["query"]
         variables = serializer.validated_data.get("variables")
-        result = gql_schema.execute(
-            query, variable_values=variables, context_value=request
-        )
+
+        def execute():
+            return gql_schema.execute(
+                query, variable_values=variables, context_value=request
+            )
+
+        result = execute()
+        errors = list(result.errors or [])
+        data = result.data
+        # The resolvers read every shard themselves (see shards.across).
+        if data and is_query_document(query) and archive.include_archived(request):
+            with use_archive():
+                archived = execute()
+            errors += archived.errors or []
+            data = _merge_results(data, archived.data or {})
         resp_data = {}
-        if result.errors:
-            resp_data["errors"] = [str(err) for err in result.errors]
-        if result.data:
-            resp_data["data"] = result.data
+        if errors:
+            resp_data["errors"] = [str(err) for err in errors]
+        if data:
+            resp_data["data"] = data
         return Response(resp_data)
+
+
+def _merge_results(data, other):
+    """
+    Append the archived results to top-level lists and fill in single
+    objects only found in the archive.
+    """
+    merged = dict(data)
+    for name, value in other.items():
+        if isinstance(merged.get(name), list) and isinstance(value, list):
+            merged[name] = merged[name] + value
+        elif merged.get(name) is None:
+            merged[name] = value
+    return merged
@@ -1,6 +1,32 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class RockartConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "rockart"
+
+    def ready(self):
+        from rockart import geo, search, shards, signals
+
+        shards.check_databases()
+        signals.connect()
+        post_migrate.connect(
+            geo.ensure_spatial_index_after_migrate,
+            sender=self,
+            dispatch_uid="rockart-spatial-index",
+        )
+        connection_created.connect(
+            search.register_functions, dispatch_uid="rockart-sql-functions"
+        )
+        post_migrate.connect(
+            search.ensure_search_indexes_after_migrate,
+            sender=self,
+            dispatch_uid="rockart-search-indexes",
+        )
+        post_migrate.connect(
+            shards.prepare_after_migrate,
+            sender=self,
+            dispatch_uid="rockart-shards",
+        )
@@ -0,0 +1,99 @@
+"""
+Cold storage for closed projects.
+
+archive_sites() copies sites and every row recorded for them to the
+"archive" database, keeping their ids, then removes them from the primary
+or their shard with rockart.bulk.delete_sites(), so the hot tables and their indexes only
+hold active projects. Archived rows are served read-only by the API and
+GraphQL when a read asks for them with ``?include_archived=1``.
+"""
+
+from django.db import router, transaction
+
+from rockart import bulk
+from rockart.db_routers import ARCHIVE_DB_ALIAS, archive_configured, use_shard
+from rockart.models import (
+    MediaAsset,
+    Panel,
+    RockArtCategory,
+    RockArtType,
+    ThreeDModel,
+    UploadChunk,
+    UploadSession,
+)
+
+# Tables copied to the archive, parents first. Upload sessions are only
+# in-flight transfers and are dropped instead.
+ARCHIVED_TABLES = [
+    (model, lookup)
+    for model, lookup in reversed(bulk.SITE_TABLES)
+    if model not in (UploadChunk, UploadSession)
+]
+
+
+def include_archived(request) -> bool:
+    """
+    True when the request asked for archived rows as well. Callers only
+    honour it for reads.
+    """
+    return archive_configured() and request.GET.get("include_archived") in (
+        "1",
+        "true",
+    )
+
+
+def _copy_vocabularies():
+    for model in (RockArtType, RockArtCategory):
+        rows = list(model.objects.using(router.db_for_write(model)))
+        model.objects.using(ARCHIVE_DB_ALIAS).bulk_create(
+            rows, update_conflicts=True, unique_fields=["id"], update_fields=["name"]
+        )
+
+
+def _copy_assets(site_ids):
+    # Assets are shared by content hash, so the primary keeps its copy.
+    assets = MediaAsset.objects.using(router.db_for_write(MediaAsset)).filter(
+        attachments__entry__site__in=site_ids
+    )
+    MediaAsset.objects.using(ARCHIVE_DB_ALIAS).bulk_create(
+        list(assets.distinct()), ignore_conflicts=True
+    )
+
+
+def archive_sites(querysets):
+    """
+    Move the sites selected by bulk.site_querysets() to the archive
+    database. Returns the number of rows archived per model label.
+    """
+    if not archive_configured():
+        raise RuntimeError("No archive database is configured.")
+    counts = {}
+    for db, sites in querysets.items():
+        with use_shard(db):
+            _archive_from(db, sites, counts)
+    return counts
+
+
+def _archive_from(db, sites, counts):
+    # The archive commits first: if the primary then fails to commit, the
+    # rows are in both databases rather than in neither.
+    with transaction.atomic(using=db), transaction.atomic(using=ARCHIVE_DB_ALIAS):
+        site_ids = list(sites.order_by("pk").values_list("pk", flat=True))
+        _copy_vocabularies()
+        for start in range(0, len(site_ids), bulk.BATCH_SIZE):
+            batch = site_ids[start : start + bulk.BATCH_SIZE]
+            _copy_assets(batch)
+            panels = set()
+            for model, lookup in ARCHIVED_TABLES:
+                rows = list(bulk.site_rows(model, lookup, batch))
+                if model is Panel:
+                    panels.update(row.pk for row in rows)
+                elif model is ThreeDModel:
+                    # A model may be placed on another site's panel.
+                    for row in rows:
+                        if row.panel_id not in panels:
+                            row.panel_id = None
+                model.objects.using(ARCHIVE_DB_ALIAS).bulk_create(rows)
+                label = model._meta.label
+                counts[label] = counts.get(label, 0) + len(rows)
+        bulk.delete_sites({db: sites})
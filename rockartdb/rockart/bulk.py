@@ -0,0 +1,149 @@
+"""
+Set-based removal of whole sites.
+
+Site.delete() goes through Django's deletion collector, which loads every
+related row into memory and sends a signal per row. delete_sites() instead
+issues one DELETE per table, children first, inside a single transaction,
+writes the change log tombstones itself and clears the caches the
+per-row signals would have cleared.
+"""
+
+import shutil
+
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+
+from rockart import motifs, report, shards, tiles
+from rockart.db_routers import use_shard
+from rockart.models import (
+    AnthropomorphInventory,
+    ChangeAction,
+    EnigmaticInventory,
+    GeneralIconographicAttributes,
+    Panel,
+    PhotogrammetryLogEntry,
+    PhotogrammetryMedia,
+    RockArtAttributes,
+    RockArtCondition,
+    RockArtInfo,
+    RockArtNote,
+    Site,
+    ThreeDModel,
+    ThreeDModelLevel,
+    UploadChunk,
+    UploadSession,
+    ZoomorphInventory,
+)
+from rockart.sync import record_changes, synced_models
+
+# Every table holding rows of a site, children before parents, with the
+# lookup from the row to its site.
+SITE_TABLES = [
+    (UploadChunk, "session__entry__site"),
+    (UploadSession, "entry__site"),
+    (ThreeDModelLevel, "model__entry__site"),
+    (ThreeDModel, "entry__site"),
+    (PhotogrammetryMedia, "entry__site"),
+    (PhotogrammetryLogEntry, "site"),
+    (RockArtInfo.rock_art_types.through, "rockartinfo__site"),
+    (RockArtInfo.rock_art_categories.through, "rockartinfo__site"),
+    (RockArtInfo, "site"),
+    (RockArtCondition, "site"),
+    (RockArtAttributes, "site"),
+    (AnthropomorphInventory, "site"),
+    (EnigmaticInventory, "site"),
+    (ZoomorphInventory, "site"),
+    (GeneralIconographicAttributes, "site"),
+    (RockArtNote, "site"),
+    (Panel, "site"),
+    (Site, "pk"),
+]
+
+# Sites per round of DELETEs, keeping IN lists under SQLite's limit.
+BATCH_SIZE = 500
+
+# Sites above this many invalidate every map tile instead of their own.
+TILE_INVALIDATION_LIMIT = 500
+
+
+def site_querysets(site_ids=None, project_name=None):
+    """
+    The sites selected by id and/or project name, as {database: Site
+    queryset} for the databases holding them.
+    """
+    if site_ids is None and project_name is None:
+        raise ValueError("Select sites by id or by project name.")
+    if site_ids is not None:
+        groups = shards.group_sites(site_ids)
+    else:
+        groups = {shards.project_database(project_name): None}
+    querysets = {}
+    for database, ids in groups.items():
+        sites = Site.objects.using(database)
+        if ids is not None:
+            sites = sites.filter(pk__in=ids)
+        if project_name is not None:
+            sites = sites.filter(project_name=project_name)
+        querysets[database] = sites
+    return querysets
+
+
+def count_sites(querysets):
+    return sum(sites.count() for sites in querysets.values())
+
+
+def site_rows(model, lookup, site_ids):
+    """
+    The rows of ``model`` belonging to these sites, on the primary or the
+    shard named with use_shard().
+    """
+    return model.objects.using(router.db_for_write(model)).filter(
+        **{f"{lookup}__in": site_ids}
+    )
+
+
+def _invalidate(site_ids, positions):
+    if len(site_ids) > TILE_INVALIDATION_LIMIT:
+        tiles.invalidate_all()
+    else:
+        tiles.invalidate_positions(*positions)
+    motifs.drop_sites(site_ids)
+    for site_id in site_ids:
+        shutil.rmtree(report.report_dir(site_id), ignore_errors=True)
+
+
+def delete_sites(querysets):
+    """
+    Delete the sites selected by site_querysets() with everything recorded
+    for them, one transaction per database. Returns the number of rows
+    deleted per model label, in deletion order.
+
+    Media assets are shared by content hash and are kept.
+    """
+    counts = {}
+    for db, sites in querysets.items():
+        with use_shard(db):
+            _delete_from(db, sites, counts)
+    return counts
+
+
+def _delete_from(db, sites, counts):
+    synced = set(synced_models())
+    # The change log is on the default database.
+    with transaction.atomic(using=DEFAULT_DB_ALIAS), transaction.atomic(using=db):
+        selected = list(sites.values_list("pk", "latitude", "longitude").order_by("pk"))
+        site_ids = [pk for pk, _, _ in selected]
+        positions = [(lat, lon) for _, lat, lon in selected]
+        for start in range(0, len(site_ids), BATCH_SIZE):
+            batch = site_ids[start : start + BATCH_SIZE]
+            # Rows of other sites only point here through nullable links.
+            site_rows(UploadSession, "media__entry__site", batch).update(media=None)
+            site_rows(ThreeDModel, "panel__site", batch).update(panel=None)
+            for model, lookup in SITE_TABLES:
+                rows = site_rows(model, lookup, batch)
+                if model in synced:
+                    record_changes(
+                        model, rows.values_list("pk", lookup), ChangeAction.DELETE
+                    )
+                label = model._meta.label
+                counts[label] = counts.get(label, 0) + rows._raw_delete(rows.db)
+        transaction.on_commit(lambda: _invalidate(site_ids, positions), using=db)
@@ -0,0 +1,289 @@
+"""
+Data consistency checks over every site.
+
+check() splits the site id range of each site database into chunks and
+hands them to a process pool. Every chunk runs each rule, a function
+taking ``(database, first_id, last_id)`` that streams the rows of sites
+with ids in that range and yields the problems it finds as dicts with at
+least "model", "id", "site" and "message". Rules are looked up by name in
+RULES and the ROCKART_CONSISTENCY_RULES setting (dotted paths), like job
+handlers.
+"""
+
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, FloatField, Max, Min, Sum, Value
+from django.db.models.functions import Abs, Greatest
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from rockart import motifs, shards
+from rockart.models import (
+    AnthropomorphInventory,
+    EnigmaticInventory,
+    Panel,
+    Site,
+    ZoomorphInventory,
+)
+
+RULES = {
+    "figure_counts": "rockart.consistency.figure_counts",
+    "panel_area": "rockart.consistency.panel_area",
+    "orphaned_rows": "rockart.consistency.orphaned_rows",
+}
+
+# Site ids per pool task.
+DEFAULT_CHUNK_SIZE = 1000
+# Rows fetched per round trip while streaming.
+FETCH_SIZE = 2000
+
+# Allowed difference between area_m2 and height_m * width_m: 5%, and at
+# least 0.01 m2 for rounding on small panels.
+AREA_TOLERANCE = 0.05
+AREA_MINIMUM_TOLERANCE = 0.01
+
+# Panel count prefix, inventory model and whether each figure has exactly
+# one of the inventory's attributes. Enigmatics and zoomorphs are classified
+# by type, so their inventories add up to the panel totals. Anthropomorph
+# attributes overlap (a figure can be frontal and masked), so only no
+# single attribute may count more figures than the panels.
+FIGURE_INVENTORIES = (
+    ("anthropomorphs", AnthropomorphInventory, False),
+    ("enigmatics", EnigmaticInventory, True),
+    ("zoomorphs", ZoomorphInventory, True),
+)
+
+
+def rule_names():
+    return list({**RULES, **getattr(settings, "ROCKART_CONSISTENCY_RULES", {})})
+
+
+def rule_for(name):
+    rules = {**RULES, **getattr(settings, "ROCKART_CONSISTENCY_RULES", {})}
+    if name not in rules:
+        raise ValueError(f"Unknown consistency rule {name!r}.")
+    return import_string(rules[name])
+
+
+def figure_counts(database, first_id, last_id):
+    """
+    Panel *_final counts summed per site against the figure inventories.
+    Sites whose panels count figures of a kind without an inventory of it
+    are reported too.
+    """
+    totals = {
+        row.pop("site_id"): row
+        for row in Panel.objects.using(database)
+        .filter(site_id__gte=first_id, site_id__lte=last_id)
+        .values("site_id")
+        .annotate(
+            **{
+                prefix: Sum(f"{prefix}_final")
+                for prefix, _model, _exclusive in FIGURE_INVENTORIES
+            }
+        )
+        .order_by()
+    }
+    for prefix, model, exclusive in FIGURE_INVENTORIES:
+        fields = motifs.INVENTORY_COLUMNS[model]
+        rows = (
+            model.objects.using(database)
+            .filter(site_id__gte=first_id, site_id__lte=last_id)
+            .values("id", "site_id", *fields)
+            .iterator(chunk_size=FETCH_SIZE)
+        )
+        inventoried = set()
+        for row in rows:
+            inventoried.add(row["site_id"])
+            panels = (totals.get(row["site_id"]) or {}).get(prefix) or 0
+            issue = {
+                "model": model._meta.label,
+                "id": row["id"],
+                "site": row["site_id"],
+                "panels": panels,
+            }
+            if exclusive:
+                inventory = sum(row[field] for field in fields)
+                if inventory != panels:
+                    yield {
+                        **issue,
+                        "inventory": inventory,
+                        "message": f"The inventory counts {inventory} {prefix},"
+                        f" the panels {panels}.",
+                    }
+            else:
+                over = {field: row[field] for field in fields if row[field] > panels}
+                if over:
+                    yield {
+                        **issue,
+                        "fields": over,
+                        "message": f"{', '.join(over)} exceed the {panels} {prefix}"
+                        " counted on the panels.",
+                    }
+        for site_id, counts in totals.items():
+            panels = counts[prefix] or 0
+            if panels and site_id not in inventoried:
+                yield {
+                    "model": model._meta.label,
+                    "id": None,
+                    "site": site_id,
+                    "panels": panels,
+                    "message": f"The panels count {panels} {prefix}"
+                    " but the site has no inventory of them.",
+                }
+
+
+def panel_area(database, first_id, last_id):
+    """
+    Panels whose area_m2 disagrees with height_m * width_m. Zeros are
+    measurements not taken yet and are skipped.
+    """
+    expected = F("height_m") * F("width_m")
+    rows = (
+        Panel.objects.using(database)
+        .filter(
+            site_id__gte=first_id,
+            site_id__lte=last_id,
+            height_m__gt=0,
+            width_m__gt=0,
+            area_m2__gt=0,
+        )
+        .alias(
+            difference=Abs(F("area_m2") - expected),
+            tolerance=Greatest(
+                expected * AREA_TOLERANCE,
+                Value(AREA_MINIMUM_TOLERANCE),
+                output_field=FloatField(),
+            ),
+        )
+        .filter(difference__gt=F("tolerance"))
+        .values("id", "site_id", "height_m", "width_m", "area_m2")
+        .iterator(chunk_size=FETCH_SIZE)
+    )
+    for row in rows:
+        computed = row["height_m"] * row["width_m"]
+        yield {
+            "model": Panel._meta.label,
+            "id": row["id"],
+            "site": row.pop("site_id"),
+            **row,
+            "message": f"area_m2 is {row['area_m2']:g},"
+            f" height_m x width_m is {computed:g}.",
+        }
+
+
+def orphaned_rows(database, first_id, last_id):
+    """
+    Tab rows pointing at a site that is not in their database.
+    """
+    sites = Site.objects.using(database).filter(pk__range=(first_id, last_id))
+    for model in _tab_models():
+        rows = (
+            model.objects.using(database)
+            .filter(site_id__gte=first_id, site_id__lte=last_id)
+            .exclude(site_id__in=sites.values("pk"))
+            .values_list("id", "site_id")
+            .iterator(chunk_size=FETCH_SIZE)
+        )
+        for pk, site_id in rows:
+            yield {
+                "model": model._meta.label,
+                "id": pk,
+                "site": site_id,
+                "message": f"Site {site_id} does not exist.",
+            }
+
+
+def _tab_models():
+    return [
+        model
+        for model in shards.sharded_models()
+        if model is not Site and any(f.name == "site" for f in model._meta.fields)
+    ]
+
+
+def _bounds(database):
+    """
+    The smallest and largest site id in ``database``, counting the site
+    ids of tab rows so orphans are covered too.
+    """
+    ranges = [Site.objects.using(database).aggregate(low=Min("pk"), high=Max("pk"))]
+    for model in _tab_models():
+        ranges.append(
+            model.objects.using(database).aggregate(
+                low=Min("site_id"), high=Max("site_id")
+            )
+        )
+    lows = [r["low"] for r in ranges if r["low"] is not None]
+    highs = [r["high"] for r in ranges if r["high"] is not None]
+    return (min(lows), max(highs)) if lows else None
+
+
+def check_chunk(database, first_id, last_id, names):
+    """
+    Run the rules over one chunk. Returns the number of sites checked and
+    the issues found. Runs in pool workers.
+    """
+    sites = Site.objects.using(database).filter(pk__range=(first_id, last_id)).count()
+    issues = []
+    for name in names:
+        for issue in rule_for(name)(database, first_id, last_id):
+            issues.append({"rule": name, "database": database, **issue})
+    return sites, issues
+
+
+def _chunks(chunk_size):
+    for database in shards.site_databases():
+        bounds = _bounds(database)
+        if bounds is None:
+            continue
+        low, high = bounds
+        for first in range(low, high + 1, chunk_size):
+            yield database, first, min(first + chunk_size - 1, high)
+
+
+def _run(tasks, names, workers):
+    if workers <= 1:
+        return [check_chunk(*task, names) for task in tasks]
+    # As in rockart.snapshot: forked workers inherit the configured project
+    # and open their own connections.
+    connections.close_all()
+    pool = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("fork")
+    )
+    with pool:
+        futures = [pool.submit(check_chunk, *task, names) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def check(names=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Run the named rules (default: all) over every site and return the
+    report: the sites checked, the issues and their count per rule.
+    """
+    names = list(names or rule_names())
+    for name in names:
+        rule_for(name)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    tasks = list(_chunks(chunk_size))
+    checked = 0
+    issues = []
+    for sites, found in _run(tasks, names, workers):
+        checked += sites
+        issues.extend(found)
+    totals = defaultdict(int, {name: 0 for name in names})
+    for issue in issues:
+        totals[issue["rule"]] += 1
+    return {
+        "checked_at": timezone.now(),
+        "rules": names,
+        "sites": checked,
+        "totals": dict(totals),
+        "issues": issues,
+    }
@@ -0,0 +1,143 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = "replica"
+ARCHIVE_DB_ALIAS = "archive"
+
+# Set per request by ReplicaRoutingMiddleware; True means reads may be
+# served by the replica.
+_read_from_replica = ContextVar("rockart_read_from_replica", default=False)
+# Set while serving archived rows (see rockart.archive).
+_read_from_archive = ContextVar("rockart_read_from_archive", default=False)
+# Set per request by ShardRoutingMiddleware, and while fanning out over the
+# shards: the database holding the sites being read or written.
+_shard = ContextVar("rockart_shard", default=None)
+
+
+def replica_configured() -> bool:
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def archive_configured() -> bool:
+    return ARCHIVE_DB_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def use_replica(enabled=True):
+    """
+    Route reads inside the block to the replica (when one is configured).
+    """
+    token = _read_from_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+@contextmanager
+def use_archive():
+    """
+    Route reads inside the block to the archive database.
+    """
+    token = _read_from_archive.set(True)
+    try:
+        yield
+    finally:
+        _read_from_archive.reset(token)
+
+
+@contextmanager
+def use_shard(database):
+    """
+    Route site rows inside the block to ``database`` (see rockart.shards).
+    """
+    token = _shard.set(database)
+    try:
+        yield
+    finally:
+        _shard.reset(token)
+
+
+def current_shard():
+    return _shard.get()
+
+
+def reading_archive() -> bool:
+    return _read_from_archive.get()
+
+
+class ShardRouter:
+    """
+    Send site rows to the shard of their project. Saved rows stay where
+    they were loaded from, new rows follow their project or site, and
+    queries without an instance use the shard of the current request.
+    Rows on the default database fall through to ReadReplicaRouter.
+    """
+
+    def _database(self, model, hints):
+        from rockart import shards
+
+        if not shards.sharding_enabled() or _read_from_archive.get():
+            return None
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db in shards.shard_aliases():
+            # Related rows, vocabularies included, are in the same shard.
+            return instance._state.db
+        if model not in shards.sharded_models():
+            return None
+        if instance is not None and type(instance) in shards.sharded_models():
+            database = shards.instance_database(instance)
+        else:
+            database = _shard.get()
+        return None if database in (None, DEFAULT_DB_ALIAS) else database
+
+    def db_for_read(self, model, **hints):
+        return self._database(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._database(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        from rockart import shards
+
+        # The vocabularies are copied to every shard.
+        vocabularies = shards.REPLICATED_MODELS
+        if shards.sharding_enabled() and (
+            type(obj1) in vocabularies or type(obj2) in vocabularies
+        ):
+            return True
+        return None
+
+
+class ReadReplicaRouter:
+    """
+    Send reads to the replica for requests the middleware marked as
+    read-only; everything else (writes, reads inside a transaction, reads
+    outside a request) stays on the primary. Reads inside use_archive(),
+    and of rows related to archived rows, go to the archive.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        if _read_from_archive.get() or (
+            instance is not None and instance._state.db == ARCHIVE_DB_ALIAS
+        ):
+            return ARCHIVE_DB_ALIAS if archive_configured() else None
+        if not _read_from_replica.get() or not replica_configured():
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS if replica_configured() else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        dbs = {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in dbs and obj2._state.db in dbs:
+            return True
+        return None
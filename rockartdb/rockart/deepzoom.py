@@ -0,0 +1,329 @@
+"""
+Deep Zoom (DZI) pyramid generation for large panoramas.
+
+This module only depends on Pillow so it can run inside worker processes
+without Django. The source is read in horizontal strips; each level keeps
+just the rows needed for its current row of tiles and hands a 2x2
+box-downsampled copy of every strip to the next level down. Peak memory is
+therefore a few strips, not the whole image, for sources whose pixels are
+stored uncompressed (TIFF, in one strip or many, PPM, BMP). Compressed
+single-stream formats such as JPEG and PNG cannot be decoded by rows and
+are loaded whole, so they are refused above ``max_decoded_pixels``; convert
+larger panoramas to an uncompressed TIFF first.
+"""
+
+import math
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+TILE_SIZE = 254
+OVERLAP = 1
+FORMAT = "jpg"
+QUALITY = 85
+# Source rows read per strip, in tiles.
+STRIP_TILES = 4
+# Largest compressed source decoded whole (about 150 MB as RGB).
+MAX_DECODED_PIXELS = 50_000_000
+
+DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+    'TileSize="{tile_size}" Overlap="{overlap}" Format="{format}">'
+    '<Size Width="{width}" Height="{height}"/></Image>\n'
+)
+
+
+class DeepZoomError(Exception):
+    pass
+
+
+def available():
+    return Image is not None
+
+
+def level_count(width, height):
+    return math.ceil(math.log2(max(width, height, 1))) + 1
+
+
+def descriptor(width, height, tile_size=TILE_SIZE, overlap=OVERLAP, fmt=FORMAT):
+    return DZI_TEMPLATE.format(
+        tile_size=tile_size, overlap=overlap, format=fmt, width=width, height=height
+    )
+
+
+class StripReader:
+    """
+    Read rows [top, bottom) of an image without decoding the rest when the
+    file stores raw scanlines. Other images are decoded whole, up to
+    ``max_decoded_pixels``.
+    """
+
+    def __init__(self, path, max_decoded_pixels=MAX_DECODED_PIXELS):
+        if Image is None:
+            raise DeepZoomError("Pillow is required to build deep zoom images.")
+        Image.MAX_IMAGE_PIXELS = None
+        self.path = path
+        self.image = Image.open(path)
+        self.width, self.height = self.image.size
+        self.raw = self._raw_layout()
+        self._decoded = None
+        if self.raw is None and self.width * self.height > max_decoded_pixels:
+            self.image.close()
+            raise DeepZoomError(
+                f"{self.width}x{self.height} {self.image.format} images are "
+                f"decoded whole, which is limited to {max_decoded_pixels} "
+                "pixels. Convert the panorama to an uncompressed TIFF first."
+            )
+
+    def _raw_layout(self):
+        """
+        (top, bottom, offset, rawmode, stride, orientation) of each band of
+        raw scanlines, or None unless the whole image is stored that way.
+        """
+        bands = []
+        for tile in self.image.tile:
+            codec, (left, top, right, bottom), offset, args = tile[:4]
+            expected_top = bands[-1][1] if bands else 0
+            if codec != "raw" or (left, right, top) != (0, self.width, expected_top):
+                return None
+            if isinstance(args, str):
+                args = (args,)
+            rawmode = args[0]
+            stride = args[1] if len(args) > 1 else 0
+            orientation = args[2] if len(args) > 2 else 1
+            if not stride:
+                if rawmode != self.image.mode:
+                    return None
+                pixel = len(Image.new(self.image.mode, (1, 1)).tobytes())
+                stride = self.width * pixel
+            bands.append((top, bottom, offset, rawmode, stride, orientation))
+        if not bands or bands[-1][1] != self.height:
+            return None
+        return bands
+
+    def read(self, top, bottom):
+        if self.raw is None:
+            if self._decoded is None:
+                self._decoded = self.image.convert(_output_mode(self.image.mode))
+            return self._decoded.crop((0, top, self.width, bottom))
+        strip = Image.new(self.image.mode, (self.width, bottom - top))
+        with open(self.path, "rb") as f:
+            for start, end, offset, rawmode, stride, orientation in self.raw:
+                first, last = max(top, start), min(bottom, end)
+                if first >= last:
+                    continue
+                # Bottom-up bands store their last row first.
+                skip = first - start if orientation > 0 else end - last
+                f.seek(offset + skip * stride)
+                data = f.read((last - first) * stride)
+                band = Image.frombytes(
+                    self.image.mode,
+                    (self.width, last - first),
+                    data,
+                    "raw",
+                    rawmode,
+                    stride,
+                    orientation,
+                )
+                strip.paste(band, (0, first - top))
+        return strip.convert(_output_mode(strip.mode))
+
+    def strips(self, rows):
+        for top in range(0, self.height, rows):
+            yield self.read(top, min(top + rows, self.height))
+
+    def close(self):
+        self.image.close()
+
+
+def _output_mode(mode):
+    return "L" if mode in ("1", "L", "I;16", "I", "F") else "RGB"
+
+
+def _stack(top, bottom):
+    if top is None:
+        return bottom
+    image = Image.new(top.mode, (top.width, top.height + bottom.height))
+    image.paste(top, (0, 0))
+    image.paste(bottom, (0, top.height))
+    return image
+
+
+def write_tile_row(band, level, row, band_top, options):
+    """
+    Cut one row of tiles out of a band of rows and encode them.
+    ``band`` is (mode, size, bytes) so it can cross a process boundary.
+    """
+    mode, size, data = band
+    image = Image.frombytes(mode, size, data)
+    tile_size, overlap, fmt, quality, directory = options
+    target = Path(directory) / str(level)
+    target.mkdir(parents=True, exist_ok=True)
+    top = max(0, row * tile_size - overlap) - band_top
+    bottom = min(size[1] + band_top, (row + 1) * tile_size + overlap) - band_top
+    for col in range(math.ceil(size[0] / tile_size)):
+        left = max(0, col * tile_size - overlap)
+        right = min(size[0], (col + 1) * tile_size + overlap)
+        tile = image.crop((left, top, right, bottom))
+        path = target / f"{col}_{row}.{fmt}"
+        if fmt == "jpg":
+            tile.save(path, "JPEG", quality=quality)
+        else:
+            tile.save(path, "PNG")
+    return level, row
+
+
+class _Level:
+    """
+    Buffers the rows of one pyramid level and emits tile rows as soon as
+    all of their rows (overlap included) have arrived.
+    """
+
+    def __init__(self, builder, level, width, height):
+        self.builder = builder
+        self.level = level
+        self.width = width
+        self.height = height
+        self.buffer = None
+        self.buffer_top = 0
+        self.received = 0
+        self.next_row = 0
+        self.rows = math.ceil(height / builder.tile_size)
+        self.pending = None
+        self.child = None
+        if level > 0:
+            self.child = _Level(
+                builder, level - 1, math.ceil(width / 2), math.ceil(height / 2)
+            )
+
+    def feed(self, strip):
+        self.buffer = _stack(self.buffer, strip)
+        self.received += strip.height
+        self._emit_ready()
+        if self.child is not None:
+            pending = _stack(self.pending, strip)
+            even = pending.height - pending.height % 2
+            self.pending = None
+            if pending.height % 2:
+                self.pending = pending.crop((0, even, pending.width, pending.height))
+            if even:
+                self.child.feed(pending.crop((0, 0, pending.width, even)).reduce(2))
+
+    def finish(self):
+        self._emit_ready()
+        if self.child is not None:
+            if self.pending is not None:
+                self.child.feed(self.pending.reduce(2))
+                self.pending = None
+            self.child.finish()
+
+    def _emit_ready(self):
+        size, overlap = self.builder.tile_size, self.builder.overlap
+        while self.next_row < self.rows:
+            row = self.next_row
+            needed = min(self.height, (row + 1) * size + overlap)
+            if self.received < needed:
+                return
+            start = max(0, row * size - overlap)
+            band = self.buffer.crop(
+                (0, start - self.buffer_top, self.width, needed - self.buffer_top)
+            )
+            self.builder.submit(band, self.level, row, start)
+            self.next_row += 1
+            # Keep only the rows the next tile row overlaps into.
+            keep_from = min(self.received, max(0, (row + 1) * size - overlap))
+            drop = keep_from - self.buffer_top
+            if drop > 0:
+                self.buffer = self.buffer.crop(
+                    (0, drop, self.buffer.width, self.buffer.height)
+                )
+                self.buffer_top = keep_from
+
+
+class PyramidBuilder:
+    def __init__(
+        self,
+        output_dir,
+        tile_size=TILE_SIZE,
+        overlap=OVERLAP,
+        fmt=FORMAT,
+        quality=QUALITY,
+        workers=None,
+        max_decoded_pixels=MAX_DECODED_PIXELS,
+    ):
+        self.output_dir = Path(output_dir)
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.fmt = fmt
+        self.quality = quality
+        self.workers = os.cpu_count() if workers is None else workers
+        self.max_decoded_pixels = max_decoded_pixels
+        self.executor = None
+        self.futures = set()
+
+    def submit(self, image, level, row, band_top):
+        band = (image.mode, image.size, image.tobytes())
+        options = (
+            self.tile_size,
+            self.overlap,
+            self.fmt,
+            self.quality,
+            str(self.files_dir),
+        )
+        if self.executor is None:
+            write_tile_row(band, level, row, band_top, options)
+            return
+        # Bound the bands held in flight so memory stays flat.
+        while len(self.futures) >= self.workers * 2:
+            done, self.futures = wait(self.futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        self.futures.add(
+            self.executor.submit(write_tile_row, band, level, row, band_top, options)
+        )
+
+    def build(self, source, progress=None):
+        """
+        Write ``image.dzi`` and ``image_files/`` for ``source`` into the
+        output directory, replacing any previous pyramid atomically.
+        ``progress`` is called with the fraction of source rows read.
+        Returns (width, height).
+        """
+        reader = StripReader(source, self.max_decoded_pixels)
+        staging = self.output_dir.with_name(self.output_dir.name + ".building")
+        shutil.rmtree(staging, ignore_errors=True)
+        self.files_dir = staging / "image_files"
+        self.files_dir.mkdir(parents=True)
+        if self.workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            width, height = reader.width, reader.height
+            top = _Level(self, level_count(width, height) - 1, width, height)
+            read = 0
+            for strip in reader.strips(self.tile_size * STRIP_TILES):
+                top.feed(strip)
+                read += strip.height
+                if progress is not None:
+                    progress(read / height)
+            top.finish()
+            for future in self.futures:
+                future.result()
+        finally:
+            reader.close()
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+            self.futures = set()
+        (staging / "image.dzi").write_text(
+            descriptor(width, height, self.tile_size, self.overlap, self.fmt)
+        )
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        os.replace(staging, self.output_dir)
+        return width, height
@@ -0,0 +1,62 @@
+from django.core.exceptions import ObjectDoesNotExist
+
+from rockart.api import serializers
+from rockart.models import Site
+
+# Reverse one-to-one tabs, loaded with select_related.
+SINGLE_TABS = {
+    "rock_art": serializers.RockArtInfoSerializer,
+    "conditions": serializers.RockArtConditionSerializer,
+    "attributes": serializers.RockArtAttributesSerializer,
+    "anthropomorph_inventory": serializers.AnthropomorphInventorySerializer,
+    "enigmatic_inventory": serializers.EnigmaticInventorySerializer,
+    "zoomorph_inventory": serializers.ZoomorphInventorySerializer,
+    "general_iconographic_attributes": (
+        serializers.GeneralIconographicAttributesSerializer
+    ),
+}
+
+# Reverse foreign keys, loaded with prefetch_related.
+LIST_TABS = {
+    "panels": serializers.PanelSerializer,
+    "photogrammetry_logs": serializers.PhotogrammetryLogEntrySerializer,
+    "notes": serializers.RockArtNoteSerializer,
+}
+
+
+def dossier_queryset():
+    """
+    Sites with every tab loaded in a fixed number of queries.
+    """
+    return Site.objects.select_related(*SINGLE_TABS).prefetch_related(
+        *LIST_TABS, "rock_art__rock_art_types", "rock_art__rock_art_categories"
+    )
+
+
+def _related_or_none(site, name):
+    try:
+        return getattr(site, name)
+    except ObjectDoesNotExist:
+        return None
+
+
+def build_dossier(site) -> dict:
+    """
+    Serialize a site loaded from dossier_queryset() with all of its tabs.
+    """
+    data = {"site": serializers.SiteSerializer(site).data}
+    for name, serializer_class in SINGLE_TABS.items():
+        obj = _related_or_none(site, name)
+        data[name] = serializer_class(obj).data if obj is not None else None
+    for name, serializer_class in LIST_TABS.items():
+        data[name] = serializer_class(getattr(site, name).all(), many=True).data
+    return data
+
+
+def get_dossier(site_id) -> dict:
+    return build_dossier(dossier_queryset().get(pk=site_id))
+
+
+async def aget_dossier(site_id) -> dict:
+    site = await dossier_queryset().aget(pk=site_id)
+    return build_dossier(site)
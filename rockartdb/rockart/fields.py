@@ -0,0 +1,148 @@
+"""
+CompressedTextField: a TextField stored zlib-compressed.
+
+On SQLite the column is a BLOB holding a one-byte header and the UTF-8
+text, deflated when that makes it smaller. Values are decompressed when
+the attribute is first read, not when the row is loaded, and rows saved
+again without touching the field write the stored bytes back as they are.
+``values()`` rows hold CompressedText objects; ``str()`` gives the text.
+
+PostgreSQL already compresses long text values itself (TOAST), so there
+the column stays plain text.
+
+Compressed text cannot be matched with ``contains``/``icontains``; fields
+declared with ``search_index=True`` get a full-text index and a ``search``
+lookup instead (see rockart.search).
+"""
+
+import zlib
+
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+PLAIN = b"\x00"
+ZLIB = b"\x01"
+
+# Shorter values do not shrink enough to be worth deflating.
+MIN_COMPRESSED_LENGTH = 64
+
+
+def compress(text) -> bytes:
+    data = text.encode()
+    if len(data) >= MIN_COMPRESSED_LENGTH:
+        deflated = zlib.compress(data)
+        if len(deflated) < len(data):
+            return ZLIB + deflated
+    return PLAIN + data
+
+
+def decompress(payload) -> str:
+    header, data = payload[:1], payload[1:]
+    if header == ZLIB:
+        return zlib.decompress(data).decode()
+    if header == PLAIN:
+        return bytes(data).decode()
+    raise ValueError(f"Unknown compressed text header {header!r}.")
+
+
+def inflate(value):
+    """
+    The text of a stored value: compressed bytes, or plain text written
+    before the column was compressed. Registered as the rockart_inflate()
+    SQL function on SQLite.
+    """
+    if isinstance(value, (bytes, memoryview)):
+        return decompress(value)
+    return value
+
+
+class CompressedText:
+    """
+    A stored value, decompressed on demand.
+    """
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        return decompress(self.payload)
+
+    def __eq__(self, other):
+        if isinstance(other, CompressedText):
+            return self.payload == other.payload
+        return str(self) == other
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __repr__(self):
+        return f"<CompressedText: {len(self.payload)} bytes>"
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    # A data descriptor, so reads go through __get__ even once the value
+    # is in the instance __dict__.
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedText):
+            value = instance.__dict__[self.field.attname] = str(value)
+        return value
+
+
+class CompressedTextField(models.TextField):
+    descriptor_class = CompressedTextDescriptor
+
+    def __init__(self, *args, search_index=False, **kwargs):
+        self.search_index = search_index
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.search_index:
+            kwargs["search_index"] = True
+        return name, path, args, kwargs
+
+    def db_type(self, connection):
+        if connection.vendor == "sqlite":
+            return "BLOB"
+        return super().db_type(connection)
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, (bytes, memoryview)):
+            return CompressedText(bytes(value))
+        return value
+
+    def to_python(self, value):
+        if isinstance(value, CompressedText):
+            return str(value)
+        return super().to_python(value)
+
+    def pre_save(self, model_instance, add):
+        # Read the stored value as it is, so an untouched field is not
+        # decompressed only to be compressed again.
+        if self.attname in model_instance.__dict__:
+            return model_instance.__dict__[self.attname]
+        return super().pre_save(model_instance, add)
+
+    def get_prep_value(self, value):
+        if isinstance(value, CompressedText):
+            return value
+        return super().get_prep_value(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        if connection.vendor != "sqlite":
+            return str(value)
+        if isinstance(value, CompressedText):
+            return connection.Database.Binary(value.payload)
+        return connection.Database.Binary(compress(value))
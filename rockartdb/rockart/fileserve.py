@@ -0,0 +1,132 @@
+import mimetypes
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+)
+from django.utils.http import http_date
+
+# Derived files are addressed by the hash of their source, so a URL always
+# names the same bytes. They are only cached privately because the API
+# requires a login.
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class _RangeFile:
+    """
+    File wrapper that reads at most ``length`` bytes from ``start``.
+    """
+
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) inclusive for a single "bytes=" range, None to
+    serve the whole file, or raise ValueError when it cannot be satisfied.
+    Multiple ranges are answered with the whole file.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+
+def _sendfile_value(path):
+    """
+    What the front-end server expects in the sendfile header: an internal
+    URL below ROCKART_SENDFILE_URL for nginx's X-Accel-Redirect, the
+    absolute path for X-Sendfile.
+    """
+    if settings.ROCKART_SENDFILE_HEADER == "X-Accel-Redirect":
+        relative = path.relative_to(Path(settings.MEDIA_ROOT)).as_posix()
+        return settings.ROCKART_SENDFILE_URL.rstrip("/") + "/" + relative
+    return str(path)
+
+
+def serve_file(request, path, content_type=None, cache_control=None):
+    """
+    Stream a file below MEDIA_ROOT with conditional GET and single byte
+    range support, or hand it to the front-end server (which then handles
+    ranges itself) when ROCKART_SENDFILE_HEADER is configured.
+    """
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise Http404("File not found.")
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    content_type = content_type or (
+        mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    )
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponseNotModified()
+    elif getattr(settings, "ROCKART_SENDFILE_HEADER", None):
+        response = HttpResponse(content_type=content_type)
+        response[settings.ROCKART_SENDFILE_HEADER] = _sendfile_value(path)
+    else:
+        response = _file_response(request, path, stat.st_size, etag, content_type)
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Accept-Ranges"] = "bytes"
+    if cache_control:
+        response["Cache-Control"] = cache_control
+    return response
+
+
+def _file_response(request, path, size, etag, content_type):
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+    if byte_range is None:
+        return FileResponse(open(path, "rb"), content_type=content_type)
+    start, end = byte_range
+    length = end - start + 1
+    # FileResponse closes the file once the body is sent.
+    response = FileResponse(
+        _RangeFile(open(path, "rb"), start, length),  # noqa: SIM115
+        content_type=content_type,
+        status=206,
+    )
+    response["Content-Length"] = str(length)
+    response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
@@ -1,5 +1,8 @@
+from functools import partial
+
 from django import forms
 
+from . import vocab
 from .models import (
     AnthropomorphInventory,
     EnigmaticInventory,
@@ -7,11 +10,9 @@ from .models import (
     Panel,
     PhotogrammetryLogEntry,
     RockArtAttributes,
-    RockArtCategory,
     RockArtCondition,
     RockArtInfo,
     RockArtNote,
-    RockArtType,
     Site,
     ZoomorphInventory,
 )
@@ -20,19 +21,100 @@ from .models import (
 class BootstrapMixin:
     """
     Add Bootstrap form-control classes to inputs for quick styling.
+
+    The classes are set on the class's base_fields the first time a form is
+    built; every instance then gets them with its copy of the fields.
     """
 
     def __init__(self, *args, **kwargs):
+        cls = type(self)
+        if not cls.__dict__.get("_bootstrap_styled"):
+            for field in cls.base_fields.values():
+                _style_widget(field.widget)
+            cls._bootstrap_styled = True
         super().__init__(*args, **kwargs)
-        for field in self.fields.values():
-            widget = field.widget
-            if isinstance(widget, (forms.CheckboxInput, forms.CheckboxSelectMultiple)):
-                widget.attrs.setdefault("class", "form-check-input")
-            elif isinstance(widget, forms.DateInput):
-                widget.attrs.setdefault("class", "form-control")
-                widget.attrs.setdefault("type", "date")
-            else:
-                widget.attrs.setdefault("class", "form-control")
+
+
+def _style_widget(widget):
+    if isinstance(widget, (forms.CheckboxInput, forms.CheckboxSelectMultiple)):
+        widget.attrs.setdefault("class", "form-check-input")
+    elif isinstance(widget, forms.DateInput):
+        widget.attrs.setdefault("class", "form-control")
+        widget.attrs.setdefault("type", "date")
+    else:
+        widget.attrs.setdefault("class", "form-control")
+
+
+def _in_vocabulary(vocabulary, value):
+    # Validate against the current rows, not a snapshot another worker's
+    # edit may not have reached yet.
+    try:
+        pk = int(value)
+    except (TypeError, ValueError):
+        return False
+    return pk in vocab.get(fresh=True).names[vocabulary]
+
+
+class VocabularyMultipleChoiceField(forms.TypedMultipleChoiceField):
+    """
+    Rock art types or categories, with choices and validation served from
+    the vocabulary cache instead of a query per render.
+    """
+
+    def __init__(self, vocabulary, **kwargs):
+        self.vocabulary = vocabulary
+        super().__init__(
+            choices=partial(vocab.choices, vocabulary), coerce=int, **kwargs
+        )
+
+    def prepare_value(self, value):
+        # A bound instance supplies its related objects as the initial value.
+        if isinstance(value, (list, tuple)):
+            return [getattr(item, "pk", item) for item in value]
+        return value
+
+    def has_changed(self, initial, data):
+        return super().has_changed(self.prepare_value(initial), data)
+
+    def valid_value(self, value):
+        return _in_vocabulary(self.vocabulary, value)
+
+    def clean(self, value):
+        snapshot = vocab.get(fresh=True)
+        return [snapshot.instance(self.vocabulary, pk) for pk in super().clean(value)]
+
+
+class VocabularyChoiceField(forms.TypedChoiceField):
+    """
+    Optional single rock art type or category, served from the vocabulary
+    cache.
+    """
+
+    def __init__(self, vocabulary, **kwargs):
+        self.vocabulary = vocabulary
+        kwargs.setdefault("required", False)
+        super().__init__(
+            choices=partial(self._choices, vocabulary),
+            coerce=int,
+            empty_value=None,
+            **kwargs,
+        )
+
+    @staticmethod
+    def _choices(vocabulary):
+        return [("", "---------"), *vocab.choices(vocabulary)]
+
+    def prepare_value(self, value):
+        return getattr(value, "pk", value)
+
+    def valid_value(self, value):
+        return _in_vocabulary(self.vocabulary, value)
+
+    def clean(self, value):
+        pk = super().clean(value)
+        if pk is None:
+            return None
+        return vocab.get(fresh=True).instance(self.vocabulary, pk)
 
 
 class SiteForm(BootstrapMixin, forms.ModelForm):
@@ -46,6 +128,9 @@ class SiteForm(BootstrapMixin, forms.ModelForm):
             "recorders",
             "temporary_housing",
             "permanent_housing",
+            "latitude",
+            "longitude",
+            "elevation_m",
         ]
         widgets = {
             "date_recorded": forms.DateInput(attrs={"type": "date"}),
@@ -54,15 +139,11 @@ class SiteForm(BootstrapMixin, forms.ModelForm):
 
 
 class RockArtInfoForm(BootstrapMixin, forms.ModelForm):
-    rock_art_types = forms.ModelMultipleChoiceField(
-        queryset=RockArtType.objects.all(),
-        required=False,
-        widget=forms.CheckboxSelectMultiple,
+    rock_art_types = VocabularyMultipleChoiceField(
+        vocab.TYPES, required=False, widget=forms.CheckboxSelectMultiple
     )
-    rock_art_categories = forms.ModelMultipleChoiceField(
-        queryset=RockArtCategory.objects.all(),
-        required=False,
-        widget=forms.CheckboxSelectMultiple,
+    rock_art_categories = VocabularyMultipleChoiceField(
+        vocab.CATEGORIES, required=False, widget=forms.CheckboxSelectMultiple
     )
 
     class Meta:
@@ -98,6 +179,8 @@ class RockArtConditionForm(BootstrapMixin, forms.ModelForm):
 
 
 class RockArtAttributesForm(BootstrapMixin, forms.ModelForm):
+    rock_art_category = VocabularyChoiceField(vocab.CATEGORIES)
+
     class Meta:
         model = RockArtAttributes
         exclude = ["site"]
@@ -0,0 +1,262 @@
+import math
+
+from django.db import connection, connections
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.expressions import RawSQL
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+RTREE_TABLE = "rockart_site_rtree"
+
+# The R*Tree is kept in step with rockart_site by triggers. Django rebuilds
+# SQLite tables on some ALTERs, which drops triggers, so ensure_spatial_index
+# also runs after every migrate.
+SQLITE_SPATIAL_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE}
+    USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS rockart_site_rtree_insert
+    AFTER INSERT ON rockart_site
+    WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+    BEGIN
+        INSERT INTO {RTREE_TABLE}
+        VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS rockart_site_rtree_update
+    AFTER UPDATE OF id, latitude, longitude ON rockart_site
+    BEGIN
+        DELETE FROM {RTREE_TABLE} WHERE id = OLD.id;
+        INSERT INTO {RTREE_TABLE}
+        SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+        WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS rockart_site_rtree_delete
+    AFTER DELETE ON rockart_site
+    BEGIN
+        DELETE FROM {RTREE_TABLE} WHERE id = OLD.id;
+    END
+    """,
+]
+
+SQLITE_RESYNC_SQL = [
+    f"DELETE FROM {RTREE_TABLE}",
+    f"""
+    INSERT INTO {RTREE_TABLE}
+    SELECT id, latitude, latitude, longitude, longitude FROM rockart_site
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    """,
+]
+
+POSTGRES_SPATIAL_SQL = [
+    """
+    CREATE INDEX IF NOT EXISTS rockart_site_point_gist
+    ON rockart_site USING gist (point(longitude, latitude))
+    """,
+]
+
+
+def spatial_backend(conn=None):
+    """
+    "rtree", "gist" or None when only the plain B-tree index is available.
+    """
+    vendor = (conn or connection).vendor
+    if vendor == "sqlite":
+        return "rtree"
+    if vendor == "postgresql":
+        return "gist"
+    return None
+
+
+def ensure_spatial_index(conn=None, resync=False):
+    conn = conn or connection
+    backend = spatial_backend(conn)
+    if backend == "rtree":
+        statements = SQLITE_SPATIAL_SQL + (SQLITE_RESYNC_SQL if resync else [])
+    elif backend == "gist":
+        statements = POSTGRES_SPATIAL_SQL
+    else:
+        return
+    with conn.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def ensure_spatial_index_after_migrate(sender, using="default", **kwargs):
+    """
+    post_migrate handler: restore triggers dropped by a table rebuild.
+    """
+    conn = connections[using]
+    with conn.cursor() as cursor:
+        columns = {
+            column.name
+            for column in conn.introspection.get_table_description(
+                cursor, "rockart_site"
+            )
+        }
+    if {"latitude", "longitude"} <= columns:
+        ensure_spatial_index(conn)
+
+
+def drop_spatial_index(conn=None):
+    conn = conn or connection
+    backend = spatial_backend(conn)
+    if backend == "rtree":
+        statements = [
+            "DROP TRIGGER IF EXISTS rockart_site_rtree_insert",
+            "DROP TRIGGER IF EXISTS rockart_site_rtree_update",
+            "DROP TRIGGER IF EXISTS rockart_site_rtree_delete",
+            f"DROP TABLE IF EXISTS {RTREE_TABLE}",
+        ]
+    elif backend == "gist":
+        statements = ["DROP INDEX IF EXISTS rockart_site_point_gist"]
+    else:
+        return
+    with conn.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = (
+        math.sin(dphi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def filter_bbox(queryset, min_lon, min_lat, max_lon, max_lat):
+    """
+    Sites whose location lies inside the bounding box.
+    """
+    backend = spatial_backend(connections[queryset.db])
+    if backend == "rtree":
+        queryset = queryset.filter(
+            pk__in=RawSQL(
+                f"SELECT id FROM {RTREE_TABLE} WHERE max_lat >= %s AND min_lat <= %s"
+                " AND max_lon >= %s AND min_lon <= %s",
+                (min_lat, max_lat, min_lon, max_lon),
+            )
+        )
+    elif backend == "gist":
+        queryset = queryset.filter(
+            pk__in=RawSQL(
+                "SELECT id FROM rockart_site WHERE point(longitude, latitude)"
+                " <@ box(point(%s, %s), point(%s, %s))",
+                (min_lon, min_lat, max_lon, max_lat),
+            )
+        )
+    # The R*Tree stores 32-bit floats rounded outwards; re-check exactly.
+    return queryset.filter(
+        latitude__gte=min_lat,
+        latitude__lte=max_lat,
+        longitude__gte=min_lon,
+        longitude__lte=max_lon,
+    )
+
+
+def _window(lat, radius_km):
+    """
+    A bounding box that contains every point within radius_km of lat.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    edge = min(89.999, abs(lat) + dlat)
+    dlon = min(180.0, dlat / math.cos(math.radians(edge)))
+    return dlat, dlon
+
+
+def nearest_site_ids(queryset, lat, lon, k, radius_km=5.0):
+    """
+    Ids of the k located sites closest to (lat, lon), nearest first.
+
+    Candidates come from growing bounding-box lookups on the spatial index
+    until the k-th nearest candidate is closer than the window edge, so
+    the answer is exact while only touching nearby rows.
+    """
+    located = queryset.filter(latitude__isnull=False, longitude__isnull=False)
+    while True:
+        dlat, dlon = _window(lat, radius_km)
+        window = filter_bbox(
+            located,
+            max(-180.0, lon - dlon),
+            max(-90.0, lat - dlat),
+            min(180.0, lon + dlon),
+            min(90.0, lat + dlat),
+        )
+        whole_world = dlat >= 180 and dlon >= 180
+        if lon - dlon < -180 or lon + dlon > 180:
+            # The window crosses the antimeridian; fall back to a scan.
+            window, whole_world = located, True
+        candidates = sorted(
+            (haversine_km(lat, lon, site_lat, site_lon), pk)
+            for pk, site_lat, site_lon in window.values_list(
+                "pk", "latitude", "longitude"
+            )
+        )
+        if whole_world or (len(candidates) >= k and candidates[k - 1][0] <= radius_km):
+            return [pk for _, pk in candidates[:k]]
+        if len(candidates) >= k:
+            radius_km = candidates[k - 1][0]
+        else:
+            radius_km *= 4
+
+
+def filter_nearest(queryset, lat, lon, k):
+    """
+    The k nearest sites ordered by distance.
+    """
+    ids = nearest_site_ids(queryset, lat, lon, k)
+    if not ids:
+        return queryset.none()
+    ordering = Case(
+        *(When(pk=pk, then=Value(position)) for position, pk in enumerate(ids)),
+        output_field=IntegerField(),
+    )
+    return queryset.filter(pk__in=ids).order_by(ordering)
+
+
+def nearest_first(lat, lon):
+    """
+    A sort key putting sites in the order filter_nearest() returns them,
+    for merging the nearest sites of several databases.
+    """
+
+    def key(site):
+        return haversine_km(lat, lon, site.latitude, site.longitude), site.pk
+
+    return key
+
+
+def parse_bbox(value):
+    """
+    Parse "min_lon,min_lat,max_lon,max_lat"; raise ValueError when invalid.
+    """
+    parts = [float(part) for part in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox needs min_lon,min_lat,max_lon,max_lat")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise ValueError("bbox is out of range or inverted")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def parse_point(value):
+    """
+    Parse "lon,lat"; raise ValueError when invalid.
+    """
+    parts = [float(part) for part in value.split(",")]
+    if len(parts) != 2:
+        raise ValueError("point needs lon,lat")
+    lon, lat = parts
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise ValueError("point is out of range")
+    return lon, lat
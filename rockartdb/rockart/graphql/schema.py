@@ -1,7 +1,9 @@
 import graphene
+from django.db.models import Prefetch
 from graphene_django import DjangoObjectType
 
-from rockart import models
+from rockart import geo, models, shards, vocab
+from rockart.db_routers import use_shard
 
 
 class SiteType(DjangoObjectType):
@@ -10,11 +12,47 @@ class SiteType(DjangoObjectType):
         fields = "__all__"
 
 
+def _vocabulary_ids(obj, relation):
+    """
+    Ids of a vocabulary relation, from the prefetched rows when
+    rock_art_info_queryset() loaded them.
+    """
+    prefetched = getattr(obj, "_prefetched_objects_cache", {})
+    if relation in prefetched:
+        return [item.pk for item in prefetched[relation]]
+    return list(getattr(obj, relation).values_list("pk", flat=True))
+
+
+def _from_vocabulary(vocabulary, ids):
+    snapshot = vocab.get()
+    return [snapshot.instance(vocabulary, pk) for pk in ids]
+
+
+def rock_art_info_queryset():
+    # Only the ids come from the database; names come from the vocabulary
+    # cache.
+    return models.RockArtInfo.objects.select_related("site").prefetch_related(
+        Prefetch("rock_art_types", models.RockArtType.objects.only("pk")),
+        Prefetch("rock_art_categories", models.RockArtCategory.objects.only("pk")),
+    )
+
+
 class RockArtInfoType(DjangoObjectType):
+    rock_art_types = graphene.List(graphene.NonNull(lambda: RockArtTypeType))
+    rock_art_categories = graphene.List(graphene.NonNull(lambda: RockArtCategoryType))
+
     class Meta:
         model = models.RockArtInfo
         fields = "__all__"
 
+    def resolve_rock_art_types(root, info):
+        return _from_vocabulary(vocab.TYPES, _vocabulary_ids(root, "rock_art_types"))
+
+    def resolve_rock_art_categories(root, info):
+        return _from_vocabulary(
+            vocab.CATEGORIES, _vocabulary_ids(root, "rock_art_categories")
+        )
+
 
 class PanelType(DjangoObjectType):
     class Meta:
@@ -29,10 +67,17 @@ class RockArtConditionType(DjangoObjectType):
 
 
 class RockArtAttributesType(DjangoObjectType):
+    rock_art_category = graphene.Field(lambda: RockArtCategoryType)
+
     class Meta:
         model = models.RockArtAttributes
         fields = "__all__"
 
+    def resolve_rock_art_category(root, info):
+        if root.rock_art_category_id is None:
+            return None
+        return vocab.get().instance(vocab.CATEGORIES, root.rock_art_category_id)
+
 
 class RockArtNoteType(DjangoObjectType):
     class Meta:
@@ -83,7 +128,18 @@ class GeneralIconographicAttributesType(DjangoObjectType):
 
 
 class Query(graphene.ObjectType):
-    sites = graphene.List(SiteType)
+    sites = graphene.List(
+        SiteType,
+        bbox=graphene.List(
+            graphene.NonNull(graphene.Float),
+            description="[min_lon, min_lat, max_lon, max_lat]",
+        ),
+        near=graphene.List(
+            graphene.NonNull(graphene.Float),
+            description="[lon, lat]; returns the k nearest sites",
+        ),
+        k=graphene.Int(default_value=10),
+    )
     site = graphene.Field(SiteType, id=graphene.Int(required=True))
 
     rock_art_info = graphene.List(RockArtInfoType)
@@ -99,49 +155,81 @@ class Query(graphene.ObjectType):
     zoomorph_inventories = graphene.List(ZoomorphInventoryType)
     general_iconographic_attributes = graphene.List(GeneralIconographicAttributesType)
 
-    def resolve_sites(root, info):
-        return models.Site.objects.all()
+    def resolve_sites(root, info, bbox=None, near=None, k=10):
+        if near is not None:
+            lon, lat = geo.parse_point(",".join(map(str, near)))
+            if k < 1:
+                raise ValueError("k must be at least 1")
+
+        def sites():
+            queryset = models.Site.objects.all()
+            if bbox is not None:
+                queryset = geo.filter_bbox(
+                    queryset, *geo.parse_bbox(",".join(map(str, bbox)))
+                )
+            if near is not None:
+                queryset = geo.filter_nearest(queryset, lat, lon, k)
+            return queryset
+
+        if near is not None:
+            return shards.across(sites, key=geo.nearest_first(lat, lon), limit=k)
+        return shards.across(sites)
 
     def resolve_site(root, info, id):
-        return models.Site.objects.filter(pk=id).first()
+        if not shards.fans_out():
+            return models.Site.objects.filter(pk=id).first()
+        with use_shard(shards.site_database(id)):
+            return models.Site.objects.filter(pk=id).first()
 
     def resolve_rock_art_info(root, info):
-        return models.RockArtInfo.objects.select_related("site").all()
+        return shards.across(rock_art_info_queryset())
 
     def resolve_panels(root, info):
-        return models.Panel.objects.select_related("site").all()
+        return shards.across(models.Panel.objects.select_related("site").all())
 
     def resolve_notes(root, info):
-        return models.RockArtNote.objects.select_related("site").all()
+        return shards.across(models.RockArtNote.objects.select_related("site").all())
 
     def resolve_photogrammetry_entries(root, info):
-        return models.PhotogrammetryLogEntry.objects.select_related("site").all()
+        return shards.across(
+            models.PhotogrammetryLogEntry.objects.select_related("site").all()
+        )
 
     def resolve_rock_art_types(root, info):
-        return models.RockArtType.objects.all()
+        return _from_vocabulary(vocab.TYPES, vocab.names(vocab.TYPES))
 
     def resolve_rock_art_categories(root, info):
-        return models.RockArtCategory.objects.all()
+        return _from_vocabulary(vocab.CATEGORIES, vocab.names(vocab.CATEGORIES))
 
     def resolve_conditions(root, info):
-        return models.RockArtCondition.objects.select_related("site").all()
+        return shards.across(
+            models.RockArtCondition.objects.select_related("site").all()
+        )
 
     def resolve_attributes(root, info):
-        return models.RockArtAttributes.objects.select_related(
-            "site", "rock_art_category"
-        ).all()
+        return shards.across(
+            models.RockArtAttributes.objects.select_related("site").all()
+        )
 
     def resolve_anthropomorph_inventories(root, info):
-        return models.AnthropomorphInventory.objects.select_related("site").all()
+        return shards.across(
+            models.AnthropomorphInventory.objects.select_related("site").all()
+        )
 
     def resolve_enigmatic_inventories(root, info):
-        return models.EnigmaticInventory.objects.select_related("site").all()
+        return shards.across(
+            models.EnigmaticInventory.objects.select_related("site").all()
+        )
 
     def resolve_zoomorph_inventories(root, info):
-        return models.ZoomorphInventory.objects.select_related("site").all()
+        return shards.across(
+            models.ZoomorphInventory.objects.select_related("site").all()
+        )
 
     def resolve_general_iconographic_attributes(root, info):
-        return models.GeneralIconographicAttributes.objects.select_related("site").all()
+        return shards.across(
+            models.GeneralIconographicAttributes.objects.select_related("site").all()
+        )
 
 
 schema = graphene.Schema(query=Query)
@@ -0,0 +1,238 @@
+"""
+Background jobs stored in the application database, so long-running work
+(deep zoom pyramids, LOD builds, the motif matrix, exports) runs outside
+the request without an external broker.
+
+A handler is a function taking the Job, looked up by ``kind`` in HANDLERS
+and the ROCKART_JOB_HANDLERS setting (dotted paths). Whatever it returns is
+stored as the job's result. Raising JobFailed fails the job for good; any
+other exception is retried with exponential backoff until ``max_attempts``
+is used up.
+"""
+
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from rockart.models import Job, JobStatus
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {
+    "deepzoom": "rockart.media.run_deep_zoom_job",
+    "lod": "rockart.media.run_lod_job",
+    "motifs": "rockart.motifs.run_build_job",
+}
+
+UNFINISHED = (JobStatus.QUEUED, JobStatus.RUNNING)
+
+# Queued rows tried per claim when rows are claimed by conditional UPDATE.
+CLAIM_BATCH = 10
+
+
+class JobFailed(Exception):
+    """
+    Raised by a handler to fail its job without retrying.
+    """
+
+
+def lease_seconds():
+    return getattr(settings, "ROCKART_JOB_LEASE_SECONDS", 60 * 60)
+
+
+def retry_delay():
+    return getattr(settings, "ROCKART_JOB_RETRY_DELAY", 30)
+
+
+def handler_for(kind):
+    handlers = {**HANDLERS, **getattr(settings, "ROCKART_JOB_HANDLERS", {})}
+    if kind not in handlers:
+        raise JobFailed(f"No handler for {kind!r} jobs.")
+    return import_string(handlers[kind])
+
+
+def _jobs():
+    # The queue is read and written on the primary, never on a replica.
+    return Job.objects.db_manager(router.db_for_write(Job))
+
+
+def enqueue(
+    kind,
+    payload=None,
+    *,
+    key="",
+    priority=0,
+    max_attempts=3,
+    run_after=None,
+    created_by=None,
+):
+    """
+    Queue a job. When ``key`` is given and a job with that key is still
+    queued or running, that job is returned instead of a duplicate.
+    """
+    jobs = _jobs()
+    if key:
+        existing = jobs.filter(key=key, status__in=UNFINISHED).first()
+        if existing is not None:
+            return existing
+    return jobs.create(
+        kind=kind,
+        key=key,
+        payload=payload or {},
+        priority=priority,
+        max_attempts=max_attempts,
+        run_after=run_after or timezone.now(),
+        created_by=created_by,
+    )
+
+
+def _expire_leases(jobs, now):
+    """
+    Requeue (or fail, when out of attempts) running jobs whose worker has
+    not reported for a whole lease, i.e. died mid-job.
+    """
+    stale = jobs.filter(
+        status=JobStatus.RUNNING,
+        locked_at__lt=now - timedelta(seconds=lease_seconds()),
+    )
+    error = "Worker stopped reporting; the job's lease expired."
+    stale.filter(attempts__gte=F("max_attempts")).update(
+        status=JobStatus.FAILED, locked_by="", error=error, finished_at=now
+    )
+    stale.update(status=JobStatus.QUEUED, locked_by="", error=error, run_after=now)
+
+
+def claim(worker, kinds=None):
+    """
+    Take the next runnable job for ``worker``, or return None. Rows are
+    locked with SELECT ... FOR UPDATE SKIP LOCKED where the database has
+    it; elsewhere (SQLite) a conditional UPDATE claims them, which is
+    atomic because writes are serialised.
+    """
+    jobs = _jobs()
+    now = timezone.now()
+    _expire_leases(jobs, now)
+    queued = jobs.filter(status=JobStatus.QUEUED, run_after__lte=now).order_by(
+        "-priority", "run_after", "pk"
+    )
+    if kinds:
+        queued = queued.filter(kind__in=kinds)
+    running = {
+        "status": JobStatus.RUNNING,
+        "locked_by": worker,
+        "locked_at": now,
+        "started_at": now,
+        "attempts": F("attempts") + 1,
+    }
+    if connections[jobs.db].features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=jobs.db):
+            job = queued.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            jobs.filter(pk=job.pk).update(**running)
+        return jobs.get(pk=job.pk)
+    for pk in queued.values_list("pk", flat=True)[:CLAIM_BATCH]:
+        # Losing the race for a row just moves on to the next one.
+        if jobs.filter(pk=pk, status=JobStatus.QUEUED).update(**running):
+            return jobs.get(pk=pk)
+    return None
+
+
+def set_progress(job, fraction, message=""):
+    """
+    Report how far a running job is (0 to 1). This also renews its lease.
+    """
+    job.progress = max(0.0, min(1.0, fraction))
+    job.progress_message = message[:255]
+    _jobs().filter(pk=job.pk, status=JobStatus.RUNNING).update(
+        progress=job.progress,
+        progress_message=job.progress_message,
+        locked_at=timezone.now(),
+    )
+
+
+def _finish(job, status, **fields):
+    now = timezone.now()
+    fields.update(status=status, locked_by="", locked_at=None)
+    if status != JobStatus.QUEUED:
+        fields["finished_at"] = now
+    # A worker whose lease expired no longer owns the job.
+    _jobs().filter(pk=job.pk, status=JobStatus.RUNNING, locked_by=job.locked_by).update(
+        **fields
+    )
+    for name, value in fields.items():
+        setattr(job, name, value)
+
+
+def run(job):
+    """
+    Run a claimed job and record its outcome.
+    """
+    try:
+        result = handler_for(job.kind)(job)
+    except JobFailed as exc:
+        _finish(job, JobStatus.FAILED, error=str(exc))
+    except Exception:
+        logger.exception("Job %s failed (attempt %s)", job.pk, job.attempts)
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = retry_delay() * 2 ** (job.attempts - 1)
+            _finish(
+                job,
+                JobStatus.QUEUED,
+                error=error,
+                run_after=timezone.now() + timedelta(seconds=delay),
+            )
+        else:
+            _finish(job, JobStatus.FAILED, error=error)
+    else:
+        _finish(job, JobStatus.SUCCEEDED, result=result, error="", progress=1.0)
+    return job
+
+
+def retry(job):
+    """
+    Queue a failed job again with a fresh set of attempts.
+    """
+    job.status = JobStatus.QUEUED
+    job.attempts = 0
+    job.error = ""
+    job.progress = 0.0
+    job.progress_message = ""
+    job.run_after = timezone.now()
+    job.finished_at = None
+    job.save()
+    return job
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def work(worker=None, kinds=None, once=False, poll=1.0, stop=lambda: False):
+    """
+    Claim and run jobs until ``stop()`` is true or, with ``once``, until no
+    job is runnable. Returns the number of jobs run.
+    """
+    worker = worker or worker_name()
+    count = 0
+    while not stop():
+        close_old_connections()
+        job = claim(worker, kinds)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll)
+            continue
+        run(job)
+        count += 1
+    return count
@@ -0,0 +1,401 @@
+"""
+Level-of-detail variants for photogrammetry meshes and point clouds.
+
+Pure Python (no Django) so builds can run in worker processes. Meshes
+are simplified by vertex clustering: vertices are snapped to a grid of
+``cells`` cells along the longest side of the bounding box, each occupied
+cell collapses to the mean of its vertices and faces that degenerate are
+dropped. Point clouds are thinned the same way, keeping one averaged point
+per occupied cell. Variants are written as binary little-endian PLY.
+
+Readers: OBJ (v/f), PLY (ascii and binary, vertex and face elements) and
+whitespace-separated XYZ/PTS point lists.
+"""
+
+import struct
+from array import array
+from pathlib import Path
+
+# Grid resolutions of the variants, coarse to fine.
+LOD_CELLS = (64, 256, 1024)
+# A variant is only kept if it has at most this share of the next finer
+# model's vertices.
+MIN_REDUCTION = 0.8
+
+MESH = "mesh"
+POINT_CLOUD = "point_cloud"
+
+PLY_TYPES = {
+    "char": "b",
+    "int8": "b",
+    "uchar": "B",
+    "uint8": "B",
+    "short": "h",
+    "int16": "h",
+    "ushort": "H",
+    "uint16": "H",
+    "int": "i",
+    "int32": "i",
+    "uint": "I",
+    "uint32": "I",
+    "float": "f",
+    "float32": "f",
+    "double": "d",
+    "float64": "d",
+}
+
+
+class LodError(Exception):
+    pass
+
+
+class Geometry:
+    """
+    Flat arrays: xyz per vertex, optional rgb per vertex, and three vertex
+    indices per triangle (empty for point clouds).
+    """
+
+    def __init__(self, vertices=None, colors=None, faces=None):
+        self.vertices = vertices if vertices is not None else array("f")
+        self.colors = colors
+        self.faces = faces if faces is not None else array("i")
+
+    @property
+    def vertex_count(self):
+        return len(self.vertices) // 3
+
+    @property
+    def face_count(self):
+        return len(self.faces) // 3
+
+
+def _add_polygon(faces, indices):
+    # Fan-triangulate polygons.
+    for i in range(1, len(indices) - 1):
+        faces.extend((indices[0], indices[i], indices[i + 1]))
+
+
+def read_obj(path):
+    geometry = Geometry()
+    vertices, faces = geometry.vertices, geometry.faces
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("v "):
+                vertices.extend(float(value) for value in line.split()[1:4])
+            elif line.startswith("f "):
+                count = len(vertices) // 3
+                indices = []
+                for token in line.split()[1:]:
+                    index = int(token.split("/")[0])
+                    indices.append(index - 1 if index > 0 else count + index)
+                _add_polygon(faces, indices)
+    return geometry
+
+
+def read_xyz(path):
+    geometry = Geometry(colors=array("B"))
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            parts = line.replace(",", " ").split()
+            if len(parts) < 3 or parts[0].startswith("#"):
+                continue
+            try:
+                geometry.vertices.extend(float(value) for value in parts[:3])
+            except ValueError:
+                continue
+            if len(parts) >= 6:
+                geometry.colors.extend(int(float(v)) & 0xFF for v in parts[-3:])
+    if len(geometry.colors) != len(geometry.vertices):
+        geometry.colors = None
+    return geometry
+
+
+def _read_ply_header(f):
+    if f.readline().strip() != b"ply":
+        raise LodError("Not a PLY file.")
+    fmt, elements = None, []
+    while True:
+        line = f.readline()
+        if not line:
+            raise LodError("Truncated PLY header.")
+        parts = line.decode("ascii", "replace").split()
+        if not parts:
+            continue
+        if parts[0] == "format":
+            fmt = parts[1]
+        elif parts[0] == "element":
+            elements.append((parts[1], int(parts[2]), []))
+        elif parts[0] == "property":
+            if parts[1] == "list":
+                prop = (parts[4], PLY_TYPES[parts[2]], PLY_TYPES[parts[3]])
+            else:
+                prop = (parts[2], PLY_TYPES[parts[1]], None)
+            elements[-1][2].append(prop)
+        elif parts[0] == "end_header":
+            return fmt, elements
+
+
+def _ply_rows(f, fmt, count, props):
+    """
+    Yield each row of an element as a list of values (lists for list
+    properties).
+    """
+    if fmt == "ascii":
+        for _ in range(count):
+            tokens = f.readline().split()
+            row, pos = [], 0
+            for _, kind, item in props:
+                if item is None:
+                    value = tokens[pos]
+                    row.append(float(value) if kind in "fd" else int(value))
+                    pos += 1
+                else:
+                    length = int(tokens[pos])
+                    row.append([int(v) for v in tokens[pos + 1 : pos + 1 + length]])
+                    pos += 1 + length
+            yield row
+        return
+    order = "<" if fmt == "binary_little_endian" else ">"
+    if all(item is None for _, _, item in props):
+        row_struct = struct.Struct(order + "".join(kind for _, kind, _ in props))
+        batch = 65536
+        remaining = count
+        while remaining:
+            n = min(batch, remaining)
+            data = f.read(row_struct.size * n)
+            if len(data) < row_struct.size * n:
+                raise LodError("Truncated PLY body.")
+            yield from map(list, row_struct.iter_unpack(data))
+            remaining -= n
+        return
+    for _ in range(count):
+        row = []
+        for _, kind, item in props:
+            if item is None:
+                size = struct.calcsize(kind)
+                row.append(struct.unpack(order + kind, f.read(size))[0])
+            else:
+                (length,) = struct.unpack(order + kind, f.read(struct.calcsize(kind)))
+                size = struct.calcsize(item)
+                row.append(
+                    list(struct.unpack(f"{order}{length}{item}", f.read(size * length)))
+                )
+        yield row
+
+
+def read_ply(path):
+    geometry = Geometry()
+    with open(path, "rb") as f:
+        fmt, elements = _read_ply_header(f)
+        if fmt not in ("ascii", "binary_little_endian", "binary_big_endian"):
+            raise LodError(f"Unsupported PLY format {fmt!r}.")
+        for name, count, props in elements:
+            names = [prop[0] for prop in props]
+            rows = _ply_rows(f, fmt, count, props)
+            if name == "vertex":
+                xyz = [names.index(axis) for axis in ("x", "y", "z")]
+                rgb = None
+                if all(c in names for c in ("red", "green", "blue")):
+                    rgb = [names.index(c) for c in ("red", "green", "blue")]
+                    geometry.colors = array("B")
+                for row in rows:
+                    geometry.vertices.extend(row[i] for i in xyz)
+                    if rgb:
+                        geometry.colors.extend(int(row[i]) & 0xFF for i in rgb)
+            elif name == "face":
+                index = next(
+                    i
+                    for i, n in enumerate(names)
+                    if n in ("vertex_indices", "vertex_index")
+                )
+                for row in rows:
+                    _add_polygon(geometry.faces, row[index])
+            else:
+                for _ in rows:
+                    pass
+    return geometry
+
+
+READERS = {".obj": read_obj, ".ply": read_ply, ".xyz": read_xyz, ".pts": read_xyz}
+
+
+def read_geometry(path, suffix=None):
+    """
+    Read a model; ``suffix`` names the format when the path has none (as
+    with content-addressed storage).
+    """
+    suffix = (suffix or Path(path).suffix).lower()
+    reader = READERS.get(suffix)
+    if reader is None:
+        raise LodError(f"Unsupported 3D format: {suffix or 'unknown'}")
+    try:
+        geometry = reader(path)
+    except (struct.error, ValueError, IndexError, KeyError, StopIteration) as exc:
+        raise LodError(f"Malformed {suffix} file: {exc}") from exc
+    if not geometry.vertex_count:
+        raise LodError("The model has no vertices.")
+    return geometry
+
+
+def cluster(geometry, cells):
+    """
+    Vertex-clustering simplification on a grid of ``cells`` along the
+    longest side of the bounding box.
+    """
+    v = geometry.vertices
+    lows = [min(v[axis::3]) for axis in range(3)]
+    highs = [max(v[axis::3]) for axis in range(3)]
+    step = max(h - lo for h, lo in zip(highs, lows)) / cells or 1.0
+    x0, y0, z0 = lows
+
+    slots = {}
+    sums = []
+    counts = []
+    color_sums = [] if geometry.colors is not None else None
+    remap = array("i", bytes(4 * geometry.vertex_count))
+    colors = geometry.colors
+    for i in range(geometry.vertex_count):
+        x, y, z = v[3 * i], v[3 * i + 1], v[3 * i + 2]
+        key = (int((x - x0) / step), int((y - y0) / step), int((z - z0) / step))
+        slot = slots.get(key)
+        if slot is None:
+            slot = slots[key] = len(counts)
+            sums.append([0.0, 0.0, 0.0])
+            counts.append(0)
+            if color_sums is not None:
+                color_sums.append([0, 0, 0])
+        total = sums[slot]
+        total[0] += x
+        total[1] += y
+        total[2] += z
+        counts[slot] += 1
+        if color_sums is not None:
+            c = color_sums[slot]
+            c[0] += colors[3 * i]
+            c[1] += colors[3 * i + 1]
+            c[2] += colors[3 * i + 2]
+        remap[i] = slot
+
+    result = Geometry()
+    for total, count in zip(sums, counts):
+        result.vertices.extend(value / count for value in total)
+    if color_sums is not None:
+        result.colors = array("B")
+        for total, count in zip(color_sums, counts):
+            result.colors.extend(round(value / count) for value in total)
+
+    seen = set()
+    faces = geometry.faces
+    for i in range(0, len(faces), 3):
+        a, b, c = remap[faces[i]], remap[faces[i + 1]], remap[faces[i + 2]]
+        if a == b or b == c or a == c:
+            continue
+        # Rotate the smallest index first so duplicates compare equal while
+        # the winding (and so the normal) is preserved.
+        if b < a and b < c:
+            a, b, c = b, c, a
+        elif c < a and c < b:
+            a, b, c = c, a, b
+        if (a, b, c) in seen:
+            continue
+        seen.add((a, b, c))
+        result.faces.extend((a, b, c))
+    return result
+
+
+def write_ply(geometry, path):
+    header = [
+        "ply",
+        "format binary_little_endian 1.0",
+        "comment generated by rockartdb",
+        f"element vertex {geometry.vertex_count}",
+        "property float x",
+        "property float y",
+        "property float z",
+    ]
+    if geometry.colors is not None:
+        header += ["property uchar red", "property uchar green", "property uchar blue"]
+    if geometry.faces:
+        header += [
+            f"element face {geometry.face_count}",
+            "property list uchar int vertex_indices",
+        ]
+    header.append("end_header\n")
+    tmp = Path(str(path) + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write("\n".join(header).encode("ascii"))
+        if geometry.colors is None:
+            vertices = array("f", geometry.vertices)
+            if vertices.itemsize != 4:  # pragma: no cover - exotic platforms
+                raise LodError("float32 arrays are required.")
+            if struct.pack("=i", 1) != struct.pack("<i", 1):  # pragma: no cover
+                vertices.byteswap()
+            f.write(vertices.tobytes())
+        else:
+            row = struct.Struct("<fffBBB")
+            v, c = geometry.vertices, geometry.colors
+            f.write(
+                b"".join(
+                    row.pack(
+                        v[3 * i],
+                        v[3 * i + 1],
+                        v[3 * i + 2],
+                        c[3 * i],
+                        c[3 * i + 1],
+                        c[3 * i + 2],
+                    )
+                    for i in range(geometry.vertex_count)
+                )
+            )
+        face = struct.Struct("<Biii")
+        fc = geometry.faces
+        f.writelines(
+            b"".join(
+                face.pack(3, fc[i], fc[i + 1], fc[i + 2])
+                for i in range(start, min(len(fc), start + 3 * 65536), 3)
+            )
+            for start in range(0, len(fc), 3 * 65536)
+        )
+    tmp.replace(path)
+
+
+def build_lods(source, output_dir, suffix=None, cells=LOD_CELLS, progress=None):
+    """
+    Write the variants of one model into ``output_dir`` as <cells>.ply and
+    return their stats, coarse to fine. Runs in a worker process.
+
+    ``progress`` is called with the fraction of levels built before each
+    level.
+    """
+    geometry = read_geometry(source, suffix)
+    kind = MESH if geometry.faces else POINT_CLOUD
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    levels = []
+    finer_count = geometry.vertex_count
+    resolutions = sorted(cells, reverse=True)
+    for done, resolution in enumerate(resolutions):
+        if progress is not None:
+            progress(done / len(resolutions))
+        variant = cluster(geometry, resolution)
+        if variant.vertex_count > finer_count * MIN_REDUCTION:
+            continue
+        path = output_dir / f"{resolution}.ply"
+        write_ply(variant, path)
+        levels.append(
+            {
+                "cells": resolution,
+                "file": path.name,
+                "size": path.stat().st_size,
+                "vertex_count": variant.vertex_count,
+                "face_count": variant.face_count,
+            }
+        )
+        finer_count = variant.vertex_count
+    levels.reverse()
+    return {
+        "kind": kind,
+        "vertex_count": geometry.vertex_count,
+        "face_count": geometry.face_count,
+        "levels": levels,
+    }
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.utils.encoders import JSONEncoder
+
+from rockart import consistency
+
+
+class Command(BaseCommand):
+    help = (
+        "Check every site for panel counts that disagree with the figure "
+        "inventories, panel areas that disagree with their dimensions and tab "
+        "rows without a site, and write the issues found as a JSON report."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default="-",
+            help="Report file (default: standard output).",
+        )
+        parser.add_argument(
+            "--rule",
+            action="append",
+            dest="rules",
+            choices=consistency.rule_names(),
+            help="Only run this rule; repeat for several (default: all).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Check processes (default: one per CPU; 1 checks in-process).",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=consistency.DEFAULT_CHUNK_SIZE,
+            help="Site ids per task.",
+        )
+
+    def handle(self, *args, output, rules, workers, chunk_size, **options):
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive.")
+        report = consistency.check(rules, workers=workers, chunk_size=chunk_size)
+        data = json.dumps(report, cls=JSONEncoder, indent=2)
+        if output == "-":
+            self.stdout.write(data)
+            return
+        with open(output, "w") as f:
+            f.write(data + "\n")
+        totals = ", ".join(f"{name} {n}" for name, n in report["totals"].items())
+        self.stdout.write(
+            f"Checked {report['sites']} sites: {totals}. Report written to {output}"
+        )
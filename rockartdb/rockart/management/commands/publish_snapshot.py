@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rockart import snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Render site dossiers, reports, paged site indexes and vocabularies "
+        "into a static tree for a CDN or file server. Only sites changed since "
+        "the last publish are rendered again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            help="Snapshot directory (default: ROCKART_SNAPSHOT_ROOT).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Render processes (default: one per CPU; 1 renders in-process).",
+        )
+        parser.add_argument(
+            "--full", action="store_true", help="Render every site again."
+        )
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=snapshot.DEFAULT_PAGE_SIZE,
+            help="Sites per index page.",
+        )
+
+    def handle(self, *args, output, workers, full, page_size, **options):
+        if page_size < 1:
+            raise CommandError("--page-size must be positive.")
+        rendered, published = snapshot.publish(
+            output, workers=workers, full=full, page_size=page_size
+        )
+        root = output or snapshot.snapshot_root()
+        self.stdout.write(f"Rendered {rendered} of {published} sites into {root}")
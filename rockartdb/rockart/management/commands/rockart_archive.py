@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rockart import archive, bulk
+
+
+class Command(BaseCommand):
+    help = (
+        "Move sites, by id or by project, with every tab row recorded for them "
+        "to the archive database. They stay readable with ?include_archived=1."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("site_ids", nargs="*", type=int, help="Site ids.")
+        parser.add_argument(
+            "--project", dest="project_name", help="Every site of this project."
+        )
+
+    def handle(self, *args, site_ids, project_name, **options):
+        if not archive.archive_configured():
+            raise CommandError("No 'archive' database is configured.")
+        if not site_ids and project_name is None:
+            raise CommandError("Give site ids or --project.")
+        sites = bulk.site_querysets(site_ids or None, project_name)
+        if not bulk.count_sites(sites):
+            raise CommandError("No sites match.")
+        for label, rows in archive.archive_sites(sites).items():
+            if rows:
+                self.stdout.write(f"{label}: {rows}")
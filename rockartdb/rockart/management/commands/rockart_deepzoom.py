@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rockart import deepzoom, media
+from rockart.models import DeepZoomImage, DerivativeStatus, PhotogrammetryMedia
+
+
+class Command(BaseCommand):
+    help = (
+        "Build deep zoom tile pyramids for panoramas now, instead of through "
+        "the job queue (manage.py rockart_worker)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "media_ids",
+            nargs="*",
+            type=int,
+            help="PhotogrammetryMedia ids to (re)build; default: all pending.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Tile encoding processes (default: one per CPU).",
+        )
+
+    def handle(self, *args, media_ids, workers, **options):
+        if not deepzoom.available():
+            raise CommandError("Pillow is required: pip install 'rockartdb[imaging]'")
+        if media_ids:
+            attachments = PhotogrammetryMedia.objects.filter(pk__in=media_ids)
+            for attachment in attachments.select_related("asset"):
+                dzi, _ = media.request_deep_zoom(attachment.asset)
+                if dzi.status == DerivativeStatus.READY:
+                    # An explicit id rebuilds a finished pyramid.
+                    DeepZoomImage.objects.filter(pk=dzi.pk).update(
+                        status=DerivativeStatus.PENDING
+                    )
+            pending = DeepZoomImage.objects.filter(
+                asset__attachments__in=media_ids, status=DerivativeStatus.PENDING
+            ).distinct()
+        else:
+            pending = DeepZoomImage.objects.filter(status=DerivativeStatus.PENDING)
+        for dzi in pending.select_related("asset"):
+            if not media.build_deep_zoom(dzi, workers=workers):
+                continue
+            if dzi.status == DerivativeStatus.READY:
+                self.stdout.write(
+                    f"{dzi.asset.sha256}: {dzi.width}x{dzi.height} pyramid built"
+                )
+            else:
+                self.stderr.write(f"{dzi.asset.sha256}: failed: {dzi.error}")
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rockart import bulk
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete sites, by id or by project, with every tab row recorded for "
+        "them, using set-based DELETEs in one transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("site_ids", nargs="*", type=int, help="Site ids.")
+        parser.add_argument(
+            "--project", dest="project_name", help="Every site of this project."
+        )
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_false",
+            dest="interactive",
+            help="Do not ask for confirmation.",
+        )
+
+    def handle(self, *args, site_ids, project_name, interactive, **options):
+        if not site_ids and project_name is None:
+            raise CommandError("Give site ids or --project.")
+        sites = bulk.site_querysets(site_ids or None, project_name)
+        count = bulk.count_sites(sites)
+        if not count:
+            raise CommandError("No sites match.")
+        if interactive:
+            answer = input(f"Delete {count} site(s) and all their records? [y/N] ")
+            if answer.strip().lower() not in ("y", "yes"):
+                self.stdout.write("Cancelled.")
+                return
+        for label, rows in bulk.delete_sites(sites).items():
+            if rows:
+                self.stdout.write(f"{label}: {rows}")
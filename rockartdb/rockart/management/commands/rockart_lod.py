@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from rockart import media
+from rockart.models import DerivativeStatus, ThreeDModel
+
+
+class Command(BaseCommand):
+    help = (
+        "Build level-of-detail variants of 3D models now, instead of through "
+        "the job queue (manage.py rockart_worker)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "model_ids",
+            nargs="*",
+            type=int,
+            help="ThreeDModel ids to (re)build; default: all pending.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Models built in parallel processes (default: one per CPU).",
+        )
+
+    def handle(self, *args, model_ids, workers, **options):
+        models = ThreeDModel.objects.select_related("source__asset")
+        if model_ids:
+            # An explicit id rebuilds whatever state the model is in.
+            ThreeDModel.objects.filter(pk__in=model_ids).update(
+                lod_status=DerivativeStatus.PENDING
+            )
+            models = models.filter(pk__in=model_ids)
+        else:
+            models = models.filter(lod_status=DerivativeStatus.PENDING)
+        for model in media.build_three_d_lods(list(models), workers=workers):
+            if model.lod_status == DerivativeStatus.READY:
+                levels = ", ".join(
+                    str(level.vertex_count) for level in model.levels.all()
+                )
+                self.stdout.write(f"{model}: {levels or 'no'} variant vertices")
+            else:
+                self.stderr.write(f"{model}: failed: {model.lod_error}")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rockart import motifs
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the site x motif matrix used by /api/analytics/motifs/, e.g. "
+        "after a bulk import. Saves keep it current afterwards."
+    )
+
+    def handle(self, *args, **options):
+        if not motifs.available():
+            raise CommandError("NumPy is required: pip install 'rockartdb[analytics]'")
+        matrix = motifs.build()
+        self.stdout.write(
+            f"Built {len(matrix.site_ids)} sites x {len(motifs.COLUMNS)} motifs "
+            f"in {motifs.matrix_root() / matrix.generation}"
+        )
@@ -0,0 +1,45 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from rockart import shards
+from rockart.models import ProjectShard
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage the project shards: migrate every shard database, assign a "
+        "project to a shard, or list the assignments."
+    )
+
+    def add_arguments(self, parser):
+        actions = parser.add_subparsers(dest="action", required=True)
+        actions.add_parser("migrate", help="Migrate and prepare every shard.")
+        assign = actions.add_parser(
+            "assign", help="Store a project's new sites in a shard."
+        )
+        assign.add_argument("project_name")
+        assign.add_argument("database", help="A shard alias, or 'default'.")
+        actions.add_parser("list", help="List shards and assigned projects.")
+
+    def handle(self, *args, action, **options):
+        if not shards.sharding_enabled():
+            raise CommandError("No shards are configured (ROCKARTDB_SHARDS).")
+        if action == "migrate":
+            for database in shards.shard_aliases():
+                self.stdout.write(f"Migrating {database}")
+                # post_migrate prepares the shard (see shards.prepare_shard).
+                call_command("migrate", database=database, verbosity=0)
+        elif action == "assign":
+            try:
+                shards.assign(options["project_name"], options["database"])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+        else:
+            assigned = {}
+            for project_name, database in ProjectShard.objects.values_list(
+                "project_name", "database"
+            ).order_by("project_name"):
+                assigned.setdefault(database, []).append(project_name)
+            for database in shards.shard_aliases():
+                projects = ", ".join(assigned.get(database, [])) or "-"
+                self.stdout.write(f"{database}: {projects}")
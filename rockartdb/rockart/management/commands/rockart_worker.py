@@ -0,0 +1,99 @@
+import multiprocessing
+import signal
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+# Only Django itself is imported at module level: with the "spawn" start
+# method, worker processes import this module before Django is set up.
+
+
+@contextmanager
+def _stop_signals():
+    """
+    Turn SIGTERM and SIGINT into a flag, so the current job finishes
+    before the worker exits.
+    """
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    previous = {
+        sig: signal.signal(sig, stop) for sig in (signal.SIGTERM, signal.SIGINT)
+    }
+    try:
+        yield lambda: bool(stopping)
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+
+
+def _work(options):
+    from rockart import jobs
+
+    with _stop_signals() as stopped:
+        return jobs.work(stop=stopped, **options)
+
+
+def _child(options):
+    import django
+
+    django.setup()
+    _work(options)
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (deep zoom, LOD builds and others)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Worker processes, each running one job at a time.",
+        )
+        parser.add_argument(
+            "--kind",
+            action="append",
+            dest="kinds",
+            help="Only run jobs of this kind (repeatable).",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when no job is runnable instead of polling.",
+        )
+        parser.add_argument(
+            "--poll",
+            type=float,
+            default=1.0,
+            help="Seconds between polls of an empty queue.",
+        )
+
+    def handle(self, *args, processes, kinds, once, poll, **options):
+        work_options = {"kinds": kinds, "once": once, "poll": poll}
+        if processes <= 1:
+            count = _work(work_options)
+            self.stdout.write(f"Ran {count} job(s).")
+            return
+        # Children must open their own database connections.
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(
+                target=_child, args=(work_options,), name=f"rockart-worker-{i}"
+            )
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        with _stop_signals() as stopped:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(timeout=1)
+                    if stopped():
+                        # Pass the stop on; workers exit after their job.
+                        for other in workers:
+                            if other.is_alive():
+                                other.terminate()
@@ -0,0 +1,418 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from rockart import deepzoom, jobs, lod
+from rockart.models import (
+    DeepZoomImage,
+    DerivativeStatus,
+    MediaAsset,
+    PhotogrammetryMedia,
+    ThreeDModel,
+    ThreeDModelLevel,
+    UploadChunk,
+    UploadSession,
+    UploadStatus,
+)
+
+# Chunks are streamed from the request in pieces of this size, so memory
+# use does not depend on the chunk or file size.
+READ_BLOCK = 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadConflict(UploadError):
+    pass
+
+
+def default_chunk_size():
+    return getattr(settings, "ROCKART_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)
+
+
+def max_chunk_size():
+    return getattr(settings, "ROCKART_UPLOAD_MAX_CHUNK_SIZE", 64 * 1024 * 1024)
+
+
+def derivative_workers():
+    """
+    Processes one deep zoom or LOD job may fan out to; the worker pool
+    already runs jobs side by side.
+    """
+    return getattr(settings, "ROCKART_DERIVATIVE_WORKERS", 1)
+
+
+def max_decoded_pixels():
+    return getattr(
+        settings, "ROCKART_DEEPZOOM_MAX_DECODED_PIXELS", deepzoom.MAX_DECODED_PIXELS
+    )
+
+
+def media_root() -> Path:
+    return Path(settings.MEDIA_ROOT)
+
+
+def asset_name(sha256) -> str:
+    """
+    Content-addressed storage name, relative to MEDIA_ROOT.
+    """
+    return f"assets/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def part_path(session) -> Path:
+    return media_root() / "uploads" / f"{session.pk}.part"
+
+
+def start_upload(entry, filename, size, sha256, chunk_size=None, **fields):
+    """
+    Open an upload session. When the content is already stored, the file
+    is attached straight away and the returned session is complete.
+    """
+    chunk_size = chunk_size or default_chunk_size()
+    session = UploadSession.objects.create(
+        entry=entry,
+        filename=filename,
+        size=size,
+        sha256=sha256.lower(),
+        chunk_size=chunk_size,
+        **fields,
+    )
+    asset = MediaAsset.objects.filter(sha256=session.sha256, size=size).first()
+    if asset is not None:
+        _attach(session, asset)
+        return session
+    path = part_path(session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # A sparse file of the final size; chunks are written at their offsets,
+    # so they can arrive in parallel and in any order.
+    with open(path, "wb") as part:
+        part.truncate(size)
+    return session
+
+
+def write_chunk(session, index, stream, sha256, length):
+    """
+    Stream one chunk from a file-like object into the part file and record
+    it once its checksum matches. Re-sending a chunk overwrites it.
+    """
+    if session.status != UploadStatus.OPEN:
+        raise UploadConflict("Upload is no longer open.")
+    if not 0 <= index < session.chunk_count:
+        raise UploadError(f"Chunk index must be below {session.chunk_count}.")
+    expected = session.chunk_length(index)
+    if length != expected:
+        raise UploadError(f"Chunk {index} must be {expected} bytes.")
+
+    digest = hashlib.sha256()
+    received = 0
+    fd = os.open(part_path(session), os.O_WRONLY)
+    try:
+        offset = index * session.chunk_size
+        while received < expected:
+            block = stream.read(min(READ_BLOCK, expected - received))
+            if not block:
+                break
+            digest.update(block)
+            os.pwrite(fd, block, offset + received)
+            received += len(block)
+    finally:
+        os.close(fd)
+    if received != expected:
+        raise UploadError(f"Chunk {index} was truncated.")
+    if digest.hexdigest() != sha256.lower():
+        raise UploadError(f"Chunk {index} failed its checksum.")
+    UploadChunk.objects.update_or_create(
+        session=session,
+        index=index,
+        defaults={"size": received, "sha256": digest.hexdigest()},
+    )
+
+
+def missing_chunks(session):
+    received = set(session.chunks.values_list("index", flat=True))
+    return [index for index in range(session.chunk_count) if index not in received]
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete_upload(session):
+    """
+    Verify the assembled file and attach it to the photogrammetry entry,
+    storing its content once.
+    """
+    claimed = UploadSession.objects.filter(
+        pk=session.pk, status=UploadStatus.OPEN
+    ).update(status=UploadStatus.COMPLETING)
+    if not claimed:
+        raise UploadConflict("Upload is already being completed.")
+    session.status = UploadStatus.COMPLETING
+    path = part_path(session)
+    try:
+        missing = missing_chunks(session)
+        if missing:
+            raise UploadError(f"Missing chunks: {missing[:20]}")
+        if _file_sha256(path) != session.sha256:
+            raise UploadError("File does not match its SHA-256.")
+    except UploadError:
+        UploadSession.objects.filter(pk=session.pk).update(status=UploadStatus.OPEN)
+        session.status = UploadStatus.OPEN
+        raise
+
+    name = asset_name(session.sha256)
+    target = media_root() / name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # The name is derived from the verified content, so a concurrent upload
+    # of the same file replaces it with identical bytes.
+    if target.exists():
+        path.unlink()
+    else:
+        os.replace(path, target)
+    try:
+        with transaction.atomic():
+            asset, _ = MediaAsset.objects.get_or_create(
+                sha256=session.sha256,
+                defaults={
+                    "size": session.size,
+                    "file": name,
+                    "content_type": session.content_type,
+                },
+            )
+    except IntegrityError:
+        asset = MediaAsset.objects.get(sha256=session.sha256)
+    _attach(session, asset)
+    return session
+
+
+def _attach(session, asset):
+    media, _ = PhotogrammetryMedia.objects.update_or_create(
+        entry=session.entry, filename=session.filename, defaults={"asset": asset}
+    )
+    session.media = media
+    session.status = UploadStatus.COMPLETE
+    session.completed_at = timezone.now()
+    session.save(update_fields=["media", "status", "completed_at"])
+    session.chunks.all().delete()
+
+
+def asset_path(asset) -> Path:
+    return media_root() / asset.file.name
+
+
+def request_deep_zoom(asset, created_by=None):
+    """
+    Queue a pyramid build for an asset; a failed build is queued again.
+    Returns the DeepZoomImage and its job (None when already built).
+    """
+    dzi, created = DeepZoomImage.objects.get_or_create(asset=asset)
+    if not created and dzi.status == DerivativeStatus.FAILED:
+        dzi.status = DerivativeStatus.PENDING
+        dzi.error = ""
+        dzi.save(update_fields=["status", "error"])
+    job = None
+    if dzi.status != DerivativeStatus.READY:
+        job = jobs.enqueue(
+            "deepzoom",
+            {"image": dzi.pk},
+            key=f"deepzoom:{dzi.pk}",
+            created_by=created_by,
+        )
+    return dzi, job
+
+
+def build_deep_zoom(dzi, workers=None, progress=None):
+    """
+    Build the pyramid of a pending DeepZoomImage. Returns False when
+    another process already claimed it.
+    """
+    claimed = DeepZoomImage.objects.filter(
+        pk=dzi.pk, status=DerivativeStatus.PENDING
+    ).update(status=DerivativeStatus.RUNNING)
+    if not claimed:
+        return False
+    builder = deepzoom.PyramidBuilder(
+        media_root() / dzi.directory,
+        tile_size=dzi.tile_size,
+        overlap=dzi.overlap,
+        fmt=dzi.format,
+        workers=workers,
+        max_decoded_pixels=max_decoded_pixels(),
+    )
+    try:
+        dzi.width, dzi.height = builder.build(asset_path(dzi.asset), progress)
+    except (deepzoom.DeepZoomError, OSError, ValueError) as exc:
+        dzi.status = DerivativeStatus.FAILED
+        dzi.error = str(exc)
+    except BaseException:
+        # Unexpected errors leave the build to be retried.
+        DeepZoomImage.objects.filter(pk=dzi.pk).update(status=DerivativeStatus.PENDING)
+        raise
+    else:
+        dzi.status = DerivativeStatus.READY
+        dzi.error = ""
+        dzi.completed_at = timezone.now()
+    dzi.save()
+    return True
+
+
+def run_deep_zoom_job(job):
+    dzi = (
+        DeepZoomImage.objects.select_related("asset")
+        .filter(pk=job.payload["image"])
+        .first()
+    )
+    if dzi is None:
+        raise jobs.JobFailed("The deep zoom image no longer exists.")
+    if dzi.status == DerivativeStatus.RUNNING and job.attempts > 1:
+        # An earlier attempt died mid-build.
+        DeepZoomImage.objects.filter(pk=dzi.pk).update(status=DerivativeStatus.PENDING)
+    if not build_deep_zoom(
+        dzi,
+        workers=derivative_workers(),
+        progress=lambda done: jobs.set_progress(job, done, "Building pyramid"),
+    ):
+        return {"skipped": True}
+    if dzi.status == DerivativeStatus.FAILED:
+        raise jobs.JobFailed(dzi.error)
+    return {"width": dzi.width, "height": dzi.height}
+
+
+# Raised by unreadable or malformed model files.
+LOD_ERRORS = (lod.LodError, OSError)
+
+
+def _claim_lods(models):
+    claimed = []
+    for model in models:
+        if ThreeDModel.objects.filter(
+            pk=model.pk, lod_status=DerivativeStatus.PENDING
+        ).update(lod_status=DerivativeStatus.RUNNING):
+            claimed.append(model)
+    return claimed
+
+
+def _record_lods(model, result):
+    levels = [
+        ThreeDModelLevel(
+            model=model,
+            cells=level["cells"],
+            size=level["size"],
+            vertex_count=level["vertex_count"],
+            face_count=level["face_count"],
+        )
+        for level in result["levels"]
+    ]
+    with transaction.atomic():
+        model.levels.all().delete()
+        ThreeDModelLevel.objects.bulk_create(levels)
+        model.kind = result["kind"]
+        model.vertex_count = result["vertex_count"]
+        model.face_count = result["face_count"]
+        model.lod_status = DerivativeStatus.READY
+        model.lod_error = ""
+        model.save()
+
+
+def _fail_lods(model, error):
+    model.lod_status = DerivativeStatus.FAILED
+    model.lod_error = str(error)
+    model.save(update_fields=["lod_status", "lod_error"])
+
+
+def request_lods(model, created_by=None):
+    """
+    Queue the level-of-detail build of a pending 3D model.
+    """
+    return jobs.enqueue(
+        "lod", {"model": model.pk}, key=f"lod:{model.pk}", created_by=created_by
+    )
+
+
+def build_three_d_lods(models, workers=None, progress=None):
+    """
+    Build the level-of-detail variants of pending 3D models, one model per
+    worker process. Returns the models that were built or failed.
+    ``progress`` is passed to lod.build_lods() for builds run in this
+    process.
+    """
+    claimed = _claim_lods(models)
+    builds = [
+        (
+            model,
+            asset_path(model.source.asset),
+            media_root() / model.lod_directory,
+            Path(model.source.filename).suffix,
+        )
+        for model in claimed
+    ]
+    workers = os.cpu_count() if workers is None else workers
+
+    def runs():
+        if workers > 1 and len(builds) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(builds))) as pool:
+                futures = [
+                    (model, pool.submit(lod.build_lods, *job)) for model, *job in builds
+                ]
+                for model, future in futures:
+                    yield model, future.result
+        else:
+            for model, *job in builds:
+                yield model, partial(lod.build_lods, *job, progress=progress)
+
+    finished = set()
+    try:
+        for model, run in runs():
+            try:
+                result = run()
+            except LOD_ERRORS as exc:
+                _fail_lods(model, exc)
+            else:
+                _record_lods(model, result)
+            finished.add(model.pk)
+    except BaseException:
+        # Unexpected errors leave the unfinished models to be retried.
+        ThreeDModel.objects.filter(
+            pk__in=[model.pk for model in claimed if model.pk not in finished]
+        ).update(lod_status=DerivativeStatus.PENDING)
+        raise
+    return claimed
+
+
+def run_lod_job(job):
+    model = (
+        ThreeDModel.objects.select_related("source__asset")
+        .filter(pk=job.payload["model"])
+        .first()
+    )
+    if model is None:
+        raise jobs.JobFailed("The 3D model no longer exists.")
+    if model.lod_status == DerivativeStatus.RUNNING and job.attempts > 1:
+        # An earlier attempt died mid-build.
+        model.lod_status = DerivativeStatus.PENDING
+        ThreeDModel.objects.filter(pk=model.pk).update(
+            lod_status=DerivativeStatus.PENDING
+        )
+    # Reporting progress between levels renews the job's lease.
+    built = build_three_d_lods(
+        [model],
+        workers=derivative_workers(),
+        progress=lambda done: jobs.set_progress(job, done, "Building levels"),
+    )
+    if not built:
+        return {"skipped": True}
+    if model.lod_status == DerivativeStatus.FAILED:
+        raise jobs.JobFailed(model.lod_error)
+    return {"levels": [level.vertex_count for level in model.levels.all()]}
@@ -0,0 +1,235 @@
+import json
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import Resolver404, resolve
+from graphql import parse
+from graphql.error import GraphQLError
+
+from rockart.db_routers import _read_from_replica, use_shard
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+GRAPHQL_URL_NAMES = ("graphql", "graphql-api", "async-graphql")
+
+PRIMARY_PIN_COOKIE = "rockart_primary_pin"
+
+
+def _pin_seconds() -> int:
+    return getattr(settings, "ROCKART_REPLICA_PIN_SECONDS", 10)
+
+
+def _pin_cache_key(user_id) -> str:
+    return f"rockart:primary-pin:{user_id}"
+
+
+def _graphql_query(request):
+    if request.method == "GET":
+        return request.GET.get("query")
+    if request.content_type == "application/json":
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+        return body.get("query") if isinstance(body, dict) else None
+    return request.POST.get("query")
+
+
+def is_graphql_read(request) -> bool:
+    """
+    True when the request's GraphQL document only contains query operations.
+    """
+    return is_query_document(_graphql_query(request))
+
+
+def is_query_document(query) -> bool:
+    """
+    True when the GraphQL document only contains query operations.
+    """
+    if not query:
+        return False
+    try:
+        document = parse(query)
+    except GraphQLError:
+        # Let the GraphQL view report the syntax error from the primary.
+        return False
+    operations = [
+        definition.operation
+        for definition in document.definitions
+        if hasattr(definition, "operation")
+    ]
+    return bool(operations) and all(op == "query" for op in operations)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Mark safe-method requests and GraphQL queries as replica reads.
+
+    A user who just wrote is pinned to the primary for
+    ROCKART_REPLICA_PIN_SECONDS so they read their own writes while the
+    replica catches up. The pin is kept both in the cache (keyed by user)
+    and in a short-lived cookie for clients that authenticate per request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        is_read = self._is_read(request)
+        token = None
+        if is_read and not self._is_pinned(request):
+            token = _read_from_replica.set(True)
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                _read_from_replica.reset(token)
+        if not is_read and response.status_code < 400:
+            self._pin_to_primary(request, response)
+        return response
+
+    async def __acall__(self, request):
+        is_read = self._is_read(request)
+        token = None
+        if is_read and not await self._ais_pinned(request):
+            token = _read_from_replica.set(True)
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                _read_from_replica.reset(token)
+        if not is_read and response.status_code < 400:
+            await self._apin_to_primary(request, response)
+        return response
+
+    def _is_read(self, request) -> bool:
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            url_name = None
+        if url_name in GRAPHQL_URL_NAMES:
+            return is_graphql_read(request)
+        return request.method in SAFE_METHODS
+
+    def _is_pinned(self, request) -> bool:
+        if request.COOKIES.get(PRIMARY_PIN_COOKIE):
+            return True
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return bool(cache.get(_pin_cache_key(user.pk)))
+        return False
+
+    async def _ais_pinned(self, request) -> bool:
+        if request.COOKIES.get(PRIMARY_PIN_COOKIE):
+            return True
+        user = await request.auser()
+        if user.is_authenticated:
+            return bool(await cache.aget(_pin_cache_key(user.pk)))
+        return False
+
+    def _pin_to_primary(self, request, response):
+        seconds = _pin_seconds()
+        if seconds <= 0:
+            return
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            cache.set(_pin_cache_key(user.pk), True, timeout=seconds)
+        response.set_cookie(
+            PRIMARY_PIN_COOKIE, "1", max_age=seconds, httponly=True, samesite="Lax"
+        )
+
+    async def _apin_to_primary(self, request, response):
+        seconds = _pin_seconds()
+        if seconds <= 0:
+            return
+        user = await request.auser()
+        if user.is_authenticated:
+            await cache.aset(_pin_cache_key(user.pk), True, timeout=seconds)
+        response.set_cookie(
+            PRIMARY_PIN_COOKIE, "1", max_age=seconds, httponly=True, samesite="Lax"
+        )
+
+
+def _json_body(request):
+    if request.content_type != "application/json":
+        return {}
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ShardRoutingMiddleware:
+    """
+    Route the request's site rows to the shard of the site or project it
+    names (see rockart.shards): a site id in the URL, the id of a site or
+    tab row in a detail URL, or a ``site`` or ``project_name`` in the query
+    string or JSON body. Requests that name none read every database.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        from rockart import shards
+
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not shards.sharding_enabled():
+            return self.get_response(request)
+        with use_shard(self._shard(request, shards)):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        from rockart import shards
+
+        if not shards.sharding_enabled():
+            return await self.get_response(request)
+        # Site and project ids are looked up in the default database.
+        database = await sync_to_async(self._shard)(request, shards)
+        with use_shard(database):
+            return await self.get_response(request)
+
+    def _shard(self, request, shards):
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        site_id = _as_id(match.kwargs.get("site_id"))
+        if site_id is not None:
+            return shards.site_database(site_id)
+        pk = _as_id(match.kwargs.get("pk"))
+        if pk is not None:
+            # Site routes, and their native async copies.
+            if (match.url_name or "").removeprefix("async-").startswith("site-"):
+                return shards.site_database(pk)
+            return shards.row_database(pk)
+        params = request.GET
+        if request.method not in SAFE_METHODS:
+            params = {**_json_body(request), **params.dict()}
+        site_id = _as_id(params.get("site"))
+        if site_id is not None:
+            return shards.site_database(site_id)
+        if params.get("project_name"):
+            return shards.project_database(params["project_name"])
+        return None
@@ -0,0 +1,54 @@
+from typing import ClassVar
+
+# Generated by Django 5.2.18 on 2026-10-19 17:30
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies: ClassVar[list[tuple[str, str]]] = [
+        ("rockart", "0001_initial"),
+    ]
+
+    operations: ClassVar[list[migrations.operations.base.Operation]] = [
+        migrations.CreateModel(
+            name="ChangeLogEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model", models.CharField(max_length=64)),
+                ("object_id", models.BigIntegerField()),
+                (
+                    "site_id",
+                    models.BigIntegerField(
+                        blank=True,
+                        help_text="Owning site, kept after it is deleted.",
+                        null=True,
+                    ),
+                ),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[("upsert", "Upsert"), ("delete", "Delete")],
+                        max_length=8,
+                    ),
+                ),
+                ("changed_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["model", "object_id"],
+                        name="rockart_cha_model_15d3d8_idx",
+                    )
+                ],
+            },
+        ),
+    ]
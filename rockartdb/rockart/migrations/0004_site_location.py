@@ -0,0 +1,63 @@
+from typing import ClassVar
+
+# Generated by Django 5.2.18 on 2026-10-19 17:34
+import django.core.validators
+from django.db import migrations, models
+
+from rockart import geo
+
+
+def create_spatial_index(apps, schema_editor):
+    geo.ensure_spatial_index(schema_editor.connection, resync=True)
+
+
+def drop_spatial_index(apps, schema_editor):
+    geo.drop_spatial_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies: ClassVar[list[tuple[str, str]]] = [
+        ("rockart", "0003_version_counters"),
+    ]
+
+    operations: ClassVar[list[migrations.operations.base.Operation]] = [
+        migrations.AddField(
+            model_name="site",
+            name="elevation_m",
+            field=models.FloatField(
+                blank=True, help_text="Elevation above sea level in meters.", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="site",
+            name="latitude",
+            field=models.FloatField(
+                blank=True,
+                null=True,
+                validators=[
+                    django.core.validators.MinValueValidator(-90),
+                    django.core.validators.MaxValueValidator(90),
+                ],
+            ),
+        ),
+        migrations.AddField(
+            model_name="site",
+            name="longitude",
+            field=models.FloatField(
+                blank=True,
+                null=True,
+                validators=[
+                    django.core.validators.MinValueValidator(-180),
+                    django.core.validators.MaxValueValidator(180),
+                ],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="site",
+            index=models.Index(
+                fields=["latitude", "longitude"], name="rockart_sit_latitud_140549_idx"
+            ),
+        ),
+        migrations.RunPython(create_spatial_index, drop_spatial_index),
+    ]
@@ -0,0 +1,116 @@
+from typing import ClassVar
+
+# Generated by Django 5.2.18 on 2026-10-19 17:48
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies: ClassVar[list[tuple[str, str]]] = [
+        ("rockart", "0006_deepzoom"),
+    ]
+
+    operations: ClassVar[list[migrations.operations.base.Operation]] = [
+        migrations.CreateModel(
+            name="ThreeDModel",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("version", models.PositiveIntegerField(default=1, editable=False)),
+                ("name", models.CharField(blank=True, max_length=255)),
+                (
+                    "kind",
+                    models.CharField(
+                        blank=True,
+                        choices=[("mesh", "Mesh"), ("point_cloud", "Point cloud")],
+                        max_length=16,
+                    ),
+                ),
+                ("vertex_count", models.BigIntegerField(blank=True, null=True)),
+                ("face_count", models.BigIntegerField(blank=True, null=True)),
+                (
+                    "lod_status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("ready", "Ready"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=16,
+                    ),
+                ),
+                ("lod_error", models.TextField(blank=True)),
+                (
+                    "entry",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="three_d_models",
+                        to="rockart.photogrammetrylogentry",
+                    ),
+                ),
+                (
+                    "panel",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="three_d_models",
+                        to="rockart.panel",
+                    ),
+                ),
+                (
+                    "source",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="three_d_models",
+                        to="rockart.photogrammetrymedia",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["entry", "name"],
+            },
+        ),
+        migrations.CreateModel(
+            name="ThreeDModelLevel",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("cells", models.PositiveIntegerField()),
+                ("size", models.BigIntegerField()),
+                ("vertex_count", models.BigIntegerField()),
+                ("face_count", models.BigIntegerField()),
+                (
+                    "model",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="levels",
+                        to="rockart.threedmodel",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["model", "cells"],
+                "unique_together": {("model", "cells")},
+            },
+        ),
+    ]
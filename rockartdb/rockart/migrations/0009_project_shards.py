@@ -0,0 +1,37 @@
+from typing import ClassVar
+
+# Generated by Django 5.2.18 on 2026-10-19 18:27
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies: ClassVar[list[tuple[str, str]]] = [
+        ("rockart", "0008_jobs"),
+    ]
+
+    operations: ClassVar[list[migrations.operations.base.Operation]] = [
+        migrations.CreateModel(
+            name="ProjectShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("project_name", models.CharField(max_length=255, unique=True)),
+                ("database", models.CharField(max_length=64)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SiteShard",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("database", models.CharField(max_length=64)),
+            ],
+        ),
+    ]
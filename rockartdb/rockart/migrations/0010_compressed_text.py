@@ -0,0 +1,119 @@
+from typing import ClassVar
+
+from django.db import migrations
+
+# Generated by Django 5.2.18 on 2026-10-19 18:45
+import rockart.fields
+from rockart import fields, search
+
+COMPRESSED = {
+    "rockartcondition": [
+        "animal_impacts_notes",
+        "biochemical_notes",
+        "chemical_notes",
+        "human_impacts_notes",
+        "physical_notes",
+    ],
+    "rockartnote": ["text"],
+    "site": ["project_description"],
+}
+
+BATCH_SIZE = 1000
+
+
+def _rewrite(apps, schema_editor, convert):
+    conn = schema_editor.connection
+    if conn.vendor != "sqlite":
+        # Other databases keep the text plain.
+        return
+    for model_name, names in COMPRESSED.items():
+        model = apps.get_model("rockart", model_name)
+        table = model._meta.db_table
+        columns = [model._meta.get_field(name).column for name in names]
+        assignments = ", ".join(f"{column} = %s" for column in columns)
+        last = 0
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT id, {', '.join(columns)} FROM {table}"
+                    " WHERE id > %s ORDER BY id LIMIT %s",
+                    [last, BATCH_SIZE],
+                )
+                rows = cursor.fetchall()
+                for pk, *values in rows:
+                    cursor.execute(
+                        f"UPDATE {table} SET {assignments} WHERE id = %s",
+                        [*(convert(value) for value in values), pk],
+                    )
+            if len(rows) < BATCH_SIZE:
+                break
+            last = rows[-1][0]
+
+
+def compress_text(apps, schema_editor):
+    _rewrite(
+        apps,
+        schema_editor,
+        lambda value: (
+            value if value is None else fields.compress(fields.inflate(value))
+        ),
+    )
+
+
+def decompress_text(apps, schema_editor):
+    _rewrite(apps, schema_editor, fields.inflate)
+
+
+def create_search_indexes(apps, schema_editor):
+    search.ensure_search_indexes(schema_editor.connection, resync=True)
+
+
+def drop_search_indexes(apps, schema_editor):
+    search.drop_search_indexes(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies: ClassVar[list[tuple[str, str]]] = [
+        ("rockart", "0009_project_shards"),
+    ]
+
+    operations: ClassVar[list[migrations.operations.base.Operation]] = [
+        migrations.AlterField(
+            model_name="rockartcondition",
+            name="animal_impacts_notes",
+            field=rockart.fields.CompressedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="rockartcondition",
+            name="biochemical_notes",
+            field=rockart.fields.CompressedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="rockartcondition",
+            name="chemical_notes",
+            field=rockart.fields.CompressedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="rockartcondition",
+            name="human_impacts_notes",
+            field=rockart.fields.CompressedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="rockartcondition",
+            name="physical_notes",
+            field=rockart.fields.CompressedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="rockartnote",
+            name="text",
+            field=rockart.fields.CompressedTextField(search_index=True),
+        ),
+        migrations.AlterField(
+            model_name="site",
+            name="project_description",
+            field=rockart.fields.CompressedTextField(blank=True),
+        ),
+        migrations.RunPython(compress_text, decompress_text),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
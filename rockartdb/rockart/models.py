@@ -1,13 +1,32 @@
+import uuid
+from typing import ClassVar
+
+from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
+
+from rockart.fields import CompressedTextField
 
 
 class TimeStampedModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Bumped on every update; offline clients send it back as the base
+    # version of their edits (optimistic concurrency).
+    version = models.PositiveIntegerField(default=1, editable=False)
 
     class Meta:
         abstract = True
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "version"}
+        super().save(*args, **kwargs)
+
 
 # ----------------------------------------------------------------------
 # Core / Project Information tab
@@ -23,7 +42,7 @@ class Site(TimeStampedModel):
     date_recorded = models.DateField(null=True, blank=True)
 
     project_name = models.CharField(max_length=255, blank=True)
-    project_description = models.TextField(blank=True)
+    project_description = CompressedTextField(blank=True)
     recorders = models.CharField(
         max_length=255,
         blank=True,
@@ -37,6 +56,27 @@ class Site(TimeStampedModel):
         max_length=255, blank=True, help_text="Permanent data housing (e.g. TARL)."
     )
 
+    # WGS84 location. Indexed by an R*Tree on SQLite or a GiST index on
+    # PostgreSQL (see rockart.geo).
+    latitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)],
+    )
+    longitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)],
+    )
+    elevation_m = models.FloatField(
+        null=True, blank=True, help_text="Elevation above sea level in meters."
+    )
+
+    class Meta:
+        indexes: ClassVar[list[models.Index]] = [
+            models.Index(fields=["latitude", "longitude"])
+        ]
+
     def __str__(self) -> str:
         return self.site_number
 
@@ -106,6 +146,18 @@ class RockArtCategory(models.Model):
         return self.name
 
 
+class VocabularyVersion(models.Model):
+    """
+    A single row counting edits to the vocabularies, bumped in the same
+    transaction as the edit (see rockart.vocab).
+    """
+
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"vocabularies v{self.version}"
+
+
 # ----------------------------------------------------------------------
 # Rock Art tab (general character, techniques, photography)
 # ----------------------------------------------------------------------
@@ -243,19 +295,19 @@ class RockArtCondition(TimeStampedModel):
 
     # Agents of deterioration – each dropdown mapped to free text plus notes
     physical_agent = models.CharField(max_length=128, blank=True)
-    physical_notes = models.TextField(blank=True)
+    physical_notes = CompressedTextField(blank=True)
 
     chemical_agent = models.CharField(max_length=128, blank=True)
-    chemical_notes = models.TextField(blank=True)
+    chemical_notes = CompressedTextField(blank=True)
 
     biochemical_agent = models.CharField(max_length=128, blank=True)
-    biochemical_notes = models.TextField(blank=True)
+    biochemical_notes = CompressedTextField(blank=True)
 
     human_impacts = models.CharField(max_length=128, blank=True)
-    human_impacts_notes = models.TextField(blank=True)
+    human_impacts_notes = CompressedTextField(blank=True)
 
     animal_impacts = models.CharField(max_length=128, blank=True)
-    animal_impacts_notes = models.TextField(blank=True)
+    animal_impacts_notes = CompressedTextField(blank=True)
 
     known_or_perceived_future_impacts = models.TextField(blank=True)
     future_research_potential = models.TextField(blank=True)
@@ -442,6 +494,210 @@ class PhotogrammetryLogEntry(TimeStampedModel):
         return f"{self.site} photogrammetry on {self.date}"
 
 
+# ----------------------------------------------------------------------
+# Photogrammetry media
+# ----------------------------------------------------------------------
+
+
+class MediaAsset(models.Model):
+    """
+    A stored file, identified by the SHA-256 of its content. Identical
+    photos uploaded twice share one asset.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    file = models.FileField(max_length=255)
+    content_type = models.CharField(max_length=128, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return self.sha256
+
+
+class PhotogrammetryMedia(TimeStampedModel):
+    entry = models.ForeignKey(
+        PhotogrammetryLogEntry, on_delete=models.CASCADE, related_name="media"
+    )
+    asset = models.ForeignKey(
+        MediaAsset, on_delete=models.PROTECT, related_name="attachments"
+    )
+    filename = models.CharField(max_length=255)
+
+    class Meta:
+        ordering: ClassVar[list[str]] = ["entry", "filename"]
+        unique_together = ("entry", "filename")
+
+    def __str__(self) -> str:
+        return self.filename
+
+
+class DerivativeStatus(models.TextChoices):
+    PENDING = "pending", "Pending"
+    RUNNING = "running", "Running"
+    READY = "ready", "Ready"
+    FAILED = "failed", "Failed"
+
+
+class DeepZoomImage(models.Model):
+    """
+    Deep Zoom tile pyramid of a panorama, stored under
+    MEDIA_ROOT/deepzoom/<sha256>/ as image.dzi and image_files/.
+    """
+
+    asset = models.OneToOneField(
+        MediaAsset, on_delete=models.CASCADE, related_name="deep_zoom"
+    )
+    status = models.CharField(
+        max_length=16,
+        choices=DerivativeStatus.choices,
+        default=DerivativeStatus.PENDING,
+    )
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    tile_size = models.PositiveIntegerField(default=254)
+    overlap = models.PositiveIntegerField(default=1)
+    format = models.CharField(max_length=8, default="jpg")
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def directory(self) -> str:
+        return f"deepzoom/{self.asset.sha256}"
+
+    def __str__(self) -> str:
+        return f"Deep zoom of {self.asset}"
+
+
+class ThreeDModelKind(models.TextChoices):
+    MESH = "mesh", "Mesh"
+    POINT_CLOUD = "point_cloud", "Point cloud"
+
+
+class ThreeDModel(TimeStampedModel):
+    """
+    A mesh or point cloud from an SfM run, stored as a photogrammetry media
+    file, with decimated level-of-detail variants under
+    MEDIA_ROOT/lod/<sha256>/.
+    """
+
+    entry = models.ForeignKey(
+        PhotogrammetryLogEntry, on_delete=models.CASCADE, related_name="three_d_models"
+    )
+    panel = models.ForeignKey(
+        Panel,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="three_d_models",
+    )
+    source = models.ForeignKey(
+        PhotogrammetryMedia, on_delete=models.CASCADE, related_name="three_d_models"
+    )
+    name = models.CharField(max_length=255, blank=True)
+    kind = models.CharField(max_length=16, choices=ThreeDModelKind.choices, blank=True)
+    vertex_count = models.BigIntegerField(null=True, blank=True)
+    face_count = models.BigIntegerField(null=True, blank=True)
+    lod_status = models.CharField(
+        max_length=16,
+        choices=DerivativeStatus.choices,
+        default=DerivativeStatus.PENDING,
+    )
+    lod_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering: ClassVar[list[str]] = ["entry", "name"]
+
+    @property
+    def lod_directory(self) -> str:
+        return f"lod/{self.source.asset.sha256}"
+
+    def __str__(self) -> str:
+        return self.name or self.source.filename
+
+
+class ThreeDModelLevel(models.Model):
+    """
+    One decimated variant; ``cells`` is the clustering grid resolution
+    along the model's longest side (lower is coarser).
+    """
+
+    model = models.ForeignKey(
+        ThreeDModel, on_delete=models.CASCADE, related_name="levels"
+    )
+    cells = models.PositiveIntegerField()
+    size = models.BigIntegerField()
+    vertex_count = models.BigIntegerField()
+    face_count = models.BigIntegerField()
+
+    class Meta:
+        ordering: ClassVar[list[str]] = ["model", "cells"]
+        unique_together = ("model", "cells")
+
+    def __str__(self) -> str:
+        return f"{self.model} at {self.cells} cells"
+
+
+class UploadStatus(models.TextChoices):
+    OPEN = "open", "Open"
+    COMPLETING = "completing", "Completing"
+    COMPLETE = "complete", "Complete"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload of one file, sent as fixed-size chunks in any order.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    entry = models.ForeignKey(
+        PhotogrammetryLogEntry, on_delete=models.CASCADE, related_name="uploads"
+    )
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=128, blank=True)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64, help_text="SHA-256 of the whole file.")
+    chunk_size = models.PositiveIntegerField()
+    status = models.CharField(
+        max_length=16, choices=UploadStatus.choices, default=UploadStatus.OPEN
+    )
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL
+    )
+    media = models.ForeignKey(
+        PhotogrammetryMedia, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def chunk_count(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index) -> int:
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def __str__(self) -> str:
+        return f"Upload of {self.filename}"
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(
+        UploadSession, on_delete=models.CASCADE, related_name="chunks"
+    )
+    index = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64)
+
+    class Meta:
+        ordering: ClassVar[list[str]] = ["session", "index"]
+        unique_together = ("session", "index")
+
+    def __str__(self) -> str:
+        return f"Chunk {self.index} of {self.session}"
+
+
 # ----------------------------------------------------------------------
 # Rock Art Notes tab
 # ----------------------------------------------------------------------
@@ -464,10 +720,129 @@ class RockArtNote(TimeStampedModel):
         default=NoteCategory.FIELD,
     )
 
-    text = models.TextField()
+    text = CompressedTextField(search_index=True)
 
     class Meta:
         ordering = ["site", "date", "created_at"]
 
     def __str__(self) -> str:
         return f"{self.get_note_type_display()} note for {self.site}"
+
+
+# ----------------------------------------------------------------------
+# Change log (offline sync)
+# ----------------------------------------------------------------------
+
+
+class ChangeAction(models.TextChoices):
+    UPSERT = "upsert", "Upsert"
+    DELETE = "delete", "Delete"
+
+
+class ChangeLogEntry(models.Model):
+    """
+    Append-only record of every create, update and delete of a synced row.
+    The auto-incrementing id is the cursor of the changes feed; delete
+    entries are the tombstones.
+    """
+
+    model = models.CharField(max_length=64)
+    object_id = models.BigIntegerField()
+    site_id = models.BigIntegerField(
+        null=True, blank=True, help_text="Owning site, kept after it is deleted."
+    )
+    action = models.CharField(max_length=8, choices=ChangeAction.choices)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes: ClassVar[list[models.Index]] = [
+            models.Index(fields=["model", "object_id"])
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.action} {self.model} {self.object_id}"
+
+
+# ----------------------------------------------------------------------
+# Background jobs
+# ----------------------------------------------------------------------
+
+
+class JobStatus(models.TextChoices):
+    QUEUED = "queued", "Queued"
+    RUNNING = "running", "Running"
+    SUCCEEDED = "succeeded", "Succeeded"
+    FAILED = "failed", "Failed"
+
+
+class Job(models.Model):
+    """
+    A unit of background work, claimed and run by ``manage.py rockart_worker``.
+    ``kind`` selects the handler (see rockart.jobs); ``key`` keeps one
+    unfinished job per target.
+    """
+
+    kind = models.CharField(max_length=64)
+    key = models.CharField(max_length=255, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=16, choices=JobStatus.choices, default=JobStatus.QUEUED
+    )
+    priority = models.IntegerField(default=0, help_text="Higher runs first.")
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    locked_by = models.CharField(max_length=128, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    progress = models.FloatField(default=0.0)
+    progress_message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering: ClassVar[list[str]] = ["-created_at"]
+        indexes: ClassVar[list[models.Index]] = [
+            models.Index(fields=["status", "run_after"]),
+            models.Index(fields=["key", "status"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+
+# ----------------------------------------------------------------------
+# Project shards (see rockart.shards)
+# ----------------------------------------------------------------------
+
+
+class ProjectShard(models.Model):
+    """
+    Registry of projects stored in a shard database instead of the default
+    one.
+    """
+
+    project_name = models.CharField(max_length=255, unique=True)
+    database = models.CharField(max_length=64)
+
+    def __str__(self) -> str:
+        return f"{self.project_name} -> {self.database}"
+
+
+class SiteShard(models.Model):
+    """
+    Directory of sites created while sharding is enabled. Its id sequence
+    allocates site ids for every database, so they stay unique and dense,
+    and ``database`` records where the site lives.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    database = models.CharField(max_length=64)
+
+    def __str__(self) -> str:
+        return f"site {self.pk} -> {self.database}"
@@ -0,0 +1,562 @@
+"""
+The iconographic inventories as one site x motif count matrix.
+
+Every count field of the four inventory tabs is a column, followed by the
+final figure counts of the site's panels summed per kind. Row ``i`` holds
+site ``i`` (ids are dense, so the row is the index) and a parallel
+``present`` array marks which ids are live sites. Alongside are the
+site's rock art types and categories (column = vocabulary id), a unit
+length motif profile per site and the profile's nonzero terms as 0/1
+(``binary``), used for similarity search. All are .npy files opened as
+memory maps, so every process shares the pages and analytics run as NumPy
+operations instead of walking ORM objects.
+
+The files live in a generation directory under MEDIA_ROOT/analytics/motifs
+named by the CURRENT file. build() writes a new generation and switches
+CURRENT; saves of sites, panels and inventory rows rewrite the affected
+rows in place (see rockart.signals), growing into a new generation when a
+site id is past the end. Writers in every process take turns on an
+exclusive lock on the LOCK file there. Requests never build: get() queues
+a "motifs" job and raises MatrixPending until the job has written one.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Sum
+
+from rockart import jobs, shards
+from rockart.models import (
+    AnthropomorphInventory,
+    EnigmaticInventory,
+    GeneralIconographicAttributes,
+    Panel,
+    RockArtInfo,
+    Site,
+    ZoomorphInventory,
+)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+# Bump when the columns or arrays change, so existing matrices are rebuilt.
+LAYOUT_VERSION = 3
+
+INVENTORY_MODELS = (
+    AnthropomorphInventory,
+    EnigmaticInventory,
+    ZoomorphInventory,
+    GeneralIconographicAttributes,
+)
+PANEL_KINDS = (
+    "anthropomorphs",
+    "enigmatics",
+    "zoomorphs",
+    "graffiti",
+    "remnant",
+    "unclassified",
+    "figurative_petros",
+    "grooves",
+)
+
+# Rows and vocabulary columns are allocated in blocks, so new sites and
+# vocabulary rows rarely need a new generation.
+ROW_BLOCK = 4096
+VOCABULARY_BLOCK = 64
+
+VOCABULARIES = {
+    "types": RockArtInfo.rock_art_types,
+    "categories": RockArtInfo.rock_art_categories,
+}
+
+ARRAYS = ("counts", "present", "types", "categories", "profile", "binary")
+
+COSINE = "cosine"
+JACCARD = "jaccard"
+METRICS = (COSINE, JACCARD)
+
+_lock = threading.Lock()
+_loaded = None
+
+
+class MotifsUnavailable(Exception):
+    pass
+
+
+class MatrixPending(Exception):
+    """
+    Raised by get() while no matrix is built; ``job`` is the queued build.
+    """
+
+    def __init__(self, job):
+        super().__init__("The motif matrix is being built.")
+        self.job = job
+
+
+def available():
+    return np is not None
+
+
+def _count_fields(model):
+    return [
+        field.name
+        for field in model._meta.concrete_fields
+        if field.get_internal_type() == "PositiveIntegerField"
+        and field.name != "version"
+    ]
+
+
+INVENTORY_COLUMNS = {model: _count_fields(model) for model in INVENTORY_MODELS}
+COLUMNS = [name for fields in INVENTORY_COLUMNS.values() for name in fields] + [
+    f"panel_{kind}" for kind in PANEL_KINDS
+]
+COLUMN_INDEX = {name: i for i, name in enumerate(COLUMNS)}
+# The inventory columns, without panel totals, make up the motif profile.
+PROFILE_COLUMNS = len(COLUMNS) - len(PANEL_KINDS)
+
+
+class MotifMatrix:
+    """
+    A loaded generation of memory maps: ``counts`` (int32, rows x
+    columns), ``present`` (bool, rows), ``types`` and ``categories``
+    (bool, rows x vocabulary ids), ``profile`` (float32, rows x
+    profile columns followed by both vocabularies) and ``binary``
+    (float32, 1 where ``profile`` is nonzero).
+    """
+
+    def __init__(self, generation, arrays):
+        self.generation = generation
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def flush(self):
+        for name in ARRAYS:
+            getattr(self, name).flush()
+
+    @property
+    def site_ids(self):
+        return np.flatnonzero(self.present)
+
+    def column_indexes(self, columns):
+        unknown = [name for name in columns if name not in COLUMN_INDEX]
+        if unknown:
+            raise KeyError(", ".join(unknown))
+        return [COLUMN_INDEX[name] for name in columns]
+
+    def select(self, site_ids=None, having=()):
+        """
+        Ids of the live sites among ``site_ids`` (all by default) that have
+        at least one figure in every ``having`` column.
+        """
+        mask = self.present.copy()
+        if site_ids is not None:
+            wanted = np.zeros_like(mask)
+            ids = np.asarray(site_ids, dtype=np.int64)
+            wanted[ids[(ids >= 0) & (ids < len(mask))]] = True
+            mask &= wanted
+        for index in self.column_indexes(having):
+            mask &= self.counts[:, index] > 0
+        return np.flatnonzero(mask)
+
+    def totals(self, rows, columns=COLUMNS):
+        """
+        Figures per column over the given rows.
+        """
+        block = self.counts[np.ix_(rows, self.column_indexes(columns))]
+        return dict(zip(columns, block.sum(axis=0, dtype=np.int64).tolist()))
+
+    def sites_with(self, rows, columns=COLUMNS):
+        """
+        Number of the given sites with at least one figure per column.
+        """
+        block = self.counts[np.ix_(rows, self.column_indexes(columns))] > 0
+        return dict(zip(columns, block.sum(axis=0).tolist()))
+
+    def cooccurrence(self, rows, columns=COLUMNS):
+        """
+        Sites having both motifs, for every pair of columns.
+        """
+        block = self.counts[np.ix_(rows, self.column_indexes(columns))] > 0
+        # float32 goes through BLAS and is exact up to 2**24 sites.
+        block = block.astype(np.float32)
+        pairs = (block.T @ block).astype(np.int64)
+        return {
+            name: dict(zip(columns, pairs[i].tolist()))
+            for i, name in enumerate(columns)
+        }
+
+    def similar(self, site_id, k=10, metric=COSINE):
+        """
+        The ``k`` sites most like ``site_id`` as (site id, score) pairs,
+        best first. Cosine compares motif profiles; Jaccard compares the
+        sets of motifs and vocabulary terms present. Raises KeyError when
+        the site is not in the matrix.
+        """
+        if not 0 <= site_id < len(self.present) or not self.present[site_id]:
+            raise KeyError(site_id)
+        target = np.asarray(self.profile[site_id])
+        if not target.any():
+            return []
+        if metric == COSINE:
+            scores = self.profile @ target
+        elif metric == JACCARD:
+            wanted = np.asarray(self.binary[site_id])
+            shared = self.binary @ wanted
+            scores = shared / (self.binary.sum(axis=1) + wanted.sum() - shared)
+        else:
+            raise ValueError(f"Unknown metric {metric!r}")
+        scores[site_id] = 0
+        scores[~self.present] = 0
+        k = min(k, int(np.count_nonzero(scores > 0)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(int(pk), float(scores[pk])) for pk in top]
+
+
+def matrix_root() -> Path:
+    return Path(settings.MEDIA_ROOT) / "analytics" / "motifs"
+
+
+def _current_generation():
+    try:
+        meta = json.loads((matrix_root() / "CURRENT").read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get("layout") != LAYOUT_VERSION or meta.get("columns") != COLUMNS:
+        return None
+    return meta["generation"]
+
+
+@contextmanager
+def _writing():
+    """
+    Hold the writer lock: one build, update or switch at a time across
+    processes.
+    """
+    root = matrix_root()
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / "LOCK", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _switch(generation):
+    root = matrix_root()
+    meta = {"generation": generation, "layout": LAYOUT_VERSION, "columns": COLUMNS}
+    fd, tmp = tempfile.mkstemp(dir=root, prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, root / "CURRENT")
+    # Processes still mapping an older generation keep their open files.
+    for path in root.iterdir():
+        if path.is_dir() and path.name != generation:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _open(generation, mode):
+    directory = matrix_root() / generation
+    arrays = {
+        name: np.lib.format.open_memmap(directory / f"{name}.npy", mode=mode)
+        for name in ARRAYS
+    }
+    return MotifMatrix(generation, arrays)
+
+
+def _round_up(value, block):
+    return -(-max(value, 1) // block) * block
+
+
+def _allocate(rows, types, categories):
+    """
+    A new, empty generation with room for site ids below ``rows`` and
+    vocabulary ids below ``types`` and ``categories``.
+    """
+    rows = _round_up(rows, ROW_BLOCK)
+    types = _round_up(types, VOCABULARY_BLOCK)
+    categories = _round_up(categories, VOCABULARY_BLOCK)
+    shapes = {
+        "counts": (np.int32, (rows, len(COLUMNS))),
+        "present": (np.bool_, (rows,)),
+        "types": (np.bool_, (rows, types)),
+        "categories": (np.bool_, (rows, categories)),
+        "profile": (np.float32, (rows, PROFILE_COLUMNS + types + categories)),
+        "binary": (np.float32, (rows, PROFILE_COLUMNS + types + categories)),
+    }
+    generation = uuid.uuid4().hex
+    directory = matrix_root() / generation
+    directory.mkdir(parents=True)
+    arrays = {
+        name: np.lib.format.open_memmap(
+            directory / f"{name}.npy", mode="w+", dtype=dtype, shape=shape
+        )
+        for name, (dtype, shape) in shapes.items()
+    }
+    return MotifMatrix(generation, arrays)
+
+
+def _grow(matrix, rows, types, categories):
+    """
+    Copy ``matrix`` into a new generation at least this large.
+    """
+    old_rows, old_types = matrix.types.shape
+    old_categories = matrix.categories.shape[1]
+    grown = _allocate(
+        max(rows, old_rows), max(types, old_types), max(categories, old_categories)
+    )
+    grown.counts[:old_rows] = matrix.counts
+    grown.present[:old_rows] = matrix.present
+    grown.types[:old_rows, :old_types] = matrix.types
+    grown.categories[:old_rows, :old_categories] = matrix.categories
+    _profile(grown, slice(None))
+    return grown
+
+
+def _array(rows, width):
+    return np.fromiter(
+        (value or 0 for row in rows.iterator() for value in row), dtype=np.int64
+    ).reshape(-1, width)
+
+
+def _selections(site_ids=None):
+    """
+    (database, site ids) pairs to read; the ids are None for every site.
+    """
+    if site_ids is None:
+        return [(database, None) for database in shards.site_databases()]
+    return list(shards.group_sites(site_ids).items())
+
+
+def _memberships(site_ids=None):
+    """
+    (site id, vocabulary id) pairs of the sites' rock art types and
+    categories, per vocabulary.
+    """
+    pairs = {}
+    for name, relation in VOCABULARIES.items():
+        through = relation.through
+        target = relation.field.m2m_reverse_name()
+        chunks = []
+        for database, ids in _selections(site_ids):
+            queryset = through.objects.using(database)
+            if ids is not None:
+                queryset = queryset.filter(rockartinfo__site_id__in=ids)
+            rows = queryset.values_list("rockartinfo__site_id", target)
+            chunks.append(_array(rows, 2))
+        pairs[name] = np.concatenate(chunks)
+    return pairs
+
+
+def _scatter(matrix, columns, rows):
+    """
+    Write (site_id, *counts) rows into ``columns`` of the matrix.
+    """
+    data = _array(rows, len(columns) + 1)
+    if len(data):
+        indexes = [COLUMN_INDEX[name] for name in columns]
+        matrix.counts[np.ix_(data[:, 0], indexes)] = data[:, 1:]
+
+
+def _unit(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def _profile(matrix, rows):
+    """
+    Recompute the profiles of ``rows``: log-scaled motif counts and the
+    vocabulary terms, each scaled to unit length so both weigh the same,
+    then the whole vector scaled to unit length. Their nonzero terms go to
+    ``binary``, so Jaccard queries read it from the map as it is.
+    """
+    counts = np.log1p(matrix.counts[rows, :PROFILE_COLUMNS].astype(np.float32))
+    terms = np.hstack([matrix.types[rows], matrix.categories[rows]])
+    profile = _unit(np.hstack([_unit(counts), _unit(terms.astype(np.float32))]))
+    matrix.profile[rows] = profile
+    matrix.binary[rows] = profile != 0
+
+
+def _fill_rows(matrix, database, site_ids):
+    def rows_of(model):
+        queryset = model.objects.using(database)
+        if site_ids is not None:
+            queryset = queryset.filter(site_id__in=site_ids)
+        return queryset
+
+    sites = Site.objects.using(database)
+    if site_ids is not None:
+        sites = sites.filter(pk__in=site_ids)
+    live = np.fromiter(sites.values_list("pk", flat=True), dtype=np.int64)
+    matrix.present[live] = True
+
+    for model, fields in INVENTORY_COLUMNS.items():
+        _scatter(matrix, fields, rows_of(model).values_list("site_id", *fields))
+
+    totals = {f"panel_{kind}": Sum(f"{kind}_final") for kind in PANEL_KINDS}
+    panels = rows_of(Panel).values("site_id").annotate(**totals).order_by()
+    _scatter(matrix, list(totals), panels.values_list("site_id", *totals))
+
+
+def _fill(matrix, memberships, site_ids=None):
+    """
+    Read the rows of ``site_ids`` (every site when None) from the primary
+    and the shards into ``matrix``.
+    """
+    rows = slice(None)
+    if site_ids is not None:
+        rows = site_ids
+        for name in ("counts", "present", "types", "categories"):
+            getattr(matrix, name)[rows] = 0
+    for database, ids in _selections(site_ids):
+        _fill_rows(matrix, database, ids)
+
+    for name, pairs in memberships.items():
+        getattr(matrix, name)[pairs[:, 0], pairs[:, 1]] = True
+    _profile(matrix, rows)
+
+
+def _sizes(memberships, site_ids):
+    """
+    (rows, types, categories) needed to hold these sites and memberships.
+    """
+    largest = [max(site_ids, default=0)] + [
+        int(pairs[:, 0].max(initial=0)) for pairs in memberships.values()
+    ]
+    return (
+        max(largest) + 1,
+        int(memberships["types"][:, 1].max(initial=0)) + 1,
+        int(memberships["categories"][:, 1].max(initial=0)) + 1,
+    )
+
+
+def _require_numpy():
+    if np is None:
+        raise MotifsUnavailable(
+            "Motif analytics need NumPy: pip install 'rockartdb[analytics]'"
+        )
+
+
+def build():
+    """
+    Write a new generation from the database and make it current.
+    """
+    _require_numpy()
+    with _writing():
+        largest = [
+            Site.objects.using(database).aggregate(largest=Max("pk"))["largest"] or 0
+            for database in shards.site_databases()
+        ]
+        memberships = _memberships()
+        matrix = _allocate(*_sizes(memberships, largest))
+        _fill(matrix, memberships)
+        matrix.flush()
+        _switch(matrix.generation)
+    return load()
+
+
+def load():
+    """
+    The current matrix, opened read-only, or None when none is built.
+    """
+    global _loaded
+    _require_numpy()
+    generation = _current_generation()
+    if generation is None:
+        return None
+    loaded = _loaded
+    if loaded is None or loaded.generation != generation:
+        with _lock:
+            if _loaded is None or _loaded.generation != generation:
+                _loaded = _open(generation, "r")
+            loaded = _loaded
+    return loaded
+
+
+def get(created_by=None):
+    """
+    The current matrix. When there is none, queues a build job and raises
+    MatrixPending instead of building it in the caller.
+    """
+    matrix = load()
+    if matrix is None:
+        raise MatrixPending(enqueue_build(created_by=created_by))
+    return matrix
+
+
+def enqueue_build(created_by=None):
+    return jobs.enqueue("motifs", key="motifs:build", created_by=created_by)
+
+
+def run_build_job(job):
+    matrix = build()
+    return {"generation": matrix.generation, "sites": len(matrix.site_ids)}
+
+
+def update_sites(site_ids):
+    """
+    Re-read the rows of these sites into the current matrix. Does nothing
+    until a matrix has been built.
+    """
+    if np is None:
+        return
+    site_ids = sorted({pk for pk in site_ids if pk is not None})
+    if not site_ids or _current_generation() is None:
+        return
+    with _writing():
+        generation = _current_generation()
+        if generation is None:
+            return
+        matrix = _open(generation, "r+")
+        memberships = _memberships(site_ids)
+        rows, types, categories = _sizes(memberships, site_ids)
+        if (
+            rows > len(matrix.present)
+            or types > matrix.types.shape[1]
+            or categories > matrix.categories.shape[1]
+        ):
+            matrix = _grow(matrix, rows, types, categories)
+        _fill(matrix, memberships, site_ids)
+        matrix.flush()
+        if matrix.generation != generation:
+            _switch(matrix.generation)
+
+
+def update_sites_on_commit(site_ids, using=None):
+    """
+    update_sites() once the current transaction on ``using`` commits.
+    """
+    site_ids = list(site_ids)
+    transaction.on_commit(lambda: update_sites(site_ids), using=using)
+
+
+def drop_sites(site_ids):
+    """
+    Clear the rows of deleted sites without reading the database.
+    """
+    if np is None or _current_generation() is None:
+        return
+    with _writing():
+        generation = _current_generation()
+        if generation is None:
+            return
+        matrix = _open(generation, "r+")
+        site_ids = np.asarray(sorted(set(site_ids)), dtype=np.int64)
+        site_ids = site_ids[(site_ids >= 0) & (site_ids < len(matrix.present))]
+        for name in ARRAYS:
+            getattr(matrix, name)[site_ids] = 0
+        matrix.flush()
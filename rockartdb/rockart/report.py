@@ -0,0 +1,228 @@
+"""
+Printable site records laid out like the paper recording form.
+
+Rendered reports are cached on disk under MEDIA_ROOT/reports, named after
+the site's content version: the newest ``updated_at`` of the site and its
+tabs, its latest change log entry (which also covers deleted rows and
+changes to the site's rock art types and categories) and the vocabulary
+version (renamed types and categories). A report for an unchanged site is
+served from that file after a single query.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Max, OuterRef, Subquery
+from django.template.loader import render_to_string
+
+from rockart import shards, vocab
+from rockart.dossier import _related_or_none, dossier_queryset
+from rockart.models import (
+    AnthropomorphInventory,
+    ChangeLogEntry,
+    EnigmaticInventory,
+    GeneralIconographicAttributes,
+    Panel,
+    PhotogrammetryLogEntry,
+    RockArtAttributes,
+    RockArtCondition,
+    RockArtInfo,
+    RockArtNote,
+    Site,
+    ZoomorphInventory,
+)
+
+try:
+    from weasyprint import HTML
+except (ImportError, OSError):  # pragma: no cover - optional dependency
+    HTML = None
+
+# Bump when the template or layout changes, so cached reports are redrawn.
+LAYOUT_VERSION = 1
+
+CONTENT_TYPES = {"html": "text/html; charset=utf-8", "pdf": "application/pdf"}
+
+# Sections in the order of the paper form: (title, related name, model).
+SINGLE_SECTIONS = [
+    ("Rock Art", "rock_art", RockArtInfo),
+    ("Rock Art Conditions", "conditions", RockArtCondition),
+    ("Rock Art Attributes", "attributes", RockArtAttributes),
+    (
+        "Iconographic Inventory - Anthropomorphs",
+        "anthropomorph_inventory",
+        AnthropomorphInventory,
+    ),
+    ("Iconographic Inventory - Enigmatic", "enigmatic_inventory", EnigmaticInventory),
+    ("Iconographic Inventory - Zoomorphs", "zoomorph_inventory", ZoomorphInventory),
+    (
+        "General Iconographic Attributes",
+        "general_iconographic_attributes",
+        GeneralIconographicAttributes,
+    ),
+]
+LIST_SECTIONS = [
+    ("Rock Art Panels", "panels", Panel),
+    ("Photogrammetry", "photogrammetry_logs", PhotogrammetryLogEntry),
+    ("Rock Art Notes", "notes", RockArtNote),
+]
+
+SKIPPED_FIELDS = {"id", "site", "created_at", "updated_at", "version"}
+
+
+class ReportUnavailable(Exception):
+    pass
+
+
+def pdf_available():
+    return HTML is not None
+
+
+def _newest(model):
+    return Subquery(
+        model.objects.filter(site=OuterRef("pk"))
+        .order_by("-updated_at")
+        .values("updated_at")[:1]
+    )
+
+
+def report_versions(sites):
+    """
+    {site id: content version} for the sites of a Site queryset, read in
+    one query.
+    """
+    tabs = {name: _newest(model) for _, name, model in SINGLE_SECTIONS + LIST_SECTIONS}
+    rows = list(
+        sites.annotate(
+            **{f"newest_{name}": subquery for name, subquery in tabs.items()},
+            last_change=Subquery(
+                ChangeLogEntry.objects.filter(site_id=OuterRef("pk"))
+                .order_by("-id")
+                .values("id")[:1]
+            ),
+        ).values(
+            "pk", "updated_at", "last_change", *(f"newest_{name}" for name in tabs)
+        )
+    )
+    if shards.sharding_enabled():
+        # The change log is on the default database, not next to the site.
+        last_changes = dict(
+            ChangeLogEntry.objects.filter(site_id__in=[row["pk"] for row in rows])
+            .values("site_id")
+            .annotate(last=Max("id"))
+            .values_list("site_id", "last")
+        )
+        for row in rows:
+            row["last_change"] = last_changes.get(row["pk"])
+    vocabulary = vocab.get().version
+    versions = {}
+    for row in rows:
+        newest = max(
+            value
+            for name, value in row.items()
+            if name.startswith(("updated_at", "newest_")) and value
+        )
+        micros = int(newest.timestamp() * 1_000_000)
+        versions[row["pk"]] = (
+            f"v{LAYOUT_VERSION}-{micros}-{row['last_change'] or 0}-{vocabulary}"
+        )
+    return versions
+
+
+def report_version(site_id):
+    """
+    The content version of a site's report, or None when there is no
+    such site.
+    """
+    versions = report_versions(Site.objects.filter(pk=site_id))
+    return next(iter(versions.values()), None)
+
+
+def _display(instance, field):
+    if field.many_to_many:
+        return ", ".join(str(item) for item in getattr(instance, field.name).all())
+    if field.choices:
+        return getattr(instance, f"get_{field.name}_display")()
+    value = getattr(instance, field.name)
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    return str(value)
+
+
+def field_rows(instance):
+    """
+    (label, value) pairs for every form field of a tab row.
+    """
+    opts = instance._meta
+    return [
+        (field.verbose_name.capitalize(), _display(instance, field))
+        for field in [*opts.concrete_fields, *opts.many_to_many]
+        if field.name not in SKIPPED_FIELDS
+    ]
+
+
+def report_context(site):
+    """
+    Sections of a site loaded with report_queryset().
+    """
+    sections = [{"title": "Project Information", "rows": field_rows(site)}]
+    for title, name, _ in SINGLE_SECTIONS:
+        obj = _related_or_none(site, name)
+        sections.append(
+            {"title": title, "rows": field_rows(obj) if obj is not None else []}
+        )
+    for title, name, _ in LIST_SECTIONS:
+        entries = [
+            {"title": str(obj), "rows": field_rows(obj)}
+            for obj in getattr(site, name).all()
+        ]
+        sections.append({"title": title, "entries": entries})
+    return {"site": site, "sections": sections, "pdf": pdf_available()}
+
+
+def report_queryset():
+    return dossier_queryset().select_related("attributes__rock_art_category")
+
+
+def render_html(site) -> str:
+    return render_to_string("rockart/report.html", report_context(site))
+
+
+def report_dir(site_id) -> Path:
+    return Path(settings.MEDIA_ROOT) / "reports" / str(site_id)
+
+
+def _write_atomically(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def get_report(site_id, fmt="html") -> Path:
+    """
+    Path of the rendered report, rendering it when the site changed since
+    it was last cached. Raises Site.DoesNotExist for unknown sites.
+    """
+    if fmt == "pdf" and not pdf_available():
+        raise ReportUnavailable(
+            "PDF reports need WeasyPrint: pip install 'rockartdb[pdf]'"
+        )
+    version = report_version(site_id)
+    if version is None:
+        raise Site.DoesNotExist(site_id)
+    directory = report_dir(site_id)
+    path = directory / f"{version}.{fmt}"
+    if path.exists():
+        return path
+    html = render_html(report_queryset().get(pk=site_id))
+    data = html.encode() if fmt == "html" else HTML(string=html).write_pdf()
+    _write_atomically(path, data)
+    for stale in directory.glob(f"*.{fmt}"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    return path
@@ -0,0 +1,165 @@
+"""
+Full-text search over compressed text.
+
+Every CompressedTextField declared with ``search_index=True`` gets, on
+SQLite, a contentless FTS5 table kept in step with its column by triggers.
+The triggers read the text through rockart_inflate(), a SQL function
+registered on every connection Django opens, so writes made outside
+Django must register it too. As with the R*Tree in rockart.geo, table
+rebuilds drop the triggers, so ensure_search_indexes also runs after every
+migrate.
+
+The ``search`` lookup (``text__search="burial"``) matches rows holding
+every word of the term, each as a word prefix. On other databases the
+text is stored plain and ``search`` falls back to ``icontains``.
+"""
+
+import re
+
+from django.apps import apps
+from django.db import connections
+from django.db.models import Lookup
+from django.db.models.lookups import IContains
+
+from rockart.fields import CompressedTextField, inflate
+
+WORD = re.compile(r"\w+")
+
+
+def register_functions(sender, connection, **kwargs):
+    """
+    connection_created handler: add rockart_inflate() to SQLite connections.
+    """
+    if connection.vendor == "sqlite":
+        connection.connection.create_function(
+            "rockart_inflate", 1, inflate, deterministic=True
+        )
+
+
+def indexed_fields():
+    return [
+        field
+        for model in apps.get_app_config("rockart").get_models()
+        for field in model._meta.local_fields
+        if isinstance(field, CompressedTextField) and field.search_index
+    ]
+
+
+def index_table(field):
+    return f"{field.model._meta.db_table}_{field.column}_fts"
+
+
+def _index_sql(field):
+    table = field.model._meta.db_table
+    index = index_table(field)
+    pk = field.model._meta.pk.column
+    column = field.column
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {index}
+        USING fts5(body, content='', tokenize='unicode61 remove_diacritics 2')
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {index}_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO {index} (rowid, body)
+            VALUES (NEW.{pk}, rockart_inflate(NEW.{column}));
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {index}_update
+        AFTER UPDATE OF {pk}, {column} ON {table}
+        BEGIN
+            INSERT INTO {index} ({index}, rowid, body)
+            VALUES ('delete', OLD.{pk}, rockart_inflate(OLD.{column}));
+            INSERT INTO {index} (rowid, body)
+            VALUES (NEW.{pk}, rockart_inflate(NEW.{column}));
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {index}_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO {index} ({index}, rowid, body)
+            VALUES ('delete', OLD.{pk}, rockart_inflate(OLD.{column}));
+        END
+        """,
+    ]
+
+
+def _resync_sql(field):
+    table = field.model._meta.db_table
+    index = index_table(field)
+    pk = field.model._meta.pk.column
+    return [
+        f"INSERT INTO {index} ({index}) VALUES ('delete-all')",
+        f"""
+        INSERT INTO {index} (rowid, body)
+        SELECT {pk}, rockart_inflate({field.column}) FROM {table}
+        """,
+    ]
+
+
+def ensure_search_indexes(conn, resync=False):
+    if conn.vendor != "sqlite":
+        return
+    with conn.cursor() as cursor:
+        for field in indexed_fields():
+            for sql in _index_sql(field) + (_resync_sql(field) if resync else []):
+                cursor.execute(sql)
+
+
+def ensure_search_indexes_after_migrate(sender, using="default", **kwargs):
+    """
+    post_migrate handler: restore triggers dropped by a table rebuild.
+    """
+    conn = connections[using]
+    if conn.vendor != "sqlite":
+        return
+    with conn.cursor() as cursor:
+        tables = set(conn.introspection.table_names(cursor))
+    # Before the migration creating it, an index would miss the rows the
+    # migration compresses and indexes.
+    if all(index_table(field) in tables for field in indexed_fields()):
+        ensure_search_indexes(conn)
+
+
+def drop_search_indexes(conn):
+    if conn.vendor != "sqlite":
+        return
+    with conn.cursor() as cursor:
+        for field in indexed_fields():
+            index = index_table(field)
+            for suffix in ("insert", "update", "delete"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {index}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {index}")
+
+
+def match_expression(term):
+    """
+    An FTS5 query for rows holding every word of ``term`` as a prefix.
+    """
+    return " ".join(f'"{word}"*' for word in WORD.findall(term))
+
+
+@CompressedTextField.register_lookup
+class Search(Lookup):
+    lookup_name = "search"
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        return IContains(self.lhs, self.rhs).as_sql(compiler, connection)
+
+    def as_sqlite(self, compiler, connection):
+        field = self.lhs.target
+        query = match_expression(str(self.rhs))
+        if not query:
+            return "1 = 0", []
+        pk = connection.ops.quote_name(field.model._meta.pk.column)
+        index = index_table(field)
+        sql = (
+            f"{connection.ops.quote_name(self.lhs.alias)}.{pk} IN"
+            f" (SELECT rowid FROM {index} WHERE {index} MATCH %s)"
+        )
+        return sql, [query]
@@ -0,0 +1,435 @@
+"""
+Optional per-project shards.
+
+With ROCKART_SHARDS set (see settings), a project can be assigned to a
+shard database with ``manage.py rockart_shards assign``. Its sites and
+every tab row recorded for them are then stored there, so writes to
+different projects no longer wait on one SQLite write lock. Everything
+else (users, vocabularies, the change log, jobs, photogrammetry media and
+3D models) stays on the default database; the vocabularies are copied to
+every shard so tab rows can point at them.
+
+Ids stay unique across databases: site ids are allocated from the
+SiteShard directory on the default database, which also records where
+each site lives, and each shard's other sequences start at its own
+multiple of SHARD_ID_SPAN, so a tab row's id names its shard.
+
+ShardRoutingMiddleware picks the shard of a request from the site or
+project it names; requests that name none read every site database in
+turn (lists, GraphQL, tiles, motif analytics, the changes feed), and lists
+merge the rows of each database in the order of the query. Outside
+a request, instances saved directly and related managers find their
+shard, but manager calls such as Panel.objects.create() need it named
+with db_routers.use_shard().
+"""
+
+import heapq
+from collections import defaultdict
+from itertools import islice, repeat
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+
+from rockart.db_routers import current_shard, reading_archive, use_shard
+from rockart.models import (
+    AnthropomorphInventory,
+    EnigmaticInventory,
+    GeneralIconographicAttributes,
+    Panel,
+    PhotogrammetryLogEntry,
+    ProjectShard,
+    RockArtAttributes,
+    RockArtCategory,
+    RockArtCondition,
+    RockArtInfo,
+    RockArtNote,
+    RockArtType,
+    Site,
+    SiteShard,
+    ZoomorphInventory,
+)
+
+# Ids of shard n (counting from 1) start at n * SHARD_ID_SPAN.
+SHARD_ID_SPAN = 2**40
+
+REPLICATED_MODELS = (RockArtType, RockArtCategory)
+
+# Backends whose id sequences _raise_sequence() can move.
+SEQUENCE_VENDORS = ("sqlite", "postgresql")
+
+
+def sharded_models():
+    return (
+        Site,
+        RockArtInfo,
+        RockArtInfo.rock_art_types.through,
+        RockArtInfo.rock_art_categories.through,
+        Panel,
+        RockArtCondition,
+        RockArtAttributes,
+        AnthropomorphInventory,
+        EnigmaticInventory,
+        ZoomorphInventory,
+        GeneralIconographicAttributes,
+        PhotogrammetryLogEntry,
+        RockArtNote,
+    )
+
+
+def shard_aliases():
+    """
+    The shard database aliases. Their order numbers the shards, so new
+    shards may only be appended.
+    """
+    return list(getattr(settings, "ROCKART_SHARDS", ()))
+
+
+def sharding_enabled() -> bool:
+    return bool(shard_aliases())
+
+
+def site_databases():
+    """
+    Every database that holds sites, the default one first.
+    """
+    return [DEFAULT_DB_ALIAS, *shard_aliases()]
+
+
+def check_databases():
+    """
+    Raise ImproperlyConfigured when sharding is on and a site database is
+    on a backend shards do not support. Run once at startup.
+    """
+    if not sharding_enabled():
+        return
+    for database in site_databases():
+        vendor = connections[database].vendor
+        if vendor not in SEQUENCE_VENDORS:
+            raise ImproperlyConfigured(
+                f"Shards are not supported on {vendor} (database {database!r})."
+            )
+
+
+def fans_out() -> bool:
+    """
+    True when a read has to visit every site database: sharding is on and
+    the request named no shard.
+    """
+    return sharding_enabled() and current_shard() is None and not reading_archive()
+
+
+def across(queryset, key=None, limit=None):
+    """
+    The rows of ``queryset`` as a list. When the request named no shard,
+    the rows of site models are read from every site database in turn and
+    merged in the queryset's order, or by ``key`` (a function of a row)
+    when given; ``limit`` keeps the first rows of the merge.
+
+    ``queryset`` can also be a function building it, called again for
+    each database, for filters that query while they are applied
+    (geo.filter_nearest).
+    """
+    build = queryset if callable(queryset) else queryset.all
+    if not fans_out():
+        return list(build())
+    found = []
+    for database in site_databases():
+        with use_shard(database):
+            queryset = build()
+            if queryset.model not in sharded_models():
+                return list(queryset)
+            queryset = total_order(queryset).using(queryset.db)
+            rows = list(queryset)
+        if rows:
+            found.append((queryset, rows))
+    # Rows from a single database need no merge keys.
+    if len(found) < 2:
+        return found[0][1][:limit] if found else []
+    parts = [
+        zip([key(row) for row in rows] if key else sort_keys(queryset), rows)
+        for queryset, rows in found
+    ]
+    return merge(parts, limit)
+
+
+def ordering(queryset):
+    """
+    The names ``queryset`` is ordered by ("-" for descending), ending with
+    the primary key so no two rows tie, or None when it is ordered by an
+    expression.
+    """
+    query = queryset.query
+    if query.order_by:
+        names = list(query.order_by)
+    elif query.default_ordering:
+        names = list(queryset.model._meta.ordering)
+    else:
+        names = []
+    if not all(isinstance(name, str) and name != "?" for name in names):
+        return None
+    pk = queryset.model._meta.pk
+    if not {name.lstrip("-") for name in names} & {"pk", pk.name, pk.attname}:
+        names.append("pk")
+    return names
+
+
+def total_order(queryset):
+    """
+    ``queryset`` ordered by ordering(), so every database returns its rows
+    in the order they are merged in.
+    """
+    names = ordering(queryset)
+    return queryset if names is None else queryset.order_by(*names)
+
+
+class _Descending:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _sort_value(value, descending, nulls_largest):
+    # Nulls sort where the database puts them instead of failing to compare.
+    value = ((1 if nulls_largest else -1), None) if value is None else (0, value)
+    return _Descending(value) if descending else value
+
+
+def sort_keys(queryset):
+    """
+    The merge keys of the rows of ``queryset`` (ordered by total_order()),
+    in order. Rows of a queryset ordered by an expression all tie, so the
+    databases' rows are merged one after the other.
+    """
+    names = ordering(queryset)
+    if names is None:
+        return repeat(())
+    nulls_largest = connections[queryset.db].features.nulls_order_largest
+    rows = (
+        queryset.prefetch_related(None)
+        .order_by(*names)
+        .values_list(*(name.lstrip("-") for name in names))
+    )
+    return [
+        tuple(
+            _sort_value(value, name.startswith("-"), nulls_largest)
+            for name, value in zip(names, row)
+        )
+        for row in rows
+    ]
+
+
+def merge(parts, limit=None):
+    """
+    Merge iterables of (key, row) pairs, each sorted by key, into one list
+    of rows, the first ``limit`` of them when given. Rows with equal keys
+    keep the order of the parts.
+    """
+    merged = heapq.merge(*parts, key=itemgetter(0))
+    return [row for _key, row in islice(merged, limit)]
+
+
+def project_database(project_name):
+    if not sharding_enabled() or not project_name:
+        return DEFAULT_DB_ALIAS
+    database = (
+        ProjectShard.objects.using(DEFAULT_DB_ALIAS)
+        .filter(project_name=project_name)
+        .values_list("database", flat=True)
+        .first()
+    )
+    return database or DEFAULT_DB_ALIAS
+
+
+def site_database(site_id):
+    if not sharding_enabled() or site_id is None:
+        return DEFAULT_DB_ALIAS
+    database = (
+        SiteShard.objects.using(DEFAULT_DB_ALIAS)
+        .filter(pk=site_id)
+        .values_list("database", flat=True)
+        .first()
+    )
+    return database or DEFAULT_DB_ALIAS
+
+
+def row_database(pk):
+    """
+    The database of a tab row, read from the range its id falls in.
+    """
+    aliases = shard_aliases()
+    try:
+        index = int(pk) // SHARD_ID_SPAN
+    except (TypeError, ValueError):
+        return DEFAULT_DB_ALIAS
+    return aliases[index - 1] if 0 < index <= len(aliases) else DEFAULT_DB_ALIAS
+
+
+def group_sites(site_ids):
+    """
+    {database: [site ids]} for these sites.
+    """
+    site_ids = list(site_ids)
+    if not sharding_enabled():
+        return {DEFAULT_DB_ALIAS: site_ids}
+    directory = dict(
+        SiteShard.objects.using(DEFAULT_DB_ALIAS)
+        .filter(pk__in=site_ids)
+        .values_list("pk", "database")
+    )
+    groups = defaultdict(list)
+    for site_id in site_ids:
+        groups[directory.get(site_id, DEFAULT_DB_ALIAS)].append(site_id)
+    return dict(groups)
+
+
+def group_rows(model, ids):
+    """
+    {database: [ids]} for rows of ``model``.
+    """
+    ids = list(ids)
+    if model is Site:
+        return group_sites(ids)
+    if not sharding_enabled() or model not in sharded_models():
+        return {DEFAULT_DB_ALIAS: ids}
+    groups = defaultdict(list)
+    for pk in ids:
+        groups[row_database(pk)].append(pk)
+    return dict(groups)
+
+
+def instance_database(instance):
+    """
+    The database a sharded row is stored in, or is about to be.
+    """
+    if not instance._state.adding and instance._state.db:
+        return instance._state.db
+    if isinstance(instance, Site):
+        return project_database(instance.project_name)
+    if not hasattr(instance, "site_id"):
+        # A rock art type or category link.
+        return instance.rockartinfo._state.db
+    site_field = instance._meta.get_field("site")
+    if site_field.is_cached(instance) and instance.site._state.db:
+        return instance.site._state.db
+    if instance.site_id is None:
+        return current_shard()
+    return site_database(instance.site_id)
+
+
+def allocate_site_id(database):
+    """
+    A new site id from the directory, recorded as living in ``database``.
+    """
+    return SiteShard.objects.using(DEFAULT_DB_ALIAS).create(database=database).pk
+
+
+def _raise_sequence(connection, table, value):
+    """
+    Make the next id of ``table`` greater than ``value``.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0"
+                " WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, table],
+            )
+            cursor.execute(
+                "UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s",
+                [value, table, value],
+            )
+        elif connection.vendor == "postgresql":
+            quoted = connection.ops.quote_name(table)
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(%s, 1,"
+                f" (SELECT COALESCE(MAX(id), 0) FROM {quoted})))",
+                [table, value],
+            )
+        else:
+            raise ImproperlyConfigured(
+                f"Shards are not supported on {connection.vendor}."
+            )
+
+
+def copy_vocabularies(database):
+    for model in REPLICATED_MODELS:
+        rows = list(model.objects.using(DEFAULT_DB_ALIAS))
+        model.objects.using(database).bulk_create(
+            rows, update_conflicts=True, unique_fields=["id"], update_fields=["name"]
+        )
+
+
+def prepare_shard(database):
+    """
+    Get a migrated shard ready: move its sequences to its id range, copy
+    the vocabularies and start the site directory above the existing
+    site ids.
+    """
+    start = (shard_aliases().index(database) + 1) * SHARD_ID_SPAN
+    connection = connections[database]
+    with transaction.atomic(using=database):
+        for model in sharded_models():
+            if model is not Site:
+                _raise_sequence(connection, model._meta.db_table, start)
+        copy_vocabularies(database)
+    # Sites created before sharding was enabled are on the default
+    # database; later ones all have directory ids.
+    largest = Site.objects.using(DEFAULT_DB_ALIAS).aggregate(largest=Max("pk"))
+    _raise_sequence(
+        connections[DEFAULT_DB_ALIAS],
+        SiteShard._meta.db_table,
+        largest["largest"] or 0,
+    )
+
+
+def prepare_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate handler: prepare_shard() for shard databases.
+    """
+    if using in shard_aliases():
+        prepare_shard(using)
+
+
+def replicate_vocabulary(instance, deleted=False):
+    """
+    Apply a save or delete of a vocabulary row on the default database to
+    every shard.
+    """
+    model = type(instance)
+    for database in shard_aliases():
+        if deleted:
+            model.objects.using(database).filter(pk=instance.pk).delete()
+        else:
+            model.objects.using(database).update_or_create(
+                pk=instance.pk, defaults={"name": instance.name}
+            )
+
+
+def assign(project_name, database):
+    """
+    Store the project's future sites in ``database``. Projects cannot
+    move once they have sites.
+    """
+    if database not in site_databases():
+        raise ValueError(f"Unknown shard {database!r}.")
+    if any(
+        Site.objects.using(alias).filter(project_name=project_name).exists()
+        for alias in site_databases()
+    ):
+        raise ValueError(f"Project {project_name!r} already has sites.")
+    if database == DEFAULT_DB_ALIAS:
+        ProjectShard.objects.filter(project_name=project_name).delete()
+    else:
+        ProjectShard.objects.update_or_create(
+            project_name=project_name, defaults={"database": database}
+        )
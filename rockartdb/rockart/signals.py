@@ -0,0 +1,225 @@
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+
+from rockart import motifs, shards, tiles, vocab
+from rockart.models import (
+    ChangeAction,
+    Panel,
+    RockArtAttributes,
+    RockArtCategory,
+    RockArtInfo,
+    RockArtType,
+    Site,
+)
+from rockart.sync import record_change, synced_models
+
+
+def _record_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        record_change(instance)
+
+
+def _record_delete(sender, instance, **kwargs):
+    record_change(instance, ChangeAction.DELETE)
+
+
+def _record_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            record_change(instance)
+        return
+    # instance is a vocabulary row; the RockArtInfo rows are what changed.
+    if action == "pre_clear":
+        infos = instance.sites.all()
+    elif action in ("post_add", "post_remove"):
+        infos = RockArtInfo.objects.filter(pk__in=pk_set)
+    else:
+        return
+    for info in infos:
+        record_change(info)
+
+
+def _record_vocabulary_delete(sender, instance, **kwargs):
+    # Deleting a vocabulary row rewrites the rows pointing at it without
+    # signals (M2M rows cascade, RockArtAttributes is SET_NULL).
+    infos = instance.sites.all()
+    for info in infos:
+        record_change(info)
+    if isinstance(instance, RockArtCategory):
+        for attrs in RockArtAttributes.objects.filter(rock_art_category=instance):
+            record_change(attrs)
+
+
+def _remember_site_position(sender, instance, using, raw=False, **kwargs):
+    instance._previous_position = None
+    if instance.pk is not None and not raw:
+        instance._previous_position = (
+            Site.objects.using(using)
+            .filter(pk=instance.pk)
+            .values_list("latitude", "longitude")
+            .first()
+        )
+
+
+def _invalidate_tiles(sender, instance, **kwargs):
+    tiles.invalidate_instance(instance, getattr(instance, "_previous_position", None))
+
+
+def _invalidate_category_tiles(
+    sender, instance, action, reverse, pk_set, using, **kwargs
+):
+    if not reverse:
+        if action.startswith("post_"):
+            tiles.invalidate_sites([instance.site_id], using=using)
+        return
+    # instance is a category; pk_set holds RockArtInfo ids.
+    if action == "pre_clear":
+        infos = instance.sites.all()
+    elif action in ("post_add", "post_remove"):
+        infos = RockArtInfo.objects.filter(pk__in=pk_set)
+    else:
+        return
+    tiles.invalidate_sites(infos.values("site_id"), using=using)
+
+
+def _invalidate_vocabulary(sender, using, **kwargs):
+    # The copies on the shards follow the default database.
+    if using not in shards.shard_aliases():
+        vocab.invalidate()
+
+
+def _allocate_site_id(sender, instance, using, raw=False, **kwargs):
+    if instance.pk is None and not raw and shards.sharding_enabled():
+        instance.pk = shards.allocate_site_id(using)
+
+
+def _replicate_vocabulary(sender, instance, signal, using, raw=False, **kwargs):
+    if not raw and using not in shards.shard_aliases():
+        shards.replicate_vocabulary(instance, deleted=signal is post_delete)
+
+
+def _refresh_motifs(sender, instance, using, raw=False, created=True, **kwargs):
+    # An edited site keeps its motif row; only new and deleted sites move it.
+    if raw or (sender is Site and not created):
+        return
+    site_id = instance.pk if sender is Site else instance.site_id
+    motifs.update_sites_on_commit([site_id], using)
+
+
+def _refresh_motif_terms(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            motifs.update_sites_on_commit([instance.site_id], using)
+        return
+    # instance is a vocabulary row; pk_set holds RockArtInfo ids.
+    if action == "pre_clear":
+        infos = instance.sites.all()
+    elif action in ("post_add", "post_remove"):
+        infos = RockArtInfo.objects.filter(pk__in=pk_set)
+    else:
+        return
+    motifs.update_sites_on_commit(infos.values_list("site_id", flat=True), using)
+
+
+def _refresh_vocabulary_motifs(sender, instance, using, **kwargs):
+    # The M2M rows of a deleted term cascade without m2m_changed.
+    motifs.update_sites_on_commit(
+        instance.sites.values_list("site_id", flat=True), using
+    )
+
+
+def connect_tiles():
+    pre_save.connect(
+        _remember_site_position, sender=Site, dispatch_uid="rockart-tiles-pre-save"
+    )
+    for name, signal in (("save", post_save), ("delete", post_delete)):
+        for model in (Site, RockArtInfo):
+            signal.connect(
+                _invalidate_tiles,
+                sender=model,
+                dispatch_uid=f"rockart-tiles-{model._meta.model_name}-{name}",
+            )
+    m2m_changed.connect(
+        _invalidate_category_tiles,
+        sender=RockArtInfo.rock_art_categories.through,
+        dispatch_uid="rockart-tiles-categories",
+    )
+
+
+def connect_vocabulary():
+    # Tiles and reports include the vocabulary version in their cache keys.
+    for name, signal in (("save", post_save), ("delete", post_delete)):
+        for model in (RockArtType, RockArtCategory):
+            signal.connect(
+                _invalidate_vocabulary,
+                sender=model,
+                dispatch_uid=f"rockart-vocab-{model._meta.model_name}-{name}",
+            )
+
+
+def connect_shards():
+    pre_save.connect(
+        _allocate_site_id, sender=Site, dispatch_uid="rockart-shards-site-id"
+    )
+    for name, signal in (("save", post_save), ("delete", post_delete)):
+        for model in shards.REPLICATED_MODELS:
+            signal.connect(
+                _replicate_vocabulary,
+                sender=model,
+                dispatch_uid=f"rockart-shards-{model._meta.model_name}-{name}",
+            )
+
+
+def connect_motifs():
+    for name, signal in (("save", post_save), ("delete", post_delete)):
+        for model in (Site, Panel, *motifs.INVENTORY_MODELS):
+            signal.connect(
+                _refresh_motifs,
+                sender=model,
+                dispatch_uid=f"rockart-motifs-{model._meta.model_name}-{name}",
+            )
+    # Deleting a RockArtInfo drops its terms without m2m_changed.
+    post_delete.connect(
+        _refresh_motifs, sender=RockArtInfo, dispatch_uid="rockart-motifs-info-delete"
+    )
+    for relation in motifs.VOCABULARIES.values():
+        m2m_changed.connect(
+            _refresh_motif_terms,
+            sender=relation.through,
+            dispatch_uid=f"rockart-motifs-{relation.through._meta.model_name}",
+        )
+        vocabulary = relation.field.related_model
+        pre_delete.connect(
+            _refresh_vocabulary_motifs,
+            sender=vocabulary,
+            dispatch_uid=f"rockart-motifs-{vocabulary._meta.model_name}",
+        )
+
+
+def connect():
+    connect_shards()
+    for model in synced_models():
+        uid = f"rockart-sync-{model._meta.model_name}"
+        post_save.connect(_record_save, sender=model, dispatch_uid=f"{uid}-save")
+        post_delete.connect(_record_delete, sender=model, dispatch_uid=f"{uid}-delete")
+    for through in (
+        RockArtInfo.rock_art_types.through,
+        RockArtInfo.rock_art_categories.through,
+    ):
+        m2m_changed.connect(
+            _record_m2m, sender=through, dispatch_uid=f"rockart-sync-{through}"
+        )
+    for model in (RockArtType, RockArtCategory):
+        pre_delete.connect(
+            _record_vocabulary_delete,
+            sender=model,
+            dispatch_uid=f"rockart-sync-{model._meta.model_name}-vocabulary",
+        )
+    connect_tiles()
+    connect_vocabulary()
+    connect_motifs()
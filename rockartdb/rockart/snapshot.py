@@ -0,0 +1,267 @@
+"""
+A static copy of the catalogue for CDN and offline serving.
+
+publish() renders every site's dossier JSON and report HTML, paged site
+indexes and the vocabularies into a directory tree any static file server
+can serve:
+
+    index.json                      entry point: pages and vocabularies
+    indexes/sites-<page>.<hash>.json
+    vocabularies/<name>.<hash>.json
+    sites/<id>/dossier.<hash>.json
+    sites/<id>/report.<hash>.html
+    manifest.json                   what was published, for the next run
+
+Every file but the two at the top is named after a hash of its content,
+so it can be cached forever. A site is only re-rendered when its content
+version (see rockart.report.report_versions) changed since the last
+publish; sites are rendered in batches by a process pool.
+"""
+
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from rockart import report, shards, vocab
+from rockart.db_routers import use_shard
+from rockart.dossier import build_dossier
+from rockart.models import Site
+
+# Bump when the tree layout or the file formats change, so the next
+# publish renders every site again.
+FORMAT_VERSION = 1
+
+INDEX = "index.json"
+MANIFEST = "manifest.json"
+
+DEFAULT_PAGE_SIZE = 500
+# Sites rendered per pool task.
+BATCH_SIZE = 100
+
+
+def snapshot_root() -> Path:
+    return Path(
+        getattr(
+            settings, "ROCKART_SNAPSHOT_ROOT", Path(settings.MEDIA_ROOT) / "snapshot"
+        )
+    )
+
+
+def _encode(data) -> bytes:
+    return json.dumps(
+        data, cls=JSONEncoder, sort_keys=True, separators=(",", ":")
+    ).encode()
+
+
+def _write_atomically(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def write_hashed(root, directory, stem, suffix, data) -> str:
+    """
+    Write ``data`` as ``directory/stem.<hash>suffix`` under ``root`` and
+    return its path relative to ``root``. Unchanged content keeps its name
+    and is not rewritten.
+    """
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    relative = f"{directory}/{stem}.{digest}{suffix}"
+    path = Path(root) / relative
+    if not path.exists():
+        _write_atomically(path, data)
+    return relative
+
+
+def render_sites(root, database, site_ids):
+    """
+    Render the dossiers and reports of these sites into ``root``. Returns
+    {site id: {"dossier": path, "report": path}}. Runs in pool workers.
+    """
+    files = {}
+    with use_shard(database):
+        for site in report.report_queryset().filter(pk__in=site_ids):
+            directory = f"sites/{site.pk}"
+            files[site.pk] = {
+                "dossier": write_hashed(
+                    root, directory, "dossier", ".json", _encode(build_dossier(site))
+                ),
+                "report": write_hashed(
+                    root,
+                    directory,
+                    "report",
+                    ".html",
+                    report.render_html(site).encode(),
+                ),
+            }
+    return files
+
+
+def _read_manifest(root):
+    try:
+        manifest = json.loads((root / MANIFEST).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+    if manifest.get("format") != FORMAT_VERSION:
+        return {}
+    return manifest
+
+
+def _current_versions():
+    """
+    {database: {site id: content version}} of every site.
+    """
+    versions = {}
+    for database in shards.site_databases():
+        with use_shard(database):
+            versions[database] = report.report_versions(Site.objects.all())
+    return versions
+
+
+def _render(root, batches, workers):
+    if workers <= 1:
+        return [render_sites(root, database, ids) for database, ids in batches]
+    # Forked workers inherit the configured project; closing the connections
+    # first makes each open its own instead of sharing the parent's.
+    connections.close_all()
+    pool = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("fork")
+    )
+    with pool:
+        futures = [
+            pool.submit(render_sites, str(root), database, ids)
+            for database, ids in batches
+        ]
+        return [future.result() for future in futures]
+
+
+def _index_rows(published):
+    rows = []
+    for database in shards.site_databases():
+        with use_shard(database):
+            rows.extend(
+                Site.objects.values(
+                    "id", "site_number", "project_name", "latitude", "longitude"
+                )
+            )
+    # Sites created since the versions were read wait for the next publish.
+    rows = [row for row in rows if str(row["id"]) in published]
+    rows.sort(key=lambda row: row["site_number"])
+    for row in rows:
+        files = published[str(row["id"])]
+        row.update(dossier=files["dossier"], report=files["report"])
+    return rows
+
+
+def _write_indexes(root, published, page_size):
+    rows = _index_rows(published)
+    pages = max(1, math.ceil(len(rows) / page_size))
+    paths = []
+    for page in range(pages):
+        data = {
+            "page": page + 1,
+            "pages": pages,
+            "sites": rows[page * page_size : (page + 1) * page_size],
+        }
+        paths.append(
+            write_hashed(root, "indexes", f"sites-{page + 1}", ".json", _encode(data))
+        )
+    vocabularies = {
+        name: write_hashed(
+            root,
+            "vocabularies",
+            name,
+            ".json",
+            _encode([{"id": pk, "name": value} for pk, value in names.items()]),
+        )
+        for name, names in vocab.get().names.items()
+    }
+    return len(rows), paths, vocabularies
+
+
+def _remove_stale(root, published, keep):
+    """
+    Delete files no longer referenced by the index or the manifest.
+    """
+    for directory in ("indexes", "vocabularies"):
+        for path in (root / directory).glob("*"):
+            if str(path.relative_to(root)) not in keep:
+                path.unlink()
+    for path in (root / "sites").glob("*"):
+        files = published.get(path.name)
+        if files is None:
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        current = {files["dossier"], files["report"]}
+        for file in path.iterdir():
+            if str(file.relative_to(root)) not in current:
+                file.unlink()
+
+
+def publish(root=None, workers=None, full=False, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Bring the snapshot under ``root`` up to date. Returns the number of
+    sites rendered and published.
+    """
+    root = Path(root or snapshot_root())
+    if workers is None:
+        workers = os.cpu_count() or 1
+    previous = {} if full else _read_manifest(root).get("sites", {})
+
+    published = {}
+    batches = []
+    for database, versions in _current_versions().items():
+        stale = []
+        for site_id, version in versions.items():
+            entry = previous.get(str(site_id))
+            if (
+                entry is not None
+                and entry["version"] == version
+                and (root / entry["dossier"]).exists()
+                and (root / entry["report"]).exists()
+            ):
+                published[str(site_id)] = entry
+            else:
+                stale.append(site_id)
+                published[str(site_id)] = {"version": version}
+        for start in range(0, len(stale), BATCH_SIZE):
+            batches.append((database, stale[start : start + BATCH_SIZE]))
+
+    rendered = 0
+    for files in _render(root, batches, workers):
+        for site_id, paths in files.items():
+            published[str(site_id)].update(paths)
+            rendered += 1
+    # Sites deleted while they were being rendered.
+    published = {pk: entry for pk, entry in published.items() if "dossier" in entry}
+
+    count, pages, vocabularies = _write_indexes(root, published, page_size)
+    _write_atomically(
+        root / INDEX,
+        _encode(
+            {
+                "published_at": timezone.now(),
+                "sites": count,
+                "pages": pages,
+                "vocabularies": vocabularies,
+            }
+        ),
+    )
+    _write_atomically(
+        root / MANIFEST, _encode({"format": FORMAT_VERSION, "sites": published})
+    )
+    _remove_stale(root, published, {*pages, *vocabularies.values()})
+    return rendered, count
@@ -0,0 +1,301 @@
+from contextlib import ExitStack
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from rockart import motifs, shards, tiles
+from rockart.api import serializers
+from rockart.api.fastlist import compile_list_plan
+from rockart.db_routers import use_shard
+from rockart.models import ChangeAction, ChangeLogEntry, Panel, Site
+
+# Models carried by the changes feed, keyed by model_name, with the
+# serializer that renders their rows.
+SYNC_SERIALIZERS = {
+    serializer_class.Meta.model._meta.model_name: serializer_class
+    for serializer_class in (
+        serializers.SiteSerializer,
+        serializers.RockArtTypeSerializer,
+        serializers.RockArtCategorySerializer,
+        serializers.RockArtInfoSerializer,
+        serializers.PanelSerializer,
+        serializers.RockArtConditionSerializer,
+        serializers.RockArtAttributesSerializer,
+        serializers.AnthropomorphInventorySerializer,
+        serializers.EnigmaticInventorySerializer,
+        serializers.ZoomorphInventorySerializer,
+        serializers.GeneralIconographicAttributesSerializer,
+        serializers.PhotogrammetryLogEntrySerializer,
+        serializers.RockArtNoteSerializer,
+    )
+}
+
+# Models that carry a version counter and accept offline edits.
+VERSIONED_SERIALIZERS = {
+    name: serializer_class
+    for name, serializer_class in SYNC_SERIALIZERS.items()
+    if any(f.name == "version" for f in serializer_class.Meta.model._meta.fields)
+}
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+MAX_UPLOAD_MUTATIONS = 1000
+
+
+def synced_models():
+    return [serializer.Meta.model for serializer in SYNC_SERIALIZERS.values()]
+
+
+def owning_site_id(instance):
+    if isinstance(instance, Site):
+        return instance.pk
+    return getattr(instance, "site_id", None)
+
+
+def record_change(instance, action=ChangeAction.UPSERT):
+    return ChangeLogEntry.objects.create(
+        model=instance._meta.model_name,
+        object_id=instance.pk,
+        site_id=owning_site_id(instance),
+        action=action,
+    )
+
+
+def record_changes(model, rows, action):
+    """
+    Bulk variant for set-based writes that bypass model signals; ``rows``
+    is an iterable of (object_id, site_id).
+    """
+    ChangeLogEntry.objects.bulk_create(
+        ChangeLogEntry(
+            model=model._meta.model_name,
+            object_id=object_id,
+            site_id=site_id,
+            action=action,
+        )
+        for object_id, site_id in rows
+    )
+
+
+def _render_rows(model_name, ids):
+    serializer_class = SYNC_SERIALIZERS[model_name]
+    model = serializer_class.Meta.model
+    plan = compile_list_plan(serializer_class())
+    rendered = {}
+    for database, group in shards.group_rows(model, ids).items():
+        with use_shard(database):
+            queryset = model.objects.filter(pk__in=group)
+            if plan is not None:
+                rows = plan.render(plan.values_queryset(queryset))
+            else:
+                rows = serializer_class(queryset, many=True).data
+            rendered.update((row["id"], row) for row in rows)
+    return rendered
+
+
+def changes_since(cursor=0, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of the changes feed after ``cursor``.
+
+    Entries are read in id order and collapsed to the newest per row.
+    Upserts carry the row as it is now; a row deleted since then is left
+    out, and its tombstone arrives by the next cursor at the latest.
+    Writes are serialized on SQLite, so ids become visible in order.
+    """
+    entries = list(
+        ChangeLogEntry.objects.filter(pk__gt=cursor).order_by("pk")[: limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for entry in entries:
+        key = (entry.model, entry.object_id)
+        latest.pop(key, None)
+        latest[key] = entry
+
+    upserts = {}
+    for (model_name, object_id), entry in latest.items():
+        if entry.action == ChangeAction.UPSERT and model_name in SYNC_SERIALIZERS:
+            upserts.setdefault(model_name, []).append(object_id)
+    rows = {
+        model_name: _render_rows(model_name, ids) for model_name, ids in upserts.items()
+    }
+
+    changes = []
+    for (model_name, object_id), entry in latest.items():
+        if entry.action == ChangeAction.DELETE:
+            changes.append(
+                {
+                    "model": model_name,
+                    "id": object_id,
+                    "op": "delete",
+                    "deleted_at": entry.changed_at,
+                }
+            )
+        elif object_id in rows.get(model_name, {}):
+            changes.append(
+                {
+                    "model": model_name,
+                    "id": object_id,
+                    "op": "upsert",
+                    "data": rows[model_name][object_id],
+                }
+            )
+    return {
+        "cursor": entries[-1].pk if entries else cursor,
+        "has_more": has_more,
+        "changes": changes,
+    }
+
+
+class SyncConflict(Exception):
+    def __init__(self, instance):
+        self.instance = instance
+
+
+def _resolve_refs(value, created):
+    """
+    Replace "$<ref>" strings with the id of a row created earlier in the
+    batch, so offline clients can link children to new parents.
+    """
+    if isinstance(value, list):
+        return [_resolve_refs(item, created) for item in value]
+    if isinstance(value, str) and value.startswith("$") and value[1:] in created:
+        return created[value[1:]]
+    return value
+
+
+def _serialize(instance):
+    serializer_class = SYNC_SERIALIZERS[instance._meta.model_name]
+    return serializer_class(instance).data
+
+
+def _apply_create(serializer_class, mutation, context):
+    serializer = serializer_class(data=mutation["data"], context=context)
+    serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+
+def _apply_update(serializer_class, mutation, context):
+    model = serializer_class.Meta.model
+    base_version = mutation["version"]
+    instance = model.objects.filter(pk=mutation["id"]).first()
+    if instance is None or instance.version != base_version:
+        raise SyncConflict(instance)
+    serializer = serializer_class(
+        instance, data=mutation["data"], partial=True, context=context
+    )
+    serializer.is_valid(raise_exception=True)
+    values = dict(serializer.validated_data)
+    many = {
+        name: values.pop(name)
+        for name in list(values)
+        if model._meta.get_field(name).many_to_many
+    }
+    # The version check and the write are one statement, so a concurrent
+    # edit makes it match no row instead of being overwritten.
+    updated = model.objects.filter(pk=instance.pk, version=base_version).update(
+        **values, version=base_version + 1, updated_at=timezone.now()
+    )
+    if not updated:
+        raise SyncConflict(model.objects.filter(pk=instance.pk).first())
+    previous_position = (
+        (instance.latitude, instance.longitude) if isinstance(instance, Site) else None
+    )
+    instance.refresh_from_db()
+    for name, related in many.items():
+        getattr(instance, name).set(related)
+    # update() bypasses the model signals.
+    record_change(instance)
+    tiles.invalidate_instance(instance, previous_position)
+    if isinstance(instance, (Panel, *motifs.INVENTORY_MODELS)):
+        motifs.update_sites_on_commit([instance.site_id], instance._state.db)
+    return instance
+
+
+def _apply_delete(serializer_class, mutation, context):
+    model = serializer_class.Meta.model
+    instance = model.objects.filter(pk=mutation["id"]).first()
+    if instance is None or instance.version != mutation["version"]:
+        raise SyncConflict(instance)
+    instance.delete()
+
+
+APPLY = {
+    "create": _apply_create,
+    "update": _apply_update,
+    "delete": _apply_delete,
+}
+
+
+def _mutation_database(model, mutation):
+    if mutation["op"] != "create":
+        [database] = shards.group_rows(model, [mutation["id"]])
+        return database
+    data = mutation["data"]
+    if model is Site:
+        return shards.project_database(data.get("project_name"))
+    try:
+        return shards.site_database(int(data.get("site")))
+    except (TypeError, ValueError):
+        return shards.site_database(None)
+
+
+def apply_mutations(mutations, context=None):
+    """
+    Apply a batch of offline edits in one transaction.
+
+    Each mutation runs in its own savepoint: accepted ones are kept, while
+    version conflicts and validation errors are reported back alongside
+    the server's current row without affecting the rest of the batch.
+    """
+    accepted, conflicts, errors = [], [], []
+    created = {}
+    with ExitStack() as stack:
+        for database in shards.site_databases():
+            stack.enter_context(transaction.atomic(using=database))
+        for mutation in mutations:
+            serializer_class = VERSIONED_SERIALIZERS[mutation["model"]]
+            data = {
+                key: _resolve_refs(value, created)
+                for key, value in mutation["data"].items()
+            }
+            mutation = {**mutation, "data": data}
+            result = {
+                "ref": mutation.get("ref"),
+                "model": mutation["model"],
+                "op": mutation["op"],
+                "id": mutation.get("id"),
+            }
+            model = serializer_class.Meta.model
+            database = _mutation_database(model, mutation)
+            try:
+                with use_shard(database), transaction.atomic(using=database):
+                    instance = APPLY[mutation["op"]](
+                        serializer_class, mutation, context
+                    )
+            except SyncConflict as conflict:
+                server = conflict.instance
+                conflicts.append(
+                    {
+                        **result,
+                        "version": mutation.get("version"),
+                        "server": _serialize(server) if server else None,
+                    }
+                )
+                continue
+            except ValidationError as exc:
+                errors.append({**result, "errors": exc.detail})
+                continue
+            if instance is not None:
+                result.update(
+                    id=instance.pk,
+                    version=instance.version,
+                    data=_serialize(instance),
+                )
+                if mutation.get("ref"):
+                    created[mutation["ref"]] = instance.pk
+            accepted.append(result)
+    return {"accepted": accepted, "conflicts": conflicts, "errors": errors}
@@ -1,13 +1,63 @@
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import (
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import resolve, reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
+from rest_framework.utils.encoders import JSONEncoder
 
-from rockart import forms, models
+from rockart import (
+    bulk,
+    consistency,
+    db_routers,
+    deepzoom,
+    fields,
+    forms,
+    jobs,
+    lod,
+    media,
+    middleware,
+    models,
+    motifs,
+    report,
+    shards,
+    snapshot,
+    sync,
+    tiles,
+    vocab,
+)
 from rockart.api import serializers
 
 
 class ModelTests(TestCase):
+    databases = "__all__"
+
     def test_site_str(self):
         site = models.Site.objects.create(site_number="ABC-123")
         self.assertEqual(str(site), "ABC-123")
@@ -36,6 +86,18 @@ class FormTests(TestCase):
         form = forms.SiteForm(data={"site_number": "X-1"})
         self.assertTrue(form.is_valid())
 
+    def test_widget_classes_are_set_once_per_form_class(self):
+        forms.RockArtInfoForm()
+        with mock.patch.object(forms, "_style_widget") as style:
+            form = forms.RockArtInfoForm()
+        style.assert_not_called()
+        self.assertEqual(
+            form.fields["rock_art_types"].widget.attrs["class"], "form-check-input"
+        )
+        self.assertEqual(
+            form.fields["reason_for_visit"].widget.attrs["class"], "form-control"
+        )
+
 
 class SerializerTests(TestCase):
     def test_site_serializer(self):
@@ -47,6 +109,8 @@ class SerializerTests(TestCase):
 
 
 class ViewTests(TestCase):
+    databases = "__all__"
+
     def setUp(self):
         User = get_user_model()
         self.user = User.objects.create_user(
@@ -80,8 +144,20 @@ class ViewTests(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertContains(resp, "Project")
 
+    def test_project_form_saves_the_site_number(self):
+        site = models.Site.objects.create(site_number="SITE-1")
+        url = reverse("rockart-project", args=[site.id])
+        # The field is required, so the tab has to render it.
+        self.assertContains(self.staff_client.get(url), 'name="site_number"')
+        resp = self.staff_client.post(url, {"site_number": "SITE-2"})
+        self.assertRedirects(resp, reverse("rockart-rock-art", args=[site.id]))
+        site.refresh_from_db()
+        self.assertEqual(site.site_number, "SITE-2")
+
 
 class APITests(TestCase):
+    databases = "__all__"
+
     def setUp(self):
         User = get_user_model()
         self.user = User.objects.create_user(
@@ -125,6 +201,8 @@ class URLTests(TestCase):
 
 
 class GraphQLTests(TestCase):
+    databases = "__all__"
+
     def setUp(self):
         User = get_user_model()
         self.user = User.objects.create_user(
@@ -156,3 +234,1991 @@ class GraphQLTests(TestCase):
         )
         self.assertEqual(resp.status_code, 200)
         self.assertIn("data", resp.json())
+
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.router = db_routers.ReadReplicaRouter()
+        self.factory = RequestFactory()
+
+    @mock.patch.object(db_routers, "replica_configured", return_value=False)
+    def test_router_is_noop_without_replica(self, _configured):
+        with db_routers.use_replica():
+            self.assertIsNone(self.router.db_for_read(models.Site))
+        self.assertIsNone(self.router.db_for_write(models.Site))
+
+    @mock.patch.object(db_routers, "replica_configured", return_value=True)
+    def test_router_sends_marked_reads_to_replica(self, _configured):
+        self.assertIsNone(self.router.db_for_read(models.Site))
+        with db_routers.use_replica():
+            # TestCase wraps each test in a transaction on the primary.
+            self.assertEqual(self.router.db_for_read(models.Site), "default")
+        self.assertEqual(self.router.db_for_write(models.Site), "default")
+
+    def test_graphql_queries_and_mutations(self):
+        query = self.factory.post("/graphql", {"query": "{ sites { id } }"})
+        mutation = self.factory.post(
+            "/graphql",
+            '{"query": "mutation { noop }"}',
+            content_type="application/json",
+        )
+        self.assertTrue(middleware.is_graphql_read(query))
+        self.assertFalse(middleware.is_graphql_read(mutation))
+
+    def test_write_pins_user_to_primary(self):
+        User = get_user_model()
+        staff = User.objects.create_user(
+            username="pinned", password="pass123", is_staff=True
+        )
+        client = Client()
+        client.force_login(staff)
+        resp = client.post(reverse("rockart-create"), {"site_number": "PIN-1"})
+        self.assertEqual(resp.status_code, 302)
+        self.assertIn(middleware.PRIMARY_PIN_COOKIE, resp.cookies)
+        request = self.factory.get("/")
+        request.COOKIES = {}
+        request.user = staff
+        mw = middleware.ReplicaRoutingMiddleware(lambda r: None)
+        self.assertTrue(mw._is_pinned(request))
+
+
+class AsyncReadTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username="asyncuser", password="pass123")
+        self.site = models.Site.objects.create(site_number="ASYNC-1")
+        models.Panel.objects.create(site=self.site, panel_number=1)
+        models.RockArtNote.objects.create(site=self.site, text="Shelter wall")
+        models.RockArtInfo.objects.create(site=self.site)
+
+    async def test_async_site_list_and_detail(self):
+        await self.async_client.aforce_login(self.user)
+        resp = await self.async_client.get(reverse("async-site-list"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()[0]["site_number"], "ASYNC-1")
+        resp = await self.async_client.get(
+            reverse("async-site-detail", args=[self.site.id])
+        )
+        self.assertEqual(resp.json()["id"], self.site.id)
+
+    async def test_async_requires_login(self):
+        resp = await self.async_client.get(reverse("async-site-list"))
+        self.assertEqual(resp.status_code, 403)
+
+    def test_dossier_matches_async_dossier(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        # With shards, the request also looks up the site's shard.
+        with self.assertNumQueries(6 + shards.sharding_enabled()):
+            sync_resp = client.get(reverse("site-dossier", args=[self.site.id]))
+        self.client.force_login(self.user)
+        async_resp = self.client.get(reverse("async-site-dossier", args=[self.site.id]))
+        self.assertEqual(sync_resp.json(), async_resp.json())
+        self.assertEqual(len(sync_resp.json()["panels"]), 1)
+        self.assertEqual(sync_resp.json()["rock_art"]["site"], self.site.id)
+        self.assertIsNone(sync_resp.json()["conditions"])
+
+
+class AsyncGraphQLTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username="asyncgql", password="pass123")
+        models.Site.objects.create(site_number="ASYNC-1")
+
+    async def test_async_graphql_rejects_mutations(self):
+        await self.async_client.aforce_login(self.user)
+        resp = await self.async_client.post(
+            reverse("async-graphql"),
+            {"query": "{ sites { siteNumber } }"},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.json()["data"]["sites"][0]["siteNumber"], "ASYNC-1")
+        resp = await self.async_client.post(
+            reverse("async-graphql"),
+            {"query": "mutation { noop }"},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 400)
+
+
+class SparseFieldsetTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username="sparse", password="pass123")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.site = models.Site.objects.create(site_number="SP-1")
+        models.RockArtCondition.objects.create(
+            site=self.site, repainting="Yes", physical_notes="Long narrative"
+        )
+
+    def test_fields_trims_response_and_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(
+                reverse("rockartcondition-list"), {"fields": "id,site,repainting"}
+            )
+        self.assertEqual(resp.status_code, 200)
+        condition = self.site.conditions
+        self.assertEqual(
+            resp.json(),
+            [{"id": condition.id, "site": self.site.id, "repainting": "Yes"}],
+        )
+        sql = queries.captured_queries[-1]["sql"]
+        self.assertNotIn("physical_notes", sql)
+        self.assertNotIn("rockart_site", sql)
+
+    def test_omit_and_m2m_fields(self):
+        info = models.RockArtInfo.objects.create(site=self.site)
+        art_type = models.RockArtType.objects.create(name="Pictograph")
+        info.rock_art_types.add(art_type)
+        resp = self.client.get(
+            reverse("rockartinfo-detail", args=[info.id]),
+            {"fields": "id,rock_art_types"},
+        )
+        self.assertEqual(resp.json(), {"id": info.id, "rock_art_types": [art_type.id]})
+        resp = self.client.get(reverse("site-list"), {"omit": "project_description"})
+        self.assertNotIn("project_description", resp.json()[0])
+        self.assertIn("site_number", resp.json()[0])
+
+    def test_unknown_field_is_rejected(self):
+        resp = self.client.get(reverse("site-list"), {"fields": "nope"})
+        self.assertEqual(resp.status_code, 400)
+
+
+class FastListTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username="fast", password="pass123")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.site = models.Site.objects.create(
+            site_number="FAST-1", date_recorded="2024-05-01"
+        )
+        models.Panel.objects.create(site=self.site, panel_number=1, height_m=1.5)
+        models.PhotogrammetryLogEntry.objects.create(
+            site=self.site, date="2024-05-02", photo_type=models.PhotoType.GIGAPAN
+        )
+        info = models.RockArtInfo.objects.create(site=self.site)
+        info.rock_art_types.add(models.RockArtType.objects.create(name="Pictograph"))
+
+    def assertFastMatchesSerializer(self, url_name, serializer_class, queryset):
+        # One query for the rows, plus one per many-to-many field.
+        m2m_fields = len(serializer_class.Meta.model._meta.many_to_many)
+        with self.assertNumQueries(1 + m2m_fields):
+            resp = self.client.get(reverse(url_name))
+        expected = serializer_class(queryset, many=True).data
+        self.assertEqual(resp.json(), json.loads(json.dumps(expected, cls=JSONEncoder)))
+
+    def test_fast_list_matches_serializer_output(self):
+        cases = [
+            ("site-list", serializers.SiteSerializer, models.Site.objects.all()),
+            ("panel-list", serializers.PanelSerializer, models.Panel.objects.all()),
+            (
+                "photogrammetrylogentry-list",
+                serializers.PhotogrammetryLogEntrySerializer,
+                models.PhotogrammetryLogEntry.objects.all(),
+            ),
+            (
+                "rockartinfo-list",
+                serializers.RockArtInfoSerializer,
+                models.RockArtInfo.objects.all(),
+            ),
+        ]
+        for url_name, serializer_class, queryset in cases:
+            with self.subTest(url_name):
+                self.assertFastMatchesSerializer(url_name, serializer_class, queryset)
+
+    def test_fast_list_respects_sparse_fieldsets(self):
+        resp = self.client.get(reverse("panel-list"), {"fields": "panel_number"})
+        self.assertEqual(resp.json(), [{"panel_number": 1}])
+
+
+class SiteExpandTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username="expand", password="pass123")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        art_type = models.RockArtType.objects.create(name="Pictograph")
+        for number in range(3):
+            site = models.Site.objects.create(site_number=f"EXP-{number}")
+            models.Panel.objects.create(site=site, panel_number=2)
+            models.Panel.objects.create(site=site, panel_number=1)
+            models.RockArtNote.objects.create(site=site, text="Narrative")
+            info = models.RockArtInfo.objects.create(site=site)
+            info.rock_art_types.add(art_type)
+            models.ZoomorphInventory.objects.create(site=site, feline=2)
+
+    def test_expanded_list_uses_fixed_number_of_queries(self):
+        expand = ",".join(serializers.SITE_EXPANSIONS)
+        # Sites with every one-to-one tab joined, then panels, notes,
+        # photogrammetry logs and the two rock art vocabularies.
+        with self.assertNumQueries(6):
+            resp = self.client.get(reverse("site-list"), {"expand": expand})
+        site = resp.json()[0]
+        self.assertEqual([p["panel_number"] for p in site["panels"]], [1, 2])
+        self.assertEqual(site["notes"][0]["text"], "Narrative")
+        self.assertEqual(len(site["rock_art"]["rock_art_types"]), 1)
+        self.assertEqual(site["zoomorph_inventory"]["feline"], 2)
+        self.assertIsNone(site["conditions"])
+        self.assertIsNone(site["anthropomorph_inventory"])
+
+    def test_expand_combines_with_sparse_fieldsets(self):
+        resp = self.client.get(
+            reverse("site-list"), {"expand": "rock_art", "fields": "site_number"}
+        )
+        self.assertEqual(set(resp.json()[0]), {"site_number", "rock_art"})
+        site_id = models.Site.objects.get(site_number="EXP-0").id
+        resp = self.client.get(
+            reverse("site-detail", args=[site_id]), {"expand": "panels"}
+        )
+        self.assertEqual(len(resp.json()["panels"]), 2)
+
+    def test_unknown_expansion_is_rejected(self):
+        resp = self.client.get(reverse("site-list"), {"expand": "bogus"})
+        self.assertEqual(resp.status_code, 400)
+
+
+class ChangesFeedTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username="tablet", password="pass123")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_changes(self, since=0, **params):
+        resp = self.client.get(reverse("changes-feed"), {"since": since, **params})
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_feed_returns_upserts_and_tombstones_after_cursor(self):
+        site = models.Site.objects.create(site_number="SYNC-1")
+        panel = models.Panel.objects.create(site=site, panel_number=1)
+        first = self.get_changes()
+        self.assertEqual(
+            [(c["model"], c["op"]) for c in first["changes"]],
+            [("site", "upsert"), ("panel", "upsert")],
+        )
+        self.assertEqual(first["changes"][1]["data"]["panel_number"], 1)
+
+        self.assertEqual(self.get_changes(first["cursor"])["changes"], [])
+
+        panel_id = panel.id
+        panel.delete()
+        site.project_name = "Lower Pecos"
+        site.save()
+        second = self.get_changes(first["cursor"])
+        self.assertEqual(
+            [(c["model"], c["id"], c["op"]) for c in second["changes"]],
+            [("panel", panel_id, "delete"), ("site", site.id, "upsert")],
+        )
+        self.assertEqual(second["changes"][1]["data"]["project_name"], "Lower Pecos")
+
+    def test_feed_collapses_repeated_updates_and_pages(self):
+        site = models.Site.objects.create(site_number="SYNC-2")
+        for name in ("a", "b", "c"):
+            site.recorders = name
+            site.save()
+        models.Site.objects.create(site_number="SYNC-3")
+        page = self.get_changes(limit=4)
+        self.assertTrue(page["has_more"])
+        self.assertEqual(len(page["changes"]), 1)
+        self.assertEqual(page["changes"][0]["data"]["recorders"], "c")
+        page = self.get_changes(page["cursor"], limit=4)
+        self.assertFalse(page["has_more"])
+        self.assertEqual(page["changes"][0]["data"]["site_number"], "SYNC-3")
+
+    def test_site_delete_tombstones_cascaded_tabs(self):
+        site = models.Site.objects.create(site_number="SYNC-4")
+        note = models.RockArtNote.objects.create(site=site, text="x")
+        expected = {("site", site.id), ("rockartnote", note.id)}
+        cursor = self.get_changes()["cursor"]
+        site.delete()
+        tombstones = {
+            (c["model"], c["id"], c["op"]) for c in self.get_changes(cursor)["changes"]
+        }
+        self.assertEqual(tombstones, {(*key, "delete") for key in expected})
+
+    def test_m2m_changes_upsert_rock_art_info(self):
+        site = models.Site.objects.create(site_number="SYNC-5")
+        info = models.RockArtInfo.objects.create(site=site)
+        art_type = models.RockArtType.objects.create(name="Petroglyph")
+        cursor = self.get_changes()["cursor"]
+        info.rock_art_types.add(art_type)
+        changes = self.get_changes(cursor)["changes"]
+        self.assertEqual(changes[0]["data"]["rock_art_types"], [art_type.id])
+
+
+class SyncUploadTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        User = get_user_model()
+        self.staff = User.objects.create_user(
+            username="recorder", password="pass123", is_staff=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.site = models.Site.objects.create(site_number="UP-1")
+
+    def upload(self, *mutations):
+        resp = self.client.post(
+            reverse("sync-upload"), {"mutations": list(mutations)}, format="json"
+        )
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()
+
+    def test_version_bumps_on_save(self):
+        self.assertEqual(self.site.version, 1)
+        self.site.recorders = "A"
+        self.site.save()
+        self.site.refresh_from_db()
+        self.assertEqual(self.site.version, 2)
+
+    def test_batch_creates_with_references_and_updates(self):
+        result = self.upload(
+            {
+                "ref": "s",
+                "model": "site",
+                "op": "create",
+                "data": {"site_number": "UP-2"},
+            },
+            {
+                "model": "panel",
+                "op": "create",
+                "data": {"site": "$s", "panel_number": 1},
+            },
+            {
+                "model": "site",
+                "op": "update",
+                "id": self.site.id,
+                "version": 1,
+                "data": {"recorders": "Field crew"},
+            },
+        )
+        self.assertEqual(result["conflicts"], [])
+        self.assertEqual(result["errors"], [])
+        new_site = models.Site.objects.get(site_number="UP-2")
+        self.assertTrue(new_site.panels.filter(panel_number=1).exists())
+        self.site.refresh_from_db()
+        self.assertEqual(self.site.recorders, "Field crew")
+        self.assertEqual(self.site.version, 2)
+        self.assertEqual(result["accepted"][2]["version"], 2)
+        feed = sync.changes_since(0)["changes"]
+        self.assertIn(("site", self.site.id), {(c["model"], c["id"]) for c in feed})
+
+    def test_stale_version_is_reported_as_conflict(self):
+        self.site.recorders = "Server edit"
+        self.site.save()
+        note = models.RockArtNote.objects.create(site=self.site, text="Keep me")
+        result = self.upload(
+            {
+                "model": "site",
+                "op": "update",
+                "id": self.site.id,
+                "version": 1,
+                "data": {"recorders": "Tablet edit"},
+            },
+            {"model": "rockartnote", "op": "delete", "id": note.id, "version": 1},
+            {"model": "panel", "op": "create", "data": {"site": self.site.id}},
+        )
+        self.assertEqual(len(result["accepted"]), 1)
+        self.assertEqual(result["conflicts"][0]["server"]["recorders"], "Server edit")
+        self.assertIn("panel_number", result["errors"][0]["errors"])
+        self.site.refresh_from_db()
+        self.assertEqual(self.site.recorders, "Server edit")
+        self.assertFalse(models.RockArtNote.objects.filter(pk=note.id).exists())
+
+    def test_upload_requires_staff(self):
+        User = get_user_model()
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="ro"))
+        resp = client.post(reverse("sync-upload"), {"mutations": []}, format="json")
+        self.assertEqual(resp.status_code, 403)
+
+
+class SiteGeoTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        User = get_user_model()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="geo"))
+        self.sites = {
+            number: models.Site.objects.create(
+                site_number=number, latitude=lat, longitude=lon
+            )
+            for number, lat, lon in (
+                ("G-1", 29.70, -101.30),
+                ("G-2", 29.72, -101.33),
+                ("G-3", 29.90, -101.10),
+                ("G-4", 31.00, -100.00),
+            )
+        }
+        models.Site.objects.create(site_number="G-5")
+
+    def site_numbers(self, **params):
+        resp = self.client.get(reverse("site-list"), params)
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return [row["site_number"] for row in resp.json()]
+
+    def test_bbox_filter_uses_spatial_index(self):
+        self.assertEqual(
+            self.site_numbers(bbox="-101.5,29.6,-101.2,29.8"), ["G-1", "G-2"]
+        )
+        site = self.sites["G-1"]
+        site.latitude = 35.0
+        site.save()
+        self.assertEqual(self.site_numbers(bbox="-101.5,29.6,-101.2,29.8"), ["G-2"])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM rockart_site_rtree")
+            self.assertEqual(cursor.fetchone()[0], 4)
+
+    def test_near_returns_k_nearest_in_distance_order(self):
+        self.assertEqual(
+            self.site_numbers(near="-101.32,29.72", k=3), ["G-2", "G-1", "G-3"]
+        )
+        # Sites without coordinates are never returned.
+        self.assertEqual(len(self.site_numbers(near="0,0", k=10)), 4)
+
+    def test_invalid_geo_parameters_are_rejected(self):
+        resp = self.client.get(reverse("site-list"), {"bbox": "1,2,3"})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get(reverse("site-list"), {"near": "0,0", "k": 0})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_graphql_sites_accepts_bbox_and_near(self):
+        from rockart.graphql.schema import schema
+
+        result = schema.execute(
+            "{ a: sites(bbox: [-101.5, 29.6, -101.2, 29.8]) { siteNumber }"
+            "  b: sites(near: [-100.1, 30.9], k: 1) { siteNumber } }"
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(
+            sorted(site["siteNumber"] for site in result.data["a"]), ["G-1", "G-2"]
+        )
+        self.assertEqual(result.data["b"], [{"siteNumber": "G-4"}])
+
+
+class SiteTileTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="map"))
+        historic = models.RockArtCategory.objects.create(name="Historic")
+        self.near = models.Site.objects.create(
+            site_number="T-1", latitude=29.70, longitude=-101.30
+        )
+        info = models.RockArtInfo.objects.create(
+            site=self.near, location_type=models.LocationType.ROCK_SHELTER
+        )
+        info.rock_art_categories.add(historic)
+        models.Site.objects.create(site_number="T-2", latitude=29.71, longitude=-101.31)
+        self.far = models.Site.objects.create(
+            site_number="T-3", latitude=-33.9, longitude=18.4
+        )
+
+    def tile(self, z, x, y):
+        resp = self.client.get(reverse("tile", args=[z, x, y]))
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()
+
+    def test_tile_clusters_sites_with_breakdowns(self):
+        world = self.tile(0, 0, 0)
+        self.assertEqual(world["count"], 3)
+        x, y = tiles.tile_for(29.70, -101.30, 8)
+        tile = self.tile(8, x, y)
+        self.assertEqual(tile["count"], 2)
+        self.assertEqual(len(tile["clusters"]), 1)
+        cluster = tile["clusters"][0]
+        self.assertEqual(cluster["location_types"], {"rock_shelter": 1})
+        self.assertEqual(cluster["categories"], {"Historic": 1})
+        x, y = tiles.tile_for(29.70, -101.30, 18)
+        self.assertEqual(self.tile(18, x, y)["clusters"][0]["site_id"], self.near.id)
+
+    def test_tiles_are_cached_and_invalidated_per_site(self):
+        near_tile = tiles.tile_for(29.70, -101.30, 6)
+        far_tile = tiles.tile_for(-33.9, 18.4, 6)
+        self.tile(6, *near_tile)
+        self.tile(6, *far_tile)
+        with self.assertNumQueries(0):
+            self.tile(6, *near_tile)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.far.latitude = -34.0
+            self.far.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.tile(6, *near_tile)["count"], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.near.latitude = 40.0
+            self.near.save()
+            # Until the move commits, the cached tile stays.
+            with self.assertNumQueries(0):
+                self.assertEqual(self.tile(6, *near_tile)["count"], 2)
+        self.assertEqual(self.tile(6, *near_tile)["count"], 1)
+
+    def test_rock_art_changes_invalidate_the_sites_tiles(self):
+        self.assertEqual(
+            self.tile(0, 0, 0)["clusters"][0]["categories"], {"Historic": 1}
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.near.rock_art.rock_art_categories.clear()
+        self.assertEqual(self.tile(0, 0, 0)["clusters"][0]["categories"], {})
+
+    def test_renamed_categories_move_tiles_to_new_keys(self):
+        self.tile(0, 0, 0)
+        category = models.RockArtCategory.objects.get(name="Historic")
+        category.name = "Historic period"
+        category.save()
+        self.assertEqual(
+            self.tile(0, 0, 0)["clusters"][0]["categories"], {"Historic period": 1}
+        )
+
+    def test_out_of_range_tile_is_not_found(self):
+        resp = self.client.get(reverse("tile", args=[2, 4, 0]))
+        self.assertEqual(resp.status_code, 404)
+
+
+class MediaUploadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        User = get_user_model()
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user(username="crew", is_staff=True)
+        )
+        site = models.Site.objects.create(site_number="M-1")
+        self.entry = models.PhotogrammetryLogEntry.objects.create(
+            site=site, date="2024-03-01"
+        )
+        self.content = os.urandom(150 * 1024)
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+
+    def start(self, entry=None, filename="IMG_0001.JPG"):
+        resp = self.client.post(
+            reverse("uploadsession-list"),
+            {
+                "entry": (entry or self.entry).id,
+                "filename": filename,
+                "content_type": "image/jpeg",
+                "size": len(self.content),
+                "sha256": self.sha256,
+                "chunk_size": 64 * 1024,
+            },
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 201, resp.content)
+        return resp.json()
+
+    def put_chunk(self, session_id, index, checksum=None):
+        data = self.content[index * 64 * 1024 : (index + 1) * 64 * 1024]
+        return self.client.put(
+            reverse("uploadsession-chunk", args=[session_id, index]),
+            data=data,
+            content_type="application/octet-stream",
+            HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(data).hexdigest(),
+        )
+
+    def test_chunks_upload_in_any_order_and_resume(self):
+        session = self.start()
+        self.assertEqual(session["chunk_count"], 3)
+        self.assertEqual(self.put_chunk(session["id"], 2).status_code, 204)
+        resp = self.put_chunk(session["id"], 0, checksum="0" * 64)
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get(reverse("uploadsession-detail", args=[session["id"]]))
+        self.assertEqual(resp.json()["missing"], [0, 1])
+        self.assertEqual(self.put_chunk(session["id"], 1).status_code, 204)
+        self.assertEqual(self.put_chunk(session["id"], 0).status_code, 204)
+        resp = self.client.post(reverse("uploadsession-complete", args=[session["id"]]))
+        self.assertEqual(resp.status_code, 200, resp.content)
+        self.assertEqual(resp.json()["status"], "complete")
+        attachment = self.entry.media.get()
+        self.assertEqual(attachment.asset.sha256, self.sha256)
+        with attachment.asset.file.open("rb") as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_completing_with_missing_chunks_keeps_session_open(self):
+        session = self.start()
+        self.put_chunk(session["id"], 0)
+        resp = self.client.post(reverse("uploadsession-complete", args=[session["id"]]))
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            models.UploadSession.objects.get(pk=session["id"]).status, "open"
+        )
+
+    def test_known_content_is_deduplicated(self):
+        first = self.start()
+        for index in range(3):
+            self.put_chunk(first["id"], index)
+        self.client.post(reverse("uploadsession-complete", args=[first["id"]]))
+        other = models.PhotogrammetryLogEntry.objects.create(
+            site=self.entry.site, date="2024-03-02"
+        )
+        second = self.start(entry=other, filename="copy.jpg")
+        self.assertEqual(second["status"], "complete")
+        self.assertEqual(models.MediaAsset.objects.count(), 1)
+        self.assertEqual(other.media.get().asset, self.entry.media.get().asset)
+
+
+@skipUnless(deepzoom.available(), "Pillow is not installed")
+class DeepZoomTests(TestCase):
+    def setUp(self):
+        from PIL import Image
+
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        User = get_user_model()
+        self.client = APIClient()
+        # force_login: the tile views are plain Django views.
+        self.client.force_login(
+            User.objects.create_user(username="pano", is_staff=True)
+        )
+        self.image = Image.effect_noise((600, 300), 50).convert("RGB")
+        buffer = io.BytesIO()
+        self.image.save(buffer, "PPM")
+        content = buffer.getvalue()
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = Path(self.media_root.name) / media.asset_name(sha256)
+        path.parent.mkdir(parents=True)
+        path.write_bytes(content)
+        asset = models.MediaAsset.objects.create(
+            sha256=sha256, size=len(content), file=media.asset_name(sha256)
+        )
+        site = models.Site.objects.create(site_number="DZ-1")
+        entry = models.PhotogrammetryLogEntry.objects.create(
+            site=site, date="2024-03-01", photo_type=models.PhotoType.GIGAPAN
+        )
+        self.attachment = models.PhotogrammetryMedia.objects.create(
+            entry=entry, asset=asset, filename="pano.ppm"
+        )
+        self.sha256 = sha256
+
+    def test_pyramid_is_built_and_served_with_cache_headers(self):
+        url = reverse("photogrammetrymedia-deepzoom", args=[self.attachment.id])
+        self.assertEqual(self.client.post(url).status_code, 202)
+        call_command("rockart_deepzoom", workers=1, stdout=io.StringIO())
+        info = self.client.get(url).json()
+        self.assertEqual(info["status"], "ready")
+        self.assertEqual((info["width"], info["height"]), (600, 300))
+
+        resp = self.client.get(info["dzi_url"])
+        self.assertIn(b'Width="600"', b"".join(resp.streaming_content))
+        tile_url = reverse("deepzoom-tile", args=[self.sha256, 10, 1, 0, "jpg"])
+        resp = self.client.get(tile_url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("immutable", resp["Cache-Control"])
+        resp = self.client.get(tile_url, HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(resp.status_code, 304)
+
+    def test_strip_built_tiles_match_a_full_image_pyramid(self):
+        from PIL import Image, ImageChops
+
+        output = Path(self.media_root.name) / "check"
+        deepzoom.PyramidBuilder(output, tile_size=128, fmt="png", workers=1).build(
+            media.asset_path(self.attachment.asset)
+        )
+        expected = self.image.reduce(2)
+        tile = Image.open(output / "image_files" / "9" / "1_1.png")
+        self.assertIsNone(
+            ImageChops.difference(
+                tile.convert("RGB"), expected.crop((127, 127, 256, 150))
+            ).getbbox()
+        )
+        # 600px wide: levels 0 (1x1) through 10 (full size).
+        self.assertEqual(len(os.listdir(output / "image_files")), 11)
+
+    def test_multi_strip_tiffs_are_read_by_strips(self):
+        path = Path(self.media_root.name) / "strips.tif"
+        self.image.save(path, tiffinfo={278: 16})  # RowsPerStrip
+        reader = deepzoom.StripReader(path)
+        self.addCleanup(reader.close)
+        self.assertEqual(len(reader.raw), 19)
+        strip = reader.read(40, 150)
+        self.assertEqual(strip.tobytes(), self.image.crop((0, 40, 600, 150)).tobytes())
+        self.assertIsNone(reader._decoded)
+
+    @override_settings(ROCKART_DEEPZOOM_MAX_DECODED_PIXELS=100_000)
+    def test_oversize_compressed_sources_are_refused(self):
+        # Pillow goes by the content, so the asset now holds a 600x300 PNG.
+        self.image.save(media.asset_path(self.attachment.asset), "PNG")
+        dzi, _ = media.request_deep_zoom(self.attachment.asset)
+        media.build_deep_zoom(dzi, workers=1)
+        self.assertEqual(dzi.status, models.DerivativeStatus.FAILED)
+        self.assertIn("uncompressed TIFF", dzi.error)
+
+    @skipUnless(sys.platform == "linux", "ru_maxrss is in kilobytes on Linux")
+    def test_raw_sources_are_built_in_bounded_memory(self):
+        script = (
+            "import resource, sys\n"
+            "from rockart import deepzoom\n"
+            "deepzoom.PyramidBuilder(sys.argv[2], workers=1).build(sys.argv[1])\n"
+            "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)"
+        )
+
+        def peak_memory(height, width=1000):
+            path = Path(self.media_root.name) / f"{height}.ppm"
+            # Written row by row, so the test never holds the image either.
+            with open(path, "wb") as f:
+                f.write(f"P6 {width} {height} 255\n".encode())
+                row = bytes(i % 251 for i in range(width * 3))
+                f.writelines(row for _ in range(height))
+            done = subprocess.run(
+                [sys.executable, "-c", script, str(path), str(path) + "-dz"],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            return int(done.stdout)
+
+        # 8x the rows (48 MB of pixels) needs about the same memory.
+        short, tall = peak_memory(2000), peak_memory(16000)
+        self.assertLess(tall - short, 1000 * 16000 * 3 // 4)
+
+    @override_settings(ROCKART_SENDFILE_HEADER="X-Accel-Redirect")
+    def test_tiles_can_be_handed_to_the_front_end_server(self):
+        dzi, _ = media.request_deep_zoom(self.attachment.asset)
+        media.build_deep_zoom(dzi, workers=1)
+        resp = self.client.get(
+            reverse("deepzoom-tile", args=[self.sha256, 0, 0, 0, "jpg"])
+        )
+        self.assertEqual(
+            resp["X-Accel-Redirect"],
+            f"/protected-media/deepzoom/{self.sha256}/image_files/0/0_0.jpg",
+        )
+
+
+class ThreeDModelTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        User = get_user_model()
+        self.client = APIClient()
+        self.client.force_login(User.objects.create_user(username="sfm", is_staff=True))
+        self.site = models.Site.objects.create(site_number="3D-1")
+        self.panel = models.Panel.objects.create(site=self.site, panel_number=1)
+        self.entry = models.PhotogrammetryLogEntry.objects.create(
+            site=self.site, date="2024-03-01"
+        )
+        # A 160x160 grid of quads.
+        lines = [
+            f"v {x / 16} {y / 16} {(x * y) % 3 / 10}"
+            for y in range(160)
+            for x in range(160)
+        ]
+        lines += [
+            f"f {y * 160 + x + 1} {y * 160 + x + 2} {(y + 1) * 160 + x + 2} {(y + 1) * 160 + x + 1}"
+            for y in range(159)
+            for x in range(159)
+        ]
+        self.source = self.add_media("panel.obj", "\n".join(lines).encode())
+
+    def add_media(self, filename, content):
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = Path(self.media_root.name) / media.asset_name(sha256)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        asset = models.MediaAsset.objects.create(
+            sha256=sha256, size=len(content), file=media.asset_name(sha256)
+        )
+        return models.PhotogrammetryMedia.objects.create(
+            entry=self.entry, asset=asset, filename=filename
+        )
+
+    def test_lod_variants_are_built_and_served_with_ranges(self):
+        resp = self.client.post(
+            reverse("threedmodel-list"),
+            {"entry": self.entry.id, "panel": self.panel.id, "source": self.source.id},
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertEqual(resp.json()["lod_status"], "pending")
+        call_command("rockart_lod", workers=1, stdout=io.StringIO())
+
+        data = self.client.get(
+            reverse("threedmodel-detail", args=[resp.json()["id"]])
+        ).json()
+        self.assertEqual(data["lod_status"], "ready")
+        self.assertEqual((data["kind"], data["vertex_count"]), ("mesh", 25600))
+        counts = [level["vertex_count"] for level in data["levels"]]
+        self.assertEqual(counts, sorted(counts))
+        self.assertLess(counts[-1], 25600)
+
+        url = data["levels"][0]["url"]
+        full = b"".join(self.client.get(url).streaming_content)
+        self.assertTrue(full.startswith(b"ply\n"))
+        resp = self.client.get(url, HTTP_RANGE="bytes=4-9")
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp["Content-Range"], f"bytes 4-9/{len(full)}")
+        self.assertEqual(b"".join(resp.streaming_content), full[4:10])
+        resp = self.client.get(url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(b"".join(resp.streaming_content), full[-5:])
+
+    def test_new_models_are_built_by_the_job_worker(self):
+        resp = self.client.post(
+            reverse("threedmodel-list"),
+            {"entry": self.entry.id, "source": self.source.id},
+            format="json",
+        )
+        model_id = resp.json()["id"]
+        queued = self.client.get(reverse("job-list"), {"key": f"lod:{model_id}"})
+        [job] = queued.json()
+        self.assertEqual((job["kind"], job["status"]), ("lod", "queued"))
+
+        out = io.StringIO()
+        with mock.patch.object(
+            jobs, "set_progress", wraps=jobs.set_progress
+        ) as set_progress:
+            call_command("rockart_worker", once=True, stdout=out)
+        self.assertIn("Ran 1 job(s).", out.getvalue())
+        # Each level renews the lease.
+        fractions = [call.args[1] for call in set_progress.call_args_list]
+        self.assertEqual(len(fractions), len(lod.LOD_CELLS))
+        self.assertEqual(fractions, sorted(fractions))
+        job = self.client.get(reverse("job-detail", args=[job["id"]])).json()
+        self.assertEqual((job["status"], job["progress"]), ("succeeded", 1.0))
+        self.assertEqual(
+            models.ThreeDModel.objects.get(pk=model_id).lod_status, "ready"
+        )
+
+    def test_source_range_requests(self):
+        url = reverse("media-file", args=[self.source.asset.sha256])
+        resp = self.client.get(url, HTTP_RANGE="bytes=0-1")
+        self.assertEqual(b"".join(resp.streaming_content), b"v ")
+        resp = self.client.get(url, HTTP_RANGE=f"bytes={self.source.asset.size}-")
+        self.assertEqual(resp.status_code, 416)
+        resp = self.client.get(url, HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(resp.status_code, 200)
+
+    def test_panel_must_belong_to_the_entry_site(self):
+        other = models.Site.objects.create(site_number="3D-2")
+        panel = models.Panel.objects.create(site=other, panel_number=1)
+        resp = self.client.post(
+            reverse("threedmodel-list"),
+            {"entry": self.entry.id, "panel": panel.id, "source": self.source.id},
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("panel", resp.json())
+
+
+def flaky_job(job):
+    if job.attempts == 1:
+        raise RuntimeError("transient")
+    jobs.set_progress(job, 0.5, "halfway")
+    return {"attempt": job.attempts}
+
+
+def doomed_job(job):
+    raise jobs.JobFailed("bad input")
+
+
+@override_settings(
+    ROCKART_JOB_RETRY_DELAY=0,
+    ROCKART_JOB_HANDLERS={
+        "flaky": "rockart.tests.flaky_job",
+        "doomed": "rockart.tests.doomed_job",
+    },
+)
+class JobQueueTests(TestCase):
+    def test_claiming_is_exclusive_and_keys_deduplicate(self):
+        first = jobs.enqueue("flaky", key="thing:1")
+        self.assertEqual(jobs.enqueue("flaky", key="thing:1"), first)
+        low = jobs.enqueue("flaky")
+        high = jobs.enqueue("flaky", priority=5)
+
+        self.assertEqual(jobs.claim("a"), high)
+        claimed = {jobs.claim("b").pk, jobs.claim("c").pk}
+        self.assertEqual(claimed, {first.pk, low.pk})
+        self.assertIsNone(jobs.claim("d"))
+        self.assertEqual(models.Job.objects.get(pk=high.pk).locked_by, "a")
+
+    def test_failures_are_retried_until_attempts_run_out(self):
+        flaky = jobs.enqueue("flaky")
+        doomed = jobs.enqueue("doomed")
+        with self.assertLogs("rockart.jobs", "ERROR"):
+            self.assertEqual(jobs.work(once=True), 3)
+
+        flaky.refresh_from_db()
+        self.assertEqual((flaky.status, flaky.attempts), ("succeeded", 2))
+        self.assertEqual(flaky.result, {"attempt": 2})
+        doomed.refresh_from_db()
+        self.assertEqual((doomed.status, doomed.attempts), ("failed", 1))
+        self.assertEqual(doomed.error, "bad input")
+
+    def test_expired_leases_are_requeued(self):
+        job = jobs.enqueue("flaky")
+        jobs.claim("crashed")
+        models.Job.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(hours=2)
+        )
+        job = jobs.claim("healthy")
+        self.assertEqual((job.locked_by, job.attempts), ("healthy", 2))
+
+    def test_jobs_api_scopes_and_retries(self):
+        User = get_user_model()
+        staff = User.objects.create_user(username="ops", is_staff=True)
+        viewer = User.objects.create_user(username="viewer")
+        job = jobs.enqueue("doomed", created_by=staff)
+        jobs.work(once=True)
+
+        client = APIClient()
+        client.force_authenticate(viewer)
+        self.assertEqual(client.get(reverse("job-list")).json(), [])
+        client.force_authenticate(staff)
+        resp = client.post(reverse("job-retry", args=[job.pk]))
+        self.assertEqual(resp.json()["status"], "queued")
+        resp = client.post(reverse("job-retry", args=[job.pk]))
+        self.assertEqual(resp.status_code, 409)
+
+
+class SiteReportTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.site = models.Site.objects.create(
+            site_number="RPT-1", project_name="Canyon Survey"
+        )
+        models.RockArtInfo.objects.create(
+            site=self.site, location_type="rock_shelter", previously_recorded=True
+        )
+        self.panel = models.Panel.objects.create(site=self.site, panel_number=1)
+        self.note = models.RockArtNote.objects.create(site=self.site, text="Faded")
+
+    def test_report_is_cached_until_the_site_changes(self):
+        path = report.get_report(self.site.pk)
+        html = path.read_text()
+        self.assertIn("Rock Art Site Record: RPT-1", html)
+        self.assertIn("Rock shelter", html)
+        self.assertIn("RPT-1 - Panel 1", html)
+        # With shards, the change log is read separately.
+        with self.assertNumQueries(1 + shards.sharding_enabled()):
+            self.assertEqual(report.get_report(self.site.pk), path)
+
+        self.panel.overall_shelter_orientation = "NE"
+        self.panel.save()
+        edited = report.get_report(self.site.pk)
+        self.assertNotEqual(edited, path)
+        self.assertFalse(path.exists())
+        # Deletions do not leave an updated_at behind; the change log does.
+        self.note.delete()
+        self.assertNotEqual(report.get_report(self.site.pk), edited)
+
+    def test_report_views(self):
+        User = get_user_model()
+        self.client.force_login(User.objects.create_user(username="reader"))
+        resp = self.client.get(reverse("rockart-report", args=[self.site.pk]))
+        self.assertEqual(resp["Content-Type"], "text/html; charset=utf-8")
+        self.assertIn(b"Canyon Survey", b"".join(resp.streaming_content))
+        resp = self.client.get(reverse("rockart-report", args=[9999]))
+        self.assertEqual(resp.status_code, 404)
+        with mock.patch.object(report, "HTML", None):
+            resp = self.client.get(reverse("rockart-report-pdf", args=[self.site.pk]))
+        self.assertEqual(resp.status_code, 404)
+
+
+class VocabularyCacheTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.pictograph = models.RockArtType.objects.create(name="Pictographs")
+        self.petroglyph = models.RockArtType.objects.create(name="Petroglyphs")
+        self.style = models.RockArtCategory.objects.create(name="Pecos River Style")
+        self.site = models.Site.objects.create(site_number="V-1")
+        self.info = models.RockArtInfo.objects.create(site=self.site)
+
+    def test_snapshot_is_reused_until_a_row_changes(self):
+        vocab.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                vocab.choices(vocab.TYPES),
+                [
+                    (self.pictograph.pk, "Pictographs"),
+                    (self.petroglyph.pk, "Petroglyphs"),
+                ],
+            )
+        self.petroglyph.name = "Petroglyphs (pecked)"
+        self.petroglyph.save()
+        self.assertEqual(
+            vocab.names(vocab.TYPES)[self.petroglyph.pk], "Petroglyphs (pecked)"
+        )
+        self.petroglyph.delete()
+        self.assertEqual(list(vocab.names(vocab.TYPES)), [self.pictograph.pk])
+
+    def test_forms_resolve_vocabularies_from_the_cache(self):
+        vocab.get()
+        with self.assertNumQueries(0):
+            html = str(forms.RockArtInfoForm()["rock_art_types"])
+        self.assertIn("Pictographs", html)
+
+        form = forms.RockArtInfoForm(
+            data={"rock_art_types": [self.petroglyph.pk], "rock_art_categories": []},
+            instance=self.info,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(list(self.info.rock_art_types.all()), [self.petroglyph])
+        form = forms.RockArtInfoForm(instance=self.info)
+        self.assertIn("checked", str(form["rock_art_types"]))
+        form = forms.RockArtInfoForm(data={"rock_art_types": [9999]})
+        self.assertIn("rock_art_types", form.errors)
+
+        attrs = forms.RockArtAttributesForm(
+            data={"rock_art_category": self.style.pk},
+            instance=models.RockArtAttributes(site=self.site),
+        )
+        self.assertTrue(attrs.is_valid(), attrs.errors)
+        self.assertEqual(attrs.save().rock_art_category, self.style)
+
+    def test_edits_by_other_processes_are_validated(self):
+        vocab.get()
+        # Another worker adds a type: its row and version bump commit
+        # without this process's signals running.
+        [cupules] = models.RockArtType.objects.bulk_create(
+            [models.RockArtType(name="Cupules")]
+        )
+        models.VocabularyVersion.objects.update(version=F("version") + 1)
+
+        serializer = serializers.RockArtInfoSerializer(
+            self.info, data={"rock_art_types": [cupules.pk]}, partial=True
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        form = forms.RockArtInfoForm(
+            data={"rock_art_types": [cupules.pk], "rock_art_categories": []},
+            instance=self.info,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(vocab.names(vocab.TYPES)[cupules.pk], "Cupules")
+
+    def test_version_is_stored_in_the_database(self):
+        self.assertEqual(
+            vocab.version(), models.VocabularyVersion.objects.get().version
+        )
+        before = vocab.version()
+        # A restarted process computes the same version.
+        vocab._snapshot = None
+        self.assertEqual(vocab.version(), before)
+        self.style.delete()
+        self.assertEqual(vocab.version(), before + 1)
+
+    def test_serializers_and_graphql_use_the_cache(self):
+        from rockart.graphql.schema import schema
+
+        serializer = serializers.RockArtInfoSerializer(
+            self.info,
+            data={"rock_art_types": [self.pictograph.pk, 9999]},
+            partial=True,
+        )
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("rock_art_types", serializer.errors)
+        serializer = serializers.RockArtInfoSerializer(
+            self.info, data={"rock_art_types": [self.pictograph.pk]}, partial=True
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+        vocab.get()
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(
+                "{ rockArtInfo { rockArtTypes { name } } rockArtTypes { name } }"
+            )
+        self.assertIsNone(result.errors)
+        self.assertEqual(
+            result.data["rockArtInfo"], [{"rockArtTypes": [{"name": "Pictographs"}]}]
+        )
+        self.assertEqual(len(result.data["rockArtTypes"]), 2)
+        self.assertFalse(
+            any('"rockart_rockarttype"."name"' in q["sql"] for q in queries)
+        )
+
+
+@skipUnless(motifs.available(), "NumPy is not installed")
+class MotifMatrixTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.shelter = models.Site.objects.create(site_number="M-1")
+        self.overhang = models.Site.objects.create(site_number="M-2")
+        self.empty = models.Site.objects.create(site_number="M-3")
+        self.inventory = models.AnthropomorphInventory.objects.create(
+            site=self.shelter, frontal=4, headdress=2
+        )
+        models.AnthropomorphInventory.objects.create(site=self.overhang, frontal=1)
+        models.ZoomorphInventory.objects.create(site=self.shelter, feline=3)
+        models.Panel.objects.create(
+            site=self.shelter, panel_number=1, anthropomorphs_final=5
+        )
+        models.Panel.objects.create(
+            site=self.shelter, panel_number=2, anthropomorphs_final=2
+        )
+
+    def test_build_and_vectorized_queries(self):
+        matrix = motifs.build()
+        rows = matrix.select()
+        self.assertEqual(
+            rows.tolist(), [self.shelter.pk, self.overhang.pk, self.empty.pk]
+        )
+        columns = ["frontal", "headdress", "feline", "panel_anthropomorphs"]
+        self.assertEqual(
+            matrix.totals(rows, columns),
+            {"frontal": 5, "headdress": 2, "feline": 3, "panel_anthropomorphs": 7},
+        )
+        self.assertEqual(
+            matrix.sites_with(rows, ["frontal", "feline"]),
+            {
+                "frontal": 2,
+                "feline": 1,
+            },
+        )
+        self.assertEqual(
+            matrix.select(having=["frontal", "feline"]).tolist(), [self.shelter.pk]
+        )
+        self.assertEqual(
+            matrix.select([self.overhang.pk, 99999]).tolist(), [self.overhang.pk]
+        )
+        pairs = matrix.cooccurrence(rows, ["frontal", "feline"])
+        self.assertEqual(pairs["frontal"], {"frontal": 2, "feline": 1})
+
+    def test_saves_update_the_matrix_in_place(self):
+        generation = motifs.build().generation
+        with self.captureOnCommitCallbacks(execute=True):
+            self.inventory.frontal = 10
+            self.inventory.save()
+            models.EnigmaticInventory.objects.create(site=self.empty, spiral=1)
+            self.overhang.delete()
+        matrix = motifs.load()
+        self.assertEqual(matrix.generation, generation)
+        rows = matrix.select()
+        self.assertEqual(rows.tolist(), [self.shelter.pk, self.empty.pk])
+        self.assertEqual(
+            matrix.totals(rows, ["frontal", "spiral"]),
+            {
+                "frontal": 10,
+                "spiral": 1,
+            },
+        )
+
+        # A site id past the allocated rows moves to a bigger generation.
+        with self.captureOnCommitCallbacks(execute=True):
+            far = models.Site.objects.create(pk=motifs.ROW_BLOCK + 1, site_number="M-9")
+            models.ZoomorphInventory.objects.create(site=far, avian=2)
+        matrix = motifs.load()
+        self.assertNotEqual(matrix.generation, generation)
+        self.assertEqual(matrix.select(having=["avian"]).tolist(), [far.pk])
+        self.assertEqual(matrix.totals(matrix.select(), ["frontal"]), {"frontal": 10})
+        # Jaccard reads the persisted 0/1 terms, kept in step with the profiles.
+        self.assertTrue((matrix.binary == (matrix.profile != 0)).all())
+
+    def test_writers_take_turns(self):
+        motifs.build()
+        dropped = threading.Event()
+
+        def drop():
+            motifs.drop_sites([self.shelter.pk])
+            dropped.set()
+
+        with motifs._writing():
+            writer = threading.Thread(target=drop)
+            writer.start()
+            self.assertFalse(dropped.wait(0.2))
+        writer.join()
+        self.assertEqual(
+            motifs.load().select().tolist(), [self.overhang.pk, self.empty.pk]
+        )
+
+    def test_sync_uploads_update_the_matrix(self):
+        motifs.build()
+        client = APIClient()
+        client.force_authenticate(
+            get_user_model().objects.create_user("tablet", is_staff=True)
+        )
+        zoomorphs = models.ZoomorphInventory.objects.get(site=self.shelter)
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = client.post(
+                reverse("sync-upload"),
+                {
+                    "mutations": [
+                        {
+                            "model": "zoomorphinventory",
+                            "op": "update",
+                            "id": zoomorphs.pk,
+                            "version": zoomorphs.version,
+                            "data": {"feline": 7},
+                        }
+                    ]
+                },
+                format="json",
+            )
+        self.assertEqual(len(resp.json()["accepted"]), 1, resp.content)
+        resp = client.get(reverse("motif-analytics"), {"columns": "feline"})
+        self.assertEqual(resp.json()["totals"], {"feline": 7})
+
+    def test_analytics_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user("analyst"))
+        url = reverse("motif-analytics")
+        params = {"columns": "frontal,feline", "has": "frontal", "cooccurrence": "1"}
+
+        # No matrix yet: the request queues one build job instead of building.
+        for _ in range(2):
+            resp = client.get(url, params)
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(resp["Retry-After"], "30")
+        self.assertIsNone(motifs.load())
+        job = models.Job.objects.get(kind="motifs")
+        self.assertEqual(jobs.work(once=True), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.JobStatus.SUCCEEDED)
+        self.assertEqual(job.result["sites"], 3)
+
+        resp = client.get(url, params)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp.json(),
+            {
+                "sites": 2,
+                "totals": {"frontal": 5, "feline": 3},
+                "sites_with": {"frontal": 2, "feline": 1},
+                "cooccurrence": {
+                    "frontal": {"frontal": 2, "feline": 1},
+                    "feline": {"frontal": 1, "feline": 1},
+                },
+            },
+        )
+        resp = client.get(url, {"sites": str(self.empty.pk)})
+        self.assertEqual(resp.json()["sites"], 1)
+        self.assertEqual(set(resp.json()["totals"]), set(motifs.COLUMNS))
+        self.assertEqual(client.get(url, {"columns": "unicorns"}).status_code, 400)
+        self.assertEqual(client.get(url, {"sites": "a,b"}).status_code, 400)
+
+    def test_similar_sites(self):
+        pecos = models.RockArtCategory.objects.create(name="Pecos River Style")
+        painted = models.RockArtType.objects.create(name="Pictographs")
+        twin = models.Site.objects.create(site_number="M-4")
+        models.AnthropomorphInventory.objects.create(site=twin, frontal=5, headdress=2)
+        models.ZoomorphInventory.objects.create(site=twin, feline=2)
+        for site in (self.shelter, twin):
+            info = models.RockArtInfo.objects.create(site=site)
+            info.rock_art_categories.add(pecos)
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user("analyst"))
+        url = reverse("site-similar", args=[self.shelter.pk])
+
+        self.assertEqual(client.get(url).status_code, 503)
+        jobs.work(once=True)
+        resp = client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        results = resp.json()["results"]
+        # The empty site has no profile and is never a match.
+        self.assertEqual([r["site"] for r in results], [twin.pk, self.overhang.pk])
+        self.assertEqual(results[0]["site_number"], "M-4")
+        self.assertGreater(results[0]["score"], 0.95)
+
+        resp = client.get(url, {"metric": "jaccard", "k": 1})
+        # frontal, headdress, feline and the category are shared; the
+        # shelter's panel totals are not part of the profile.
+        self.assertEqual(
+            resp.json()["results"],
+            [{"site": twin.pk, "site_number": "M-4", "score": 1.0}],
+        )
+
+        # Term changes reach the matrix on commit.
+        with self.captureOnCommitCallbacks(execute=True):
+            twin.rock_art.rock_art_types.add(painted)
+        resp = client.get(url, {"metric": "jaccard", "k": 1})
+        self.assertEqual(resp.json()["results"][0]["score"], 0.8)
+        with self.captureOnCommitCallbacks(execute=True):
+            painted.delete()
+        resp = client.get(url, {"metric": "jaccard", "k": 1})
+        self.assertEqual(resp.json()["results"][0]["score"], 1.0)
+
+        self.assertEqual(client.get(url, {"metric": "euclid"}).status_code, 400)
+        self.assertEqual(
+            client.get(reverse("site-similar", args=[9999])).status_code, 404
+        )
+
+
+class BulkDeleteTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        self.style = models.RockArtCategory.objects.create(name="Pecos River Style")
+        self.asset = models.MediaAsset.objects.create(
+            sha256="a" * 64, size=1, file="media/a"
+        )
+        self.retired = [self.make_site(f"OLD-{i}", "Closed Survey") for i in range(3)]
+        self.kept = self.make_site("NEW-1", "Open Survey")
+
+    def make_site(self, number, project):
+        site = models.Site.objects.create(
+            site_number=number, project_name=project, latitude=30.0, longitude=-101.0
+        )
+        info = models.RockArtInfo.objects.create(site=site)
+        info.rock_art_categories.add(self.style)
+        panel = models.Panel.objects.create(site=site, panel_number=1)
+        models.ZoomorphInventory.objects.create(site=site, feline=1)
+        models.RockArtNote.objects.create(site=site, text="Checked")
+        entry = models.PhotogrammetryLogEntry.objects.create(
+            site=site, date="2024-05-01"
+        )
+        media = models.PhotogrammetryMedia.objects.create(
+            entry=entry, asset=self.asset, filename="mesh.obj"
+        )
+        model = models.ThreeDModel.objects.create(
+            entry=entry, source=media, panel=panel
+        )
+        models.ThreeDModelLevel.objects.create(
+            model=model, cells=64, size=1, vertex_count=1, face_count=1
+        )
+        upload = models.UploadSession.objects.create(
+            entry=entry, filename="mesh.obj", size=1, sha256="b" * 64, chunk_size=1
+        )
+        models.UploadChunk.objects.create(
+            session=upload, index=0, size=1, sha256="b" * 64
+        )
+        return site
+
+    def test_deletes_a_project_with_set_based_queries(self):
+        ids = [site.pk for site in self.retired]
+        panel_ids = list(
+            models.Panel.objects.filter(site__in=ids).values_list("pk", flat=True)
+        )
+        with CaptureQueriesContext(connection) as one:
+            bulk.delete_sites(bulk.site_querysets([ids[0]]))
+        with CaptureQueriesContext(connection) as two:
+            counts = bulk.delete_sites(
+                bulk.site_querysets(project_name="Closed Survey")
+            )
+        # The query count does not grow with the number of rows.
+        self.assertEqual(len(one), len(two))
+        self.assertEqual(counts["rockart.Site"], 2)
+        self.assertEqual(counts["rockart.UploadChunk"], 2)
+        self.assertEqual(counts["rockart.RockArtInfo_rock_art_categories"], 2)
+
+        self.assertFalse(models.Site.objects.filter(pk__in=ids).exists())
+        self.assertFalse(models.Panel.objects.filter(site__in=ids).exists())
+        self.assertEqual(models.ThreeDModel.objects.count(), 1)
+        self.assertEqual(models.UploadChunk.objects.count(), 1)
+        self.assertTrue(models.MediaAsset.objects.exists())
+        self.assertEqual(
+            list(self.kept.rock_art.rock_art_categories.all()), [self.style]
+        )
+
+        tombstones = models.ChangeLogEntry.objects.filter(
+            action=models.ChangeAction.DELETE
+        )
+        self.assertEqual(
+            set(tombstones.filter(model="site").values_list("object_id", flat=True)),
+            set(ids),
+        )
+        self.assertEqual(
+            sorted(
+                tombstones.filter(model="panel").values_list("object_id", "site_id")
+            ),
+            sorted(zip(panel_ids, ids)),
+        )
+        changes = sync.changes_since(0, sync.MAX_PAGE_SIZE)["changes"]
+        self.assertIn(
+            {"model": "site", "id": ids[0], "op": "delete"},
+            [{k: c[k] for k in ("model", "id", "op")} for c in changes],
+        )
+
+    def test_clears_tiles_reports_and_the_motif_matrix(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user("viewer"))
+        tile = reverse("tile", args=[0, 0, 0])
+        self.assertEqual(client.get(tile).json()["count"], 4)
+        report_path = report.get_report(self.retired[0].pk)
+        if motifs.available():
+            motifs.build()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk.delete_sites(bulk.site_querysets(project_name="Closed Survey"))
+        self.assertEqual(client.get(tile).json()["count"], 1)
+        self.assertFalse(report_path.parent.exists())
+        if motifs.available():
+            self.assertEqual(motifs.load().select().tolist(), [self.kept.pk])
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command(
+            "rockart_delete_sites",
+            "--project",
+            "Closed Survey",
+            "--noinput",
+            stdout=out,
+        )
+        self.assertIn("rockart.Site: 3", out.getvalue())
+        self.assertEqual(models.Site.objects.count(), 1)
+
+
+class ArchiveTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        cache.clear()
+        self.painted = models.RockArtType.objects.create(name="Pictographs")
+        self.closed = models.Site.objects.create(
+            site_number="ARC-1", project_name="Closed Survey"
+        )
+        info = models.RockArtInfo.objects.create(site=self.closed)
+        info.rock_art_types.add(self.painted)
+        self.panel = models.Panel.objects.create(site=self.closed, panel_number=1)
+        models.RockArtNote.objects.create(site=self.closed, text="Archived note")
+        self.active = models.Site.objects.create(
+            site_number="ACT-1", project_name="Open Survey"
+        )
+        models.Panel.objects.create(site=self.active, panel_number=1)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create_user("archivist", is_staff=True)
+        )
+
+    def archive_closed_project(self):
+        out = io.StringIO()
+        call_command("rockart_archive", "--project", "Closed Survey", stdout=out)
+        return out.getvalue()
+
+    def test_archiving_moves_rows_out_of_the_hot_tables(self):
+        output = self.archive_closed_project()
+        self.assertIn("rockart.Site: 1", output)
+        self.assertIn("rockart.Panel: 1", output)
+        self.assertEqual(list(models.Site.objects.all()), [self.active])
+        self.assertEqual(models.Panel.objects.count(), 1)
+        archived = models.Site.objects.using("archive").get(pk=self.closed.pk)
+        self.assertEqual(archived.site_number, "ARC-1")
+        self.assertEqual(
+            list(archived.rock_art.rock_art_types.values_list("name", flat=True)),
+            ["Pictographs"],
+        )
+        self.assertTrue(
+            models.ChangeLogEntry.objects.filter(
+                model="site", object_id=self.closed.pk, action="delete"
+            ).exists()
+        )
+
+    def test_api_serves_archived_rows_read_only_on_request(self):
+        self.archive_closed_project()
+        sites = reverse("site-list")
+        self.assertEqual(
+            [s["site_number"] for s in self.client.get(sites).json()], ["ACT-1"]
+        )
+        resp = self.client.get(sites, {"include_archived": "1", "expand": "rock_art"})
+        self.assertEqual([s["site_number"] for s in resp.json()], ["ACT-1", "ARC-1"])
+        self.assertEqual(
+            resp.json()[1]["rock_art"]["rock_art_types"], [self.painted.pk]
+        )
+        self.assertEqual(
+            len(
+                self.client.get(reverse("panel-list"), {"include_archived": "1"}).json()
+            ),
+            2,
+        )
+
+        detail = reverse("site-detail", args=[self.closed.pk])
+        self.assertEqual(self.client.get(detail).status_code, 404)
+        resp = self.client.get(detail + "?include_archived=1")
+        self.assertEqual(resp.json()["site_number"], "ARC-1")
+        resp = self.client.patch(
+            detail + "?include_archived=1", {"project_name": "Reopened"}, format="json"
+        )
+        self.assertEqual(resp.status_code, 404)
+
+    def test_async_views_serve_archived_sites_on_request(self):
+        self.archive_closed_project()
+        client = Client()
+        client.force_login(get_user_model().objects.get(username="archivist"))
+        sites = reverse("async-site-list")
+        resp = client.get(sites, {"include_archived": "1"})
+        self.assertEqual([s["site_number"] for s in resp.json()], ["ACT-1", "ARC-1"])
+        detail = reverse("async-site-detail", args=[self.closed.pk])
+        self.assertEqual(client.get(detail).status_code, 404)
+        resp = client.get(detail, {"include_archived": "1"})
+        self.assertEqual(resp.json()["site_number"], "ARC-1")
+
+    def test_graphql_merges_archived_results(self):
+        self.archive_closed_project()
+        url = reverse("graphql-api")
+        query = {"query": "{ sites { siteNumber panels { panelNumber } } }"}
+        resp = self.client.post(url, query, format="json")
+        self.assertEqual(len(resp.json()["data"]["sites"]), 1)
+        resp = self.client.post(url + "?include_archived=1", query, format="json")
+        self.assertEqual(
+            resp.json()["data"]["sites"],
+            [
+                {"siteNumber": "ACT-1", "panels": [{"panelNumber": 1}]},
+                {"siteNumber": "ARC-1", "panels": [{"panelNumber": 1}]},
+            ],
+        )
+        query = {"query": f"{{ site(id: {self.closed.pk}) {{ siteNumber }} }}"}
+        resp = self.client.post(url + "?include_archived=1", query, format="json")
+        self.assertEqual(resp.json()["data"]["site"], {"siteNumber": "ARC-1"})
+
+
+class ShardRoutingTests(SimpleTestCase):
+    @override_settings(ROCKART_SHARDS=["shard_a", "shard_b"])
+    def test_row_ids_name_their_shard(self):
+        span = shards.SHARD_ID_SPAN
+        self.assertEqual(shards.row_database(42), "default")
+        self.assertEqual(shards.row_database(span + 1), "shard_a")
+        self.assertEqual(shards.row_database(2 * span + 7), "shard_b")
+        self.assertEqual(shards.row_database(3 * span), "default")
+        self.assertEqual(
+            shards.group_rows(models.Panel, [1, span + 1, span + 2]),
+            {"default": [1], "shard_a": [span + 1, span + 2]},
+        )
+        # Vocabularies are not sharded.
+        self.assertEqual(
+            shards.group_rows(models.RockArtType, [span + 1]),
+            {"default": [span + 1]},
+        )
+
+    @override_settings(ROCKART_SHARDS=["shard_a"])
+    def test_unsupported_backends_are_rejected(self):
+        with (
+            mock.patch.object(connection, "vendor", "oracle"),
+            self.assertRaises(ImproperlyConfigured),
+        ):
+            shards.check_databases()
+
+
+# Run with a shard configured, e.g.
+# ROCKARTDB_SHARDS="north=/tmp/north.sqlite3" python manage.py test rockart
+@skipUnless(shards.sharding_enabled(), "no shards configured")
+class ShardingTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        cache.clear()
+        self.shard = shards.shard_aliases()[0]
+        shards.assign("North Survey", self.shard)
+        self.painted = models.RockArtType.objects.create(name="Pictographs")
+        self.local = models.Site.objects.create(
+            site_number="LOC-1", project_name="Local Survey"
+        )
+        # Saved instances follow their project or site.
+        self.north = models.Site(
+            site_number="NOR-1",
+            project_name="North Survey",
+            latitude=30,
+            longitude=-100,
+        )
+        self.north.save()
+        info = models.RockArtInfo(site=self.north)
+        info.save()
+        info.rock_art_types.add(self.painted)
+        self.panel = self.north.panels.create(panel_number=1)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create_user("sharder", is_staff=True)
+        )
+
+    def test_assigned_projects_are_stored_in_their_shard(self):
+        self.assertEqual(self.north._state.db, self.shard)
+        self.assertFalse(models.Site.objects.using("default").filter(pk=self.north.pk))
+        self.assertEqual(self.local._state.db, "default")
+        self.assertEqual(self.north.pk, self.local.pk + 1)
+        self.assertEqual(shards.site_database(self.north.pk), self.shard)
+        self.assertGreater(self.panel.pk, shards.SHARD_ID_SPAN)
+        # Vocabulary rows are copied to the shard.
+        info = models.RockArtInfo.objects.using(self.shard).get(site=self.north)
+        self.assertEqual(
+            list(info.rock_art_types.values_list("name", flat=True)), ["Pictographs"]
+        )
+        with self.assertRaises(ValueError):
+            shards.assign("North Survey", "default")
+
+    def test_api_routes_by_site_and_fans_out_lists(self):
+        sites = self.client.get(reverse("site-list")).json()
+        self.assertEqual(sorted(s["site_number"] for s in sites), ["LOC-1", "NOR-1"])
+        sites = self.client.get(reverse("site-list"), {"project_name": "North Survey"})
+        self.assertEqual([s["site_number"] for s in sites.json()], ["NOR-1"])
+        detail = self.client.get(reverse("site-detail", args=[self.north.pk]))
+        self.assertEqual(detail.json()["site_number"], "NOR-1")
+
+        resp = self.client.patch(
+            reverse("panel-detail", args=[self.panel.pk]),
+            {"overall_shelter_orientation": "NE"},
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.panel.refresh_from_db()
+        self.assertEqual(self.panel.overall_shelter_orientation, "NE")
+        resp = self.client.post(
+            reverse("rockartnote-list"),
+            {"site": self.north.pk, "text": "Sharded note"},
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 201, resp.content)
+        note = models.RockArtNote.objects.using(self.shard).get(text="Sharded note")
+        self.assertEqual(shards.row_database(note.pk), self.shard)
+
+    async def test_async_requests_are_routed_without_a_thread(self):
+        shards_seen = []
+
+        async def view(request):
+            shards_seen.append(db_routers.current_shard())
+            return HttpResponse()
+
+        routing = middleware.ShardRoutingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(routing))
+        factory = RequestFactory()
+        await routing(factory.get(reverse("site-detail", args=[self.north.pk])))
+        await routing(factory.get(reverse("site-list")))
+        self.assertEqual(shards_seen, [self.shard, None])
+
+    def test_fanned_out_lists_are_merged_in_order(self):
+        with db_routers.use_shard(self.shard):
+            models.Site.objects.create(
+                site_number="ABC-1",
+                project_name="North Survey",
+                latitude=35,
+                longitude=-100,
+            )
+        models.Site.objects.create(site_number="ZED-1", latitude=30.01, longitude=-100)
+
+        def site_numbers(**params):
+            resp = self.client.get(reverse("site-list"), params)
+            return [site["site_number"] for site in resp.json()]
+
+        self.assertEqual(site_numbers(), ["ABC-1", "LOC-1", "NOR-1", "ZED-1"])
+        self.assertEqual(
+            site_numbers(ordering="-site_number"), ["ZED-1", "NOR-1", "LOC-1", "ABC-1"]
+        )
+        # Each database has its own nearest sites; only the k nearest of
+        # them all are kept.
+        self.assertEqual(site_numbers(near="-100,30", k=2), ["NOR-1", "ZED-1"])
+        query = {"query": "{ sites(near: [-100, 30], k: 2) { siteNumber } }"}
+        resp = self.client.post(reverse("graphql-api"), query, format="json")
+        self.assertEqual(
+            resp.json()["data"]["sites"],
+            [{"siteNumber": "NOR-1"}, {"siteNumber": "ZED-1"}],
+        )
+
+    def test_async_views_read_every_shard(self):
+        client = Client()
+        client.force_login(get_user_model().objects.create_user("async-sharder"))
+        resp = client.get(reverse("async-site-list"))
+        self.assertEqual(
+            [site["site_number"] for site in resp.json()], ["LOC-1", "NOR-1"]
+        )
+        resp = client.get(reverse("async-site-detail", args=[self.north.pk]))
+        self.assertEqual(resp.json()["site_number"], "NOR-1")
+        resp = client.get(reverse("async-site-dossier", args=[self.north.pk]))
+        self.assertEqual(resp.json()["panels"][0]["panel_number"], 1)
+
+    def test_cross_project_reads_visit_every_shard(self):
+        # Outside a request, manager writes need the shard named.
+        with db_routers.use_shard(self.shard):
+            models.Site.objects.create(site_number="NOR-2", project_name="North Survey")
+        query = {"query": "{ sites { siteNumber } }"}
+        resp = self.client.post(reverse("graphql-api"), query, format="json")
+        self.assertEqual(
+            sorted(s["siteNumber"] for s in resp.json()["data"]["sites"]),
+            ["LOC-1", "NOR-1", "NOR-2"],
+        )
+        tile = tiles.build_tile(0, 0, 0)
+        self.assertEqual(tile["count"], 1)
+        self.assertEqual(tile["clusters"][0]["site_id"], self.north.pk)
+        feed = sync.changes_since(0)
+        self.assertIn(
+            ("panel", self.panel.pk),
+            {(change["model"], change["id"]) for change in feed["changes"]},
+        )
+
+    def test_deleting_a_sharded_project(self):
+        out = io.StringIO()
+        call_command(
+            "rockart_delete_sites", "--project", "North Survey", "--noinput", stdout=out
+        )
+        self.assertIn("rockart.Site: 1", out.getvalue())
+        self.assertIn("rockart.Panel: 1", out.getvalue())
+        self.assertFalse(models.Site.objects.using(self.shard).exists())
+        self.assertFalse(models.Panel.objects.using(self.shard).exists())
+        self.assertEqual(list(models.Site.objects.using("default")), [self.local])
+        self.assertTrue(
+            models.ChangeLogEntry.objects.filter(
+                model="site", object_id=self.north.pk, action=models.ChangeAction.DELETE
+            ).exists()
+        )
+        counts = bulk.delete_sites(bulk.site_querysets([self.local.pk]))
+        self.assertEqual(counts["rockart.Site"], 1)
+
+    def test_archiving_a_sharded_project(self):
+        out = io.StringIO()
+        call_command("rockart_archive", "--project", "North Survey", stdout=out)
+        self.assertIn("rockart.Site: 1", out.getvalue())
+        self.assertFalse(models.Site.objects.using(self.shard).exists())
+        self.assertFalse(models.Panel.objects.using(self.shard).exists())
+        archived = models.Site.objects.using("archive").get(pk=self.north.pk)
+        self.assertEqual(archived.site_number, "NOR-1")
+        self.assertEqual(
+            list(archived.rock_art.rock_art_types.values_list("name", flat=True)),
+            ["Pictographs"],
+        )
+        self.assertEqual(list(models.Site.objects.using("default")), [self.local])
+
+
+class SnapshotTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.path = Path(self.root.name)
+        models.RockArtType.objects.create(name="Pictographs")
+        self.site = models.Site.objects.create(
+            site_number="PUB-1", project_name="Canyon Survey"
+        )
+        self.panel = models.Panel.objects.create(site=self.site, panel_number=1)
+        models.Site.objects.create(site_number="PUB-2", project_name="Canyon Survey")
+
+    def publish(self, **kwargs):
+        return snapshot.publish(self.path, workers=1, page_size=1, **kwargs)
+
+    def read(self, relative):
+        return json.loads((self.path / relative).read_text())
+
+    def test_publish_writes_hashed_tree(self):
+        self.assertEqual(self.publish(), (2, 2))
+        index = self.read("index.json")
+        self.assertEqual(index["sites"], 2)
+        self.assertEqual(len(index["pages"]), 2)
+        first = self.read(index["pages"][0])
+        self.assertEqual(first["pages"], 2)
+        [entry] = first["sites"]
+        self.assertEqual(entry["site_number"], "PUB-1")
+        dossier = self.read(entry["dossier"])
+        self.assertEqual(dossier["site"]["site_number"], "PUB-1")
+        self.assertEqual(dossier["panels"][0]["panel_number"], 1)
+        self.assertIn("PUB-1", (self.path / entry["report"]).read_text())
+        data = (self.path / entry["dossier"]).read_bytes()
+        self.assertIn(hashlib.sha256(data).hexdigest()[:16], entry["dossier"])
+        types = self.read(index["vocabularies"]["types"])
+        self.assertEqual([row["name"] for row in types], ["Pictographs"])
+
+    def test_republish_renders_only_changed_sites(self):
+        self.publish()
+        old = self.read(self.read("index.json")["pages"][0])["sites"][0]["dossier"]
+        self.assertEqual(self.publish(), (0, 2))
+
+        self.panel.height_m = 2.5
+        self.panel.save()
+        self.assertEqual(self.publish(), (1, 2))
+        new = self.read(self.read("index.json")["pages"][0])["sites"][0]["dossier"]
+        self.assertNotEqual(new, old)
+        self.assertFalse((self.path / old).exists())
+        self.assertEqual(self.read(new)["panels"][0]["height_m"], 2.5)
+
+        self.assertEqual(self.publish(full=True), (2, 2))
+
+    def test_new_process_skips_unchanged_sites(self):
+        self.publish()
+        # A fresh process: empty cache and no vocabulary snapshot.
+        cache.clear()
+        vocab._snapshot = None
+        self.assertEqual(self.publish(), (0, 2))
+        with override_settings(MEDIA_ROOT=self.root.name):
+            path = report.get_report(self.site.pk)
+            cache.clear()
+            vocab._snapshot = None
+            self.assertEqual(report.get_report(self.site.pk), path)
+
+    def test_deleted_sites_are_unpublished(self):
+        self.publish()
+        site_id = self.site.pk
+        self.site.delete()
+        out = io.StringIO()
+        call_command(
+            "publish_snapshot", "--output", self.root.name, "--workers", "1", stdout=out
+        )
+        self.assertIn("Rendered 0 of 1 sites", out.getvalue())
+        self.assertFalse((self.path / "sites" / str(site_id)).exists())
+        self.assertEqual(len(list((self.path / "indexes").iterdir())), 1)
+
+
+class ConsistencyTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.site = models.Site.objects.create(site_number="CHK-1")
+        models.Panel.objects.create(
+            site=self.site,
+            panel_number=1,
+            height_m=2,
+            width_m=3,
+            area_m2=6,
+            anthropomorphs_final=3,
+            zoomorphs_final=2,
+        )
+        models.Panel.objects.create(
+            site=self.site, panel_number=2, zoomorphs_final=1, area_m2=1.5
+        )
+        models.AnthropomorphInventory.objects.create(site=self.site, frontal=3)
+        models.ZoomorphInventory.objects.create(site=self.site, feline=1, avian=2)
+
+    def issues(self, rule):
+        report = consistency.check([rule], workers=1, chunk_size=1)
+        self.assertEqual(report["totals"], {rule: len(report["issues"])})
+        return report["issues"]
+
+    def test_consistent_site_has_no_issues(self):
+        report = consistency.check(workers=1)
+        self.assertEqual(report["sites"], 1)
+        self.assertEqual(report["issues"], [])
+        self.assertEqual(
+            report["totals"], {"figure_counts": 0, "panel_area": 0, "orphaned_rows": 0}
+        )
+
+    def test_figure_count_mismatches(self):
+        models.AnthropomorphInventory.objects.filter(site=self.site).update(mask=4)
+        models.ZoomorphInventory.objects.filter(site=self.site).update(snakes=1)
+        models.EnigmaticInventory.objects.create(site=self.site, grid=2)
+        issues = {issue["model"]: issue for issue in self.issues("figure_counts")}
+        self.assertEqual(
+            issues["rockart.AnthropomorphInventory"]["fields"], {"mask": 4}
+        )
+        zoomorphs = issues["rockart.ZoomorphInventory"]
+        self.assertEqual((zoomorphs["inventory"], zoomorphs["panels"]), (4, 3))
+        self.assertEqual(issues["rockart.EnigmaticInventory"]["panels"], 0)
+
+    def test_figures_without_an_inventory(self):
+        site = models.Site.objects.create(site_number="CHK-2")
+        models.Panel.objects.create(site=site, panel_number=1, enigmatics_final=2)
+        [issue] = self.issues("figure_counts")
+        self.assertEqual(
+            (issue["model"], issue["id"], issue["site"], issue["panels"]),
+            ("rockart.EnigmaticInventory", None, site.pk, 2),
+        )
+
+    def test_panel_area_and_orphaned_rows(self):
+        panel = self.site.panels.get(panel_number=1)
+        panel.area_m2 = 7
+        panel.save()
+        orphan = models.Panel.objects.create(site_id=self.site.pk + 5, panel_number=1)
+        # SQLite checks foreign keys at commit; remove it before the test ends.
+        self.addCleanup(models.Panel.objects.filter(pk=orphan.pk).delete)
+
+        [area] = self.issues("panel_area")
+        self.assertEqual((area["id"], area["area_m2"]), (panel.pk, 7))
+        [row] = self.issues("orphaned_rows")
+        self.assertEqual((row["model"], row["id"]), ("rockart.Panel", orphan.pk))
+
+    def test_command_writes_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "report.json"
+            out = io.StringIO()
+            call_command(
+                "check_rockart_consistency",
+                "--output",
+                str(path),
+                "--rule",
+                "panel_area",
+                "--workers",
+                "1",
+                stdout=out,
+            )
+            report = json.loads(path.read_text())
+        self.assertEqual(report["rules"], ["panel_area"])
+        self.assertIn("Checked 1 sites: panel_area 0.", out.getvalue())
+
+
+class CompressedTextTests(TestCase):
+    databases = "__all__"
+
+    NARRATIVE = "Red pictographs of anthropomorphs along the shelter wall. " * 20
+
+    def setUp(self):
+        user = get_user_model().objects.create_user("reader", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.site = models.Site.objects.create(
+            site_number="TXT-1", project_description=self.NARRATIVE
+        )
+        self.note = models.RockArtNote.objects.create(
+            site=self.site, text=self.NARRATIVE
+        )
+
+    def test_text_is_stored_compressed_and_read_lazily(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT text FROM rockart_rockartnote WHERE id = %s", [self.note.pk]
+            )
+            [(stored,)] = cursor.fetchall()
+        self.assertEqual(stored[:1], fields.ZLIB)
+        self.assertLess(len(stored), len(self.NARRATIVE) // 4)
+
+        note = models.RockArtNote.objects.get(pk=self.note.pk)
+        self.assertIsInstance(note.__dict__["text"], fields.CompressedText)
+        self.assertEqual(note.text, self.NARRATIVE)
+        self.assertEqual(note.__dict__["text"], self.NARRATIVE)
+
+    def test_untouched_text_is_not_compressed_again(self):
+        note = models.RockArtNote.objects.get(pk=self.note.pk)
+        note.author = "Field crew"
+        with mock.patch("rockart.fields.compress") as compress:
+            note.save()
+        compress.assert_not_called()
+        note.refresh_from_db()
+        self.assertEqual(note.text, self.NARRATIVE)
+
+    def test_search_sees_plain_text(self):
+        other = models.RockArtNote.objects.create(site=self.site, text="Burial cist")
+        url = reverse("rockartnote-list")
+        resp = self.client.get(url, {"search": "pictograph"})
+        self.assertEqual([row["id"] for row in resp.json()], [self.note.pk])
+        self.assertEqual(resp.json()[0]["text"], self.NARRATIVE)
+
+        other.text = "Pictographs above a burial cist"
+        other.save()
+        resp = self.client.get(url, {"search": "burial pictographs"})
+        self.assertEqual([row["id"] for row in resp.json()], [other.pk])
+
+        other.delete()
+        self.assertFalse(models.RockArtNote.objects.filter(text__search="burial"))
+
+    def test_site_list_renders_description(self):
+        resp = self.client.get(reverse("site-list"))
+        self.assertEqual(resp.json()[0]["project_description"], self.NARRATIVE)
@@ -0,0 +1,217 @@
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from rockart import geo, shards, vocab
+from rockart.db_routers import use_shard
+from rockart.models import RockArtInfo, Site
+
+MAX_ZOOM = 20
+# Each tile is split into CLUSTER_GRID x CLUSTER_GRID cells; the sites in
+# a cell form one cluster.
+CLUSTER_GRID = 16
+MAX_MERCATOR_LAT = 85.0511287798
+
+GENERATION_KEY = "rockart:tiles:generation"
+
+
+def _timeout():
+    return getattr(settings, "ROCKART_TILE_CACHE_SECONDS", 24 * 60 * 60)
+
+
+def _mercator_y(lat):
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    rad = math.radians(lat)
+    return (1 - math.log(math.tan(rad) + 1 / math.cos(rad)) / math.pi) / 2
+
+
+def _mercator_lat(y):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+def tile_position(lat, lon, z):
+    """
+    Fractional tile coordinates of a point at zoom z.
+    """
+    n = 2**z
+    x = (lon + 180) / 360 * n
+    y = _mercator_y(lat) * n
+    return min(x, n - 1e-9), min(y, n - 1e-9)
+
+
+def tile_for(lat, lon, z):
+    x, y = tile_position(lat, lon, z)
+    return int(x), int(y)
+
+
+def tile_bounds(z, x, y):
+    """
+    (min_lon, min_lat, max_lon, max_lat) of a tile. The top and bottom rows
+    extend to the poles so every site lands in some tile.
+    """
+    n = 2**z
+    min_lon = x / n * 360 - 180
+    max_lon = (x + 1) / n * 360 - 180
+    max_lat = 90.0 if y == 0 else _mercator_lat(y / n)
+    min_lat = -90.0 if y == n - 1 else _mercator_lat((y + 1) / n)
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def _generation():
+    # Clusters list category names, so a vocabulary edit also moves every
+    # tile to a new key.
+    return f"{cache.get_or_set(GENERATION_KEY, 1, None)}.{vocab.get().version}"
+
+
+def _cache_key(generation, z, x, y):
+    return f"rockart:tile:{generation}:{z}:{x}:{y}"
+
+
+def build_tile(z, x, y):
+    """
+    Cluster the sites of one tile on a CLUSTER_GRID grid.
+
+    Candidate rows come from the spatial index (see rockart.geo); rows on a
+    shared edge are kept only by the tile that owns them.
+    """
+    cells = defaultdict(list)
+    location_types = {}
+    categories = defaultdict(list)
+    names = vocab.names(vocab.CATEGORIES)
+    through = RockArtInfo.rock_art_categories.through
+    for database in shards.site_databases():
+        with use_shard(database):
+            queryset = geo.filter_bbox(Site.objects.all(), *tile_bounds(z, x, y))
+            found = []
+            for pk, lat, lon in queryset.values_list("pk", "latitude", "longitude"):
+                fx, fy = tile_position(lat, lon, z)
+                if (int(fx), int(fy)) != (x, y):
+                    continue
+                cell = (int((fx - x) * CLUSTER_GRID), int((fy - y) * CLUSTER_GRID))
+                cells[cell].append((pk, lat, lon))
+                found.append(pk)
+            location_types.update(
+                RockArtInfo.objects.filter(site_id__in=found).values_list(
+                    "site_id", "location_type"
+                )
+            )
+            for site_id, category_id in through.objects.filter(
+                rockartinfo__site_id__in=found
+            ).values_list("rockartinfo__site_id", "rockartcategory_id"):
+                if category_id in names:
+                    categories[site_id].append(names[category_id])
+
+    site_ids = [pk for members in cells.values() for pk, _, _ in members]
+
+    clusters = []
+    for _, members in sorted(cells.items()):
+        cluster = {
+            "count": len(members),
+            "latitude": sum(lat for _, lat, _ in members) / len(members),
+            "longitude": sum(lon for _, _, lon in members) / len(members),
+            "location_types": dict(
+                Counter(
+                    location_types[pk] for pk, _, _ in members if pk in location_types
+                )
+            ),
+            "categories": dict(
+                Counter(name for pk, _, _ in members for name in categories[pk])
+            ),
+        }
+        if len(members) == 1:
+            cluster["site_id"] = members[0][0]
+        clusters.append(cluster)
+    return {
+        "z": z,
+        "x": x,
+        "y": y,
+        "bounds": list(tile_bounds(z, x, y)),
+        "count": len(site_ids),
+        "clusters": clusters,
+    }
+
+
+def get_tile(z, x, y):
+    key = _cache_key(_generation(), z, x, y)
+    tile = cache.get(key)
+    if tile is None:
+        tile = build_tile(z, x, y)
+        cache.set(key, tile, _timeout())
+    return tile
+
+
+def invalidate_positions(*positions, using=None):
+    """
+    Drop the cached tiles, at every zoom, that contain any of the given
+    (latitude, longitude) positions; unset positions are ignored. The
+    tiles are dropped once the transaction on ``using`` commits, so a read
+    in between cannot cache them again from the old rows.
+    """
+    positions = {
+        position for position in positions if position and None not in position
+    }
+    if positions:
+        transaction.on_commit(lambda: _drop_tiles(positions), using=using)
+
+
+def _drop_tiles(positions):
+    generation = _generation()
+    cache.delete_many(
+        [
+            _cache_key(generation, z, *tile_for(lat, lon, z))
+            for lat, lon in positions
+            for z in range(MAX_ZOOM + 1)
+        ]
+    )
+
+
+def invalidate_sites(site_ids, using=None):
+    """
+    Drop the tiles showing these sites, e.g. after their rock art changed.
+    """
+    invalidate_positions(
+        *(
+            position
+            for database, ids in shards.group_sites(site_ids).items()
+            for position in Site.objects.using(database)
+            .filter(pk__in=ids)
+            .values_list("latitude", "longitude")
+        ),
+        using=using,
+    )
+
+
+def invalidate_instance(instance, previous_position=None):
+    """
+    Drop the tiles a saved or deleted Site or RockArtInfo shows up in.
+    """
+    using = instance._state.db
+    if isinstance(instance, Site):
+        # Both positions: a moved site leaves one tile and enters another.
+        invalidate_positions(
+            previous_position, (instance.latitude, instance.longitude), using=using
+        )
+    elif isinstance(instance, RockArtInfo):
+        invalidate_sites([instance.site_id], using=using)
+
+
+def invalidate_all(using=None):
+    """
+    Start a new cache generation, e.g. after a bulk import, once the
+    transaction on ``using`` commits.
+    """
+    transaction.on_commit(_next_generation, using=using)
+
+
+def _next_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, None)
@@ -34,5 +34,12 @@ urlpatterns = [
         name="rockart-photogrammetry",
     ),
     path("sites/<int:site_id>/notes/", views.notes_view, name="rockart-notes"),
+    path("sites/<int:site_id>/report/", views.site_report, name="rockart-report"),
+    path(
+        "sites/<int:site_id>/report.pdf",
+        views.site_report,
+        {"fmt": "pdf"},
+        name="rockart-report-pdf",
+    ),
     path("profile/", views.profile, name="rockart-profile"),
 ]
@@ -1,7 +1,8 @@
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseForbidden
+from django.http import Http404, HttpResponseForbidden
 from django.shortcuts import get_object_or_404, redirect, render
 
+from . import fileserve, report, shards
 from .forms import (
     AnthropomorphInventoryForm,
     EnigmaticInventoryForm,
@@ -32,7 +33,8 @@ from .models import (
 
 @login_required
 def site_select(request):
-    sites = Site.objects.all().order_by("site_number")
+    sites = shards.across(Site.objects.all())
+    sites.sort(key=lambda site: site.site_number)
     return render(
         request,
         "rockart/site_select.html",
@@ -60,6 +62,24 @@ def profile(request):
     return render(request, "rockart/profile.html", {"site": None})
 
 
+@login_required
+def site_report(request, site_id, fmt="html"):
+    """
+    The whole site record as one printable document, served from the
+    report cache while the site is unchanged.
+    """
+    try:
+        path = report.get_report(site_id, fmt)
+    except Site.DoesNotExist:
+        raise Http404("Site not found.")
+    except report.ReportUnavailable as exc:
+        raise Http404(str(exc))
+    response = fileserve.serve_file(request, path, report.CONTENT_TYPES[fmt])
+    if fmt == "pdf":
+        response["Content-Disposition"] = f'inline; filename="site-{site_id}.pdf"'
+    return response
+
+
 @login_required
 def project_info(request, site_id):
     site = get_object_or_404(Site, pk=site_id)
@@ -72,7 +92,7 @@ def project_info(request, site_id):
     return render(
         request,
         "rockart/project_info.html",
-        {"form": form, "site": site, "active_tab": "project", "site_form": SiteForm()},
+        {"form": form, "site": site, "active_tab": "project"},
     )
 
 
@@ -89,7 +109,7 @@ def rock_art(request, site_id):
     return render(
         request,
         "rockart/rock_art.html",
-        {"form": form, "site": site, "active_tab": "rockart", "site_form": SiteForm()},
+        {"form": form, "site": site, "active_tab": "rockart"},
     )
 
 
@@ -113,7 +133,6 @@ def panel_view(request, site_id):
             "panels": panels,
             "site": site,
             "active_tab": "panel",
-            "site_form": SiteForm(),
         },
     )
 
@@ -135,7 +154,6 @@ def conditions_view(request, site_id):
             "form": form,
             "site": site,
             "active_tab": "conditions",
-            "site_form": SiteForm(),
         },
     )
 
@@ -157,7 +175,6 @@ def attributes_view(request, site_id):
             "form": form,
             "site": site,
             "active_tab": "attributes",
-            "site_form": SiteForm(),
         },
     )
 
@@ -179,7 +196,6 @@ def inventory_anthro_view(request, site_id):
             "form": form,
             "site": site,
             "active_tab": "inv-anthro",
-            "site_form": SiteForm(),
         },
     )
 
@@ -220,7 +236,6 @@ def inventory_continued_view(request, site_id):
             "general_form": general_form,
             "site": site,
             "active_tab": "inv-continued",
-            "site_form": SiteForm(),
         },
     )
 
@@ -245,7 +260,6 @@ def photogrammetry_view(request, site_id):
             "entries": entries,
             "site": site,
             "active_tab": "photo",
-            "site_form": SiteForm(),
         },
     )
 
@@ -270,6 +284,5 @@ def notes_view(request, site_id):
             "notes": notes,
             "site": site,
             "active_tab": "notes",
-            "site_form": SiteForm(),
         },
     )
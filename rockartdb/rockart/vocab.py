@@ -0,0 +1,122 @@
+"""
+Per-process cache of the RockArtType and RockArtCategory vocabularies.
+
+Every process keeps an {id: name} snapshot of both tables stamped with the
+version it was loaded at. The version is a counter on the primary database
+(VocabularyVersion) bumped in the same transaction as every vocabulary
+save or delete (see rockart.signals), so all workers see an edit once it
+commits. Reads trust a snapshot whose version was checked in the last
+RECHECK_SECONDS; validation (fresh=True) checks it every time, at the cost
+of one query. Bulk updates that bypass signals must call invalidate().
+"""
+
+import threading
+import time
+
+from django.db import router
+from django.db.models import F
+
+from rockart.models import RockArtCategory, RockArtType, VocabularyVersion
+
+# How long reads may serve a snapshot without checking the version again.
+RECHECK_SECONDS = 1.0
+
+TYPES = "types"
+CATEGORIES = "categories"
+MODELS = {TYPES: RockArtType, CATEGORIES: RockArtCategory}
+VOCABULARIES = {model: name for name, model in MODELS.items()}
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+class Snapshot:
+    def __init__(self, version, names):
+        self.version = version
+        self.names = names
+        self.checked_at = time.monotonic()
+
+    def choices(self, vocabulary):
+        """
+        (id, name) pairs in id order, as form choices.
+        """
+        return list(self.names[vocabulary].items())
+
+    def instance(self, vocabulary, pk):
+        """
+        A model instance for ``pk`` built from the snapshot, enough to
+        assign to or add to a relation, or None when there is no such row.
+        """
+        name = self.names[vocabulary].get(pk)
+        if name is None:
+            return None
+        model = MODELS[vocabulary]
+        obj = model(pk=pk, name=name)
+        obj._state.adding = False
+        obj._state.db = router.db_for_write(model)
+        return obj
+
+
+def _versions():
+    # Read and bumped on the primary, never on a replica.
+    return VocabularyVersion.objects.using(router.db_for_write(VocabularyVersion))
+
+
+def version():
+    """
+    The current vocabulary version.
+    """
+    return _versions().filter(pk=1).values_list("version", flat=True).first() or 0
+
+
+def invalidate():
+    """
+    Bump the version, so every process reloads the vocabularies once the
+    current transaction commits.
+    """
+    global _snapshot
+    if not _versions().filter(pk=1).update(version=F("version") + 1):
+        _versions().get_or_create(pk=1, defaults={"version": 1})
+    _snapshot = None
+
+
+def _load(current):
+    names = {}
+    for vocabulary, model in MODELS.items():
+        # Read from the primary: a lagging replica would pin stale names
+        # to the new version.
+        queryset = model.objects.using(router.db_for_write(model))
+        names[vocabulary] = dict(queryset.order_by("pk").values_list("pk", "name"))
+    return Snapshot(current, names)
+
+
+def get(fresh=False):
+    """
+    The current snapshot, reloaded when the version has moved. Without
+    ``fresh`` the version is only read again after RECHECK_SECONDS.
+    """
+    global _snapshot
+    snapshot = _snapshot
+    now = time.monotonic()
+    if (
+        not fresh
+        and snapshot is not None
+        and now - snapshot.checked_at < RECHECK_SECONDS
+    ):
+        return snapshot
+    current = version()
+    if snapshot is None or snapshot.version != current:
+        with _lock:
+            if _snapshot is None or _snapshot.version != current:
+                _snapshot = _load(current)
+            snapshot = _snapshot
+    snapshot.checked_at = now
+    return snapshot
+
+
+def names(vocabulary):
+    return get().names[vocabulary]
+
+
+def choices(vocabulary):
+    return get().choices(vocabulary)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -50,6 +51,8 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "rockart.middleware.ReplicaRoutingMiddleware",
+    "rockart.middleware.ShardRoutingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -84,6 +87,69 @@ DATABASES = {
     }
 }
 
+# Optional read replica for safe-method requests and GraphQL queries. Point
+# ROCKARTDB_REPLICA_NAME at a second SQLite file (kept in sync externally) or
+# swap in a Postgres replica; see rockart.db_routers.
+if os.environ.get("ROCKARTDB_REPLICA_NAME"):
+    DATABASES["replica"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ["ROCKARTDB_REPLICA_NAME"],
+        "TEST": {"MIRROR": "default"},
+    }
+
+# Cold storage for closed projects (manage.py rockart_archive), served
+# read-only with ?include_archived=1. Create its tables with
+# manage.py migrate --database archive.
+DATABASES["archive"] = {
+    "ENGINE": "django.db.backends.sqlite3",
+    "NAME": os.environ.get("ROCKARTDB_ARCHIVE_NAME", BASE_DIR / "archive.sqlite3"),
+}
+
+# Optional per-project shards (see rockart.shards):
+# ROCKARTDB_SHARDS="name=/path/name.sqlite3,..." adds a "shard_<name>"
+# database per entry. Only append to the list: its order numbers the
+# shards. Create their tables with manage.py rockart_shards migrate.
+ROCKART_SHARDS = []
+for _entry in filter(None, os.environ.get("ROCKARTDB_SHARDS", "").split(",")):
+    _name, _, _path = _entry.strip().partition("=")
+    DATABASES[f"shard_{_name}"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": _path or BASE_DIR / f"shard_{_name}.sqlite3",
+    }
+    ROCKART_SHARDS.append(f"shard_{_name}")
+
+DATABASE_ROUTERS = [
+    "rockart.db_routers.ShardRouter",
+    "rockart.db_routers.ReadReplicaRouter",
+]
+
+# Seconds a user reads from the primary after a write.
+ROCKART_REPLICA_PIN_SECONDS = 10
+
+# Lifetime of cached map tiles; edits invalidate the affected tiles earlier.
+ROCKART_TILE_CACHE_SECONDS = 24 * 60 * 60
+
+# Map tiles, their generation and replica pins are invalidated through the
+# cache, so every worker process has to share it. Django's default cache is
+# per process and only suits a single one (runserver). Set
+# ROCKARTDB_CACHE_URL to redis://host:port/db (needs the redis package) or
+# to a directory for a file-based cache shared by the workers of one host.
+_cache_url = os.environ.get("ROCKARTDB_CACHE_URL")
+if _cache_url and _cache_url.startswith(("redis://", "rediss://", "unix://")):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": _cache_url,
+        }
+    }
+elif _cache_url:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": _cache_url,
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -121,6 +187,36 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Uploaded media (photogrammetry image sets). Stored content-addressed under
+# MEDIA_ROOT/assets; in-progress chunked uploads live in MEDIA_ROOT/uploads.
+MEDIA_URL = "media/"
+MEDIA_ROOT = Path(os.environ.get("ROCKARTDB_MEDIA_ROOT", BASE_DIR / "media"))
+
+# Static catalogue written by manage.py publish_snapshot (see rockart.snapshot).
+ROCKART_SNAPSHOT_ROOT = Path(
+    os.environ.get("ROCKARTDB_SNAPSHOT_ROOT", MEDIA_ROOT / "snapshot")
+)
+
+ROCKART_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+ROCKART_UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Let the front-end server deliver media files: "X-Accel-Redirect" (nginx,
+# with an internal location for ROCKART_SENDFILE_URL aliased to MEDIA_ROOT)
+# or "X-Sendfile" (Apache, lighttpd). None streams them from Django.
+ROCKART_SENDFILE_HEADER = os.environ.get("ROCKARTDB_SENDFILE_HEADER") or None
+ROCKART_SENDFILE_URL = "/protected-media/"
+
+# Background jobs (manage.py rockart_worker). A running job whose worker has
+# not reported for a lease is handed to another worker; failures are retried
+# after ROCKART_JOB_RETRY_DELAY seconds, doubling each attempt.
+ROCKART_JOB_LEASE_SECONDS = 60 * 60
+ROCKART_JOB_RETRY_DELAY = 30
+# Processes a single deep zoom or LOD job may use on top of the worker pool.
+ROCKART_DERIVATIVE_WORKERS = 1
+# JPEG, PNG and other compressed panoramas are decoded whole for deep zoom;
+# larger ones fail and need converting to an uncompressed TIFF first.
+ROCKART_DEEPZOOM_MAX_DECODED_PIXELS = 50_000_000
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -143,6 +239,10 @@ SPECTACULAR_SETTINGS = {
 
 GRAPHENE = {
     "SCHEMA": "rockart.graphql.schema.schema",
+    # graphene-django adds its debug middleware when DEBUG is on; without a
+    # DjangoDebug field in the schema it wraps every connection's cursor
+    # and never unwraps it.
+    "MIDDLEWARE": [],
 }
 
 LOGIN_URL = "/accounts/login/"